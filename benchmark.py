@@ -0,0 +1,298 @@
+"""Time wit commands on generated repositories of increasing size, and compare two runs.
+
+Usage:
+    python benchmark.py run [--files 100,1000,10000] [--depth N] [--history N] [--branches N]
+                            [--median-size BYTES] [--size-sigma S] [--max-size BYTES] [--large-size BYTES]
+                            [--repeat N] [--seed N] [--jobs N] [--output results.json] [--plot curves.png]
+    python benchmark.py compare <old.json> <new.json> [--threshold 0.1]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List, NamedTuple
+
+import layout_funcs
+import repository_funcs
+import utilities
+
+
+RESULTS_VERSION = 1
+OPERATIONS = ('init', 'add', 'commit', 'status', 'status_dirty', 'checkout', 'merge', 'graph',
+              'commit_large', 'commit_large_edit')
+FILES_PER_DIRECTORY = 20
+CHANGED_FRACTION = 0.01
+LARGE_BLOCK = 1 << 20
+# Differences below this many seconds are noise, whatever their ratio.
+MIN_REGRESSION = 0.005
+
+
+class Scale(NamedTuple):
+    """Shape of a generated repository."""
+    files: int
+    depth: int
+    history: int
+    branches: int
+    median_size: int
+    size_sigma: float
+    max_size: int
+    large_size: int = 0
+
+
+class Generator:
+    """Reproducible random content for a repository of shape `scale`."""
+
+    def __init__(self, root: str, scale: Scale, seed: int) -> None:
+        self.root = root
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.paths: List[str] = []
+
+    def get_size(self) -> int:
+        """Return a file size drawn from a log-normal distribution around the median size."""
+        size = self.random.lognormvariate(math.log(self.scale.median_size), self.scale.size_sigma)
+        return min(self.scale.max_size, int(size))
+
+    def write(self, rel_path: str) -> None:
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file_handler:
+            file_handler.write(self.random.randbytes(self.get_size()))
+
+    def write_large(self, rel_path: str) -> None:
+        """Write a file of `scale.large_size` bytes, a block at a time."""
+        with open(os.path.join(self.root, rel_path), 'wb') as file_handler:
+            for offset in range(0, self.scale.large_size, LARGE_BLOCK):
+                file_handler.write(self.random.randbytes(min(LARGE_BLOCK, self.scale.large_size - offset)))
+
+    def edit_large(self, rel_path: str) -> None:
+        """Overwrite a few bytes in the middle of the large file."""
+        with open(os.path.join(self.root, rel_path), 'r+b') as file_handler:
+            file_handler.seek(self.scale.large_size // 2)
+            file_handler.write(self.random.randbytes(16))
+
+    def populate(self) -> None:
+        """Write `scale.files` files spread over directories `scale.depth` levels deep."""
+        directories = max(1, self.scale.files // FILES_PER_DIRECTORY)
+        width = max(1, round(directories ** (1 / self.scale.depth))) if self.scale.depth else 1
+        for number in range(self.scale.files):
+            parts = [f'dir{self.random.randrange(width)}' for _ in range(self.scale.depth)]
+            rel_path = os.path.join(*parts, f'file{number}.bin')
+            self.write(rel_path)
+            self.paths.append(rel_path)
+
+    def modify(self) -> List[str]:
+        """Rewrite a small random sample of the files and return their paths."""
+        count = max(1, int(len(self.paths) * CHANGED_FRACTION))
+        changed = self.random.sample(self.paths, count)
+        for rel_path in changed:
+            self.write(rel_path)
+        return changed
+
+
+def measure(timings: Dict[str, float], operation: str, function: Callable[[], object]) -> None:
+    start = time.perf_counter()
+    function()
+    timings[operation] = time.perf_counter() - start
+
+
+def commit_changes(repository: 'repository_funcs.Repository', generator: Generator, message: str) -> None:
+    repository.add_many(generator.modify())
+    repository.commit(message)
+
+
+def draw_graph(wit_dir: str) -> None:
+    # Imported here so that the benchmark runs without the plotting libraries; `graph` is then skipped.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import graph_funcs
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        graph_funcs.draw_graph(*layout_funcs.get_positions(wit_dir, all_commits=True), wit_dir, output=os.devnull)
+    plt.close('all')
+
+
+def run_scenario(scale: Scale, seed: int) -> Dict[str, float]:
+    """Build a repository of shape `scale` in a temporary directory and return the time taken by each operation.
+    Setup steps between the timed operations, like building commit history, are not timed."""
+    timings: Dict[str, float] = {}
+    root = tempfile.mkdtemp(prefix='wit-benchmark-')
+    old_cwd = os.getcwd()
+    try:
+        os.chdir(root)
+        generator = Generator(root, scale, seed)
+        generator.populate()
+        measure(timings, 'init', lambda: repository_funcs.Repository.init(root))
+        repository = repository_funcs.Repository(root)
+        top_level = sorted(name for name in os.listdir(root) if name != '.wit')
+        measure(timings, 'add', lambda: repository.add_many(top_level))
+        measure(timings, 'commit', lambda: repository.commit('initial'))
+
+        for number in range(scale.history):
+            commit_changes(repository, generator, f'history {number}')
+        for number in range(scale.branches):
+            repository.branch(f'branch{number}')
+            repository.checkout(f'branch{number}')
+            commit_changes(repository, generator, f'branch {number}')
+            repository.checkout('master')
+        commit_changes(repository, generator, 'diverge')
+
+        measure(timings, 'status', repository.status)
+        generator.modify()
+        measure(timings, 'status_dirty', repository.status)
+        repository.add(os.curdir)
+        repository.commit('dirty')
+
+        target = 'branch0' if scale.branches else repository.head
+        measure(timings, 'checkout', lambda: repository.checkout(target))
+        repository.checkout('master')
+        if scale.branches:
+            measure(timings, 'merge', lambda: repository.merge('branch0'))
+        try:
+            measure(timings, 'graph', lambda: draw_graph(repository.wit_dir))
+        except ImportError:
+            pass
+        if scale.large_size:
+            generator.write_large('large.bin')
+            repository.add('large.bin')
+            measure(timings, 'commit_large', lambda: repository.commit('large file'))
+            generator.edit_large('large.bin')
+            repository.add('large.bin')
+            measure(timings, 'commit_large_edit', lambda: repository.commit('large file edit'))
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(root, ignore_errors=True)
+    return timings
+
+
+def run(scales: List[Scale], repeat: int, seed: int) -> dict:
+    """Return the median time of every operation at every scale, and the scaling curve of each operation."""
+    results = []
+    for scale in scales:
+        runs = [run_scenario(scale, seed) for _ in range(repeat)]
+        timings = {operation: statistics.median(timing[operation] for timing in runs)
+                   for operation in OPERATIONS if operation in runs[0]}
+        results.append({'scale': scale._asdict(), 'timings': timings})
+        print(f'{scale.files} files: ' + ', '.join(f'{operation} {seconds:.3f}s'
+                                                 for operation, seconds in timings.items()), file=sys.stderr)
+    curves = {operation: [[result['scale']['files'], result['timings'][operation]]
+                          for result in results if operation in result['timings']]
+              for operation in OPERATIONS}
+    return {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'jobs': utilities.JOBS,
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+        'curves': curves,
+    }
+
+
+def plot_curves(report: dict, path: str) -> None:
+    """Save the scaling curve of every operation, on log-log axes, to the image in `path`."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    figure, axes = plt.subplots()
+    for operation, points in report['curves'].items():
+        if points:
+            axes.plot(*zip(*points), marker='o', label=operation)
+    axes.set_xscale('log')
+    axes.set_yscale('log')
+    axes.set_xlabel('files')
+    axes.set_ylabel('seconds')
+    axes.legend()
+    figure.savefig(path)
+    plt.close(figure)
+
+
+def get_scale_key(scale: dict) -> tuple:
+    # Reports written before a field was added hold its default.
+    return tuple(scale.get(field, Scale._field_defaults.get(field)) for field in Scale._fields)
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    """Print the change of every timing present in both reports, and return the regressions:
+    timings more than `threshold` slower, relatively, and at least `MIN_REGRESSION` seconds slower."""
+    old_results = {get_scale_key(result['scale']): result['timings'] for result in old['results']}
+    regressions = []
+    for result in new['results']:
+        old_timings = old_results.get(get_scale_key(result['scale']))
+        if old_timings is None:
+            continue
+        for operation, seconds in result['timings'].items():
+            old_seconds = old_timings.get(operation)
+            if old_seconds is None:
+                continue
+            change = (seconds - old_seconds) / old_seconds if old_seconds else 0.0
+            line = f'{result["scale"]["files"]:>8} files {operation:<14}{old_seconds:>10.4f}s {seconds:>10.4f}s {change:>+8.1%}'
+            if change > threshold and seconds - old_seconds >= MIN_REGRESSION:
+                line += '  REGRESSION'
+                regressions.append(line.strip())
+            print(line)
+    return regressions
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark wit commands on generated repositories.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Time every operation at every scale')
+    run_parser.add_argument('--files', default='100,1000,10000', help='Comma separated file counts, one per scale')
+    run_parser.add_argument('--depth', type=int, default=3, help='Directory levels above every file')
+    run_parser.add_argument('--history', type=int, default=10, help='Commits made before the timed operations')
+    run_parser.add_argument('--branches', type=int, default=3, help='Branches forked from the history')
+    run_parser.add_argument('--median-size', type=int, default=4096, help='Median file size in bytes')
+    run_parser.add_argument('--size-sigma', type=float, default=1.5, help='Spread of the log-normal file sizes')
+    run_parser.add_argument('--max-size', type=int, default=1 << 20, help='Largest file size in bytes')
+    run_parser.add_argument('--large-size', type=int, default=1 << 28,
+                            help='Size in bytes of a single large file committed, then edited and committed again; '
+                                 '0 skips it')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs per scale; the median time is kept')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--jobs', type=int, default=utilities.DEFAULT_JOBS)
+    run_parser.add_argument('--output', help='Write the JSON results here instead of to standard output')
+    run_parser.add_argument('--plot', help='Save the scaling curves to this image')
+    compare_parser = commands.add_parser('compare', help='Compare two results files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Relative slowdown reported as a regression, default 0.1')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    if args.command == 'compare':
+        with open(args.old, 'r') as old, open(args.new, 'r') as new:
+            regressions = compare(json.load(old), json.load(new), args.threshold)
+        print(f'{len(regressions)} regressions beyond {args.threshold:.0%}.')
+        return 1 if regressions else 0
+
+    utilities.JOBS = args.jobs
+    scales = [Scale(int(files), args.depth, args.history, args.branches,
+                    args.median_size, args.size_sigma, args.max_size, args.large_size) for files in args.files.split(',')]
+    report = run(scales, args.repeat, args.seed)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file_handler:
+            file_handler.write(output)
+    else:
+        print(output)
+    if args.plot:
+        plot_curves(report, args.plot)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,92 @@
+import os
+from typing import Dict, List, Mapping
+
+import index_funcs
+import object_funcs
+import status_funcs
+import trace_funcs
+import utilities
+
+
+def remove_path(path: str, root: str) -> None:
+    """Remove the file or empty directory tree in `path`, along with any parent directories it leaves empty
+    under `root`. Files not asked for are never deleted with a directory."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        utilities.remove_empty_tree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+    directory = os.path.dirname(path)
+    while directory != root and os.path.isdir(directory) and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+def find_untracked(diff: status_funcs.TreeDiff, new_tree: Mapping[str, str], wit_dir_parent: str,
+                   index: Mapping[str, index_funcs.IndexEntry]) -> List[str]:
+    """Return the files of the working tree that checking out `diff` would delete although they aren't staged:
+    those under a directory that is removed or replaced by a file, other than the removed ones,
+    and those in the way of an added path, or of the directories it is created in."""
+    removed = set(diff.removed)
+    replaced = [rel_path for rel_path in diff.added + diff.modified + diff.type_changed
+                if new_tree[rel_path] != object_funcs.EMPTY_DIR]
+    untracked = []
+    for rel_path in diff.removed + replaced:
+        path = os.path.join(wit_dir_parent, rel_path)
+        if os.path.islink(path) or not os.path.isdir(path):
+            continue
+        for directory, sub_directories, file_names in os.walk(path):
+            # Links to directories are kept like files, and aren't followed.
+            for name in file_names + [name for name in sub_directories if os.path.islink(os.path.join(directory, name))]:
+                file_path = os.path.join(directory, name)
+                if os.path.relpath(file_path, wit_dir_parent) not in removed:
+                    untracked.append(file_path)
+    blocked = set()
+    for rel_path in diff.added + diff.type_changed:
+        parts = rel_path.split(os.sep)
+        for depth in range(1, len(parts) + 1):
+            blocking = os.sep.join(parts[:depth])
+            path = os.path.join(wit_dir_parent, blocking)
+            if blocking in blocked or blocking in index or blocking in removed:
+                continue
+            # Directories in the way are walked above; an empty directory is kept as it is.
+            if os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path)):
+                blocked.add(blocking)
+                untracked.append(path)
+    return untracked
+
+
+@trace_funcs.traced('checkout tree')
+def checkout_tree(diff: status_funcs.TreeDiff,
+                  new_tree: Mapping[str, str],
+                  wit_dir_parent: str,
+                  index: Dict[str, index_funcs.IndexEntry]) -> None:
+    """Make the working tree, the staging area and `index` match an image, rewriting only the paths in `diff`
+    from the current image to it. `new_tree` maps the paths it added or changed to their content ids.
+    Raise ValueError, before changing anything, if files that aren't staged would be deleted or overwritten."""
+    untracked = find_untracked(diff, new_tree, wit_dir_parent, index)
+    if untracked:
+        raise ValueError(f'Unable to perform checkout. Untracked files would be deleted or overwritten:\n{untracked}')
+    wit_dir = os.path.join(wit_dir_parent, '.wit')
+    staging_area = os.path.join(wit_dir, 'staging_area')
+    # Deepest paths first, so directories are emptied before they are removed.
+    for rel_path in sorted(diff.removed, key=object_funcs.get_path_key, reverse=True):
+        for root in (wit_dir_parent, staging_area):
+            remove_path(os.path.join(root, rel_path), root)
+        index_funcs.unstage_path(rel_path, index)
+    changed = diff.added + diff.modified + diff.type_changed
+    for rel_path in sorted(changed):
+        for root in (wit_dir_parent, staging_area):
+            if new_tree[rel_path] == object_funcs.EMPTY_DIR:
+                object_funcs.checkout_object(object_funcs.EMPTY_DIR, os.path.join(root, rel_path), wit_dir)
+            else:
+                os.makedirs(os.path.dirname(os.path.join(root, rel_path)), exist_ok=True)
+
+    def write_file(rel_path: str) -> index_funcs.IndexEntry:
+        object_id = new_tree[rel_path]
+        if object_id != object_funcs.EMPTY_DIR:
+            for root in (wit_dir_parent, staging_area):
+                object_funcs.checkout_object(object_id, os.path.join(root, rel_path), wit_dir, link=root == staging_area)
+        return index_funcs.make_entry(os.path.join(wit_dir_parent, rel_path), object_id)
+
+    for rel_path, entry in zip(changed, utilities.run_jobs(write_file, changed)):
+        index[rel_path] = entry
@@ -0,0 +1,126 @@
+import hashlib
+import mmap
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import object_funcs
+
+
+CHUNK_THRESHOLD = 1 << 24
+MIN_CHUNK = 1 << 18
+AVERAGE_CHUNK = 1 << 20
+MAX_CHUNK = 1 << 22
+# Every byte is reduced to a single bit, and a chunk is cut after bytes whose bits spell out an anchor.
+# Both steps run in C, through `bytes.translate` and `bytes.find`, at memory speed.
+SYMBOLS = bytes(hashlib.sha256(bytes([byte])).digest()[0] & 1 for byte in range(256))
+ANCHOR = bytes((byte >> shift) & 1 for byte in hashlib.sha256(b'wit chunk anchor').digest()[:4] for shift in range(8))
+# Normalized chunking: cut points are harder to find before the average chunk size and easier after it.
+ANCHOR_SMALL = ANCHOR[:22]
+ANCHOR_LARGE = ANCHOR[:18]
+SCAN_BLOCK = 1 << 18
+
+
+def get_chunks_path(object_id: str, wit_dir: str) -> str:
+    """Return path to the chunk list of the object `object_id`."""
+    return f'{object_funcs.get_object_path(object_id, wit_dir)}.chunks'
+
+
+def find_cut(data: mmap.mmap, start: int, stop: int) -> int:
+    """Return the end of the chunk starting at `start`: the end of the first anchor found past the minimum chunk size.
+    Only the chunk's own bytes are read, so the same bytes are always cut the same way."""
+    if stop - start <= MIN_CHUNK:
+        return stop
+    normal = min(stop, start + AVERAGE_CHUNK)
+    end = find_anchor(data, ANCHOR_SMALL, start + MIN_CHUNK, normal)
+    if end is None:
+        # The anchor may start before the average size, as long as it ends after it.
+        end = find_anchor(data, ANCHOR_LARGE, max(start + MIN_CHUNK, normal - len(ANCHOR_LARGE) + 1), stop)
+    return end if end is not None else stop
+
+
+def find_anchor(data: mmap.mmap, anchor: bytes, start: int, stop: int) -> Optional[int]:
+    """Return the end of the first `anchor` in the symbols of `data[start:stop]`, or None if there is none.
+    The symbols are computed a block at a time, so little is read past the anchor."""
+    while stop - start >= len(anchor):
+        block_stop = min(stop, start + SCAN_BLOCK)
+        index = data[start:block_stop].translate(SYMBOLS).find(anchor)
+        if index != -1:
+            return start + index + len(anchor)
+        # Blocks overlap, for anchors that straddle two of them.
+        start = block_stop - len(anchor) + 1
+        if block_stop == stop:
+            break
+    return None
+
+
+class Chunk(NamedTuple):
+    """A chunk of a large file, with its size, unknown in chunk lists written before sizes were recorded."""
+    id: str
+    size: Optional[int]
+
+
+def iter_chunks(data: mmap.mmap, base: Sequence[Chunk] = ()) -> Iterator[Tuple[int, int]]:
+    """Yield the start and end of every content-defined chunk of `data`.
+    Chunks of `base`, the chunks of a previous version of the file, are reused without scanning them wherever
+    they would be cut the same way: where one starts at the same offset, or at the same distance from the end,
+    and still holds the same bytes. Only the changed regions are scanned, until the chunks line up again."""
+    size = len(data)
+    by_start: Dict[int, Chunk] = {}
+    by_distance: Dict[int, Chunk] = {}
+    if base and all(chunk.size is not None for chunk in base):
+        base_size = sum(chunk.size for chunk in base)
+        offset = 0
+        for position, chunk in enumerate(base):
+            # The last chunk ends at the end of the file rather than at a cut, so it only lines up from the end.
+            if position + 1 < len(base):
+                by_start[offset] = chunk
+            by_distance[base_size - offset] = chunk
+            offset += chunk.size
+    start = 0
+    while start < size:
+        for chunk in (by_start.get(start), by_distance.get(size - start)):
+            if (chunk is not None and start + chunk.size <= size
+                    and hashlib.sha1(data[start:start + chunk.size]).hexdigest() == chunk.id):
+                end = start + chunk.size
+                break
+        else:
+            end = find_cut(data, start, min(size, start + MAX_CHUNK))
+        yield start, end
+        start = end
+
+
+def store_chunked_file(path: str, object_id: str, wit_dir: str, base_id: Optional[str] = None) -> None:
+    """Store the file in `path` as deduplicated chunks, and the object `object_id` as the list of them.
+    If `base_id` is a previous version of the file stored in chunks, only the regions that changed are chunked again."""
+    chunks: List[Chunk] = []
+    base = read_chunks(base_id, wit_dir) if base_id is not None else None
+    with open(path, 'rb') as file_handler:
+        with mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, end in iter_chunks(data, base or ()):
+                chunks.append(Chunk(object_funcs.store_bytes(data[start:end], wit_dir), end - start))
+    object_funcs.write_loose(object_id, format_chunk_list(chunks), wit_dir, suffix='.chunks')
+
+
+def format_chunk_list(chunks: Iterable[Chunk]) -> bytes:
+    """Return the contents of the chunk list of `chunks`: the id and size of each chunk, one per line."""
+    return ''.join(f'{chunk.id} {chunk.size}\n' if chunk.size is not None else f'{chunk.id}\n'
+                   for chunk in chunks).encode()
+
+
+def read_chunks(object_id: str, wit_dir: str) -> Optional[List[Chunk]]:
+    """Return the chunks of `object_id`, or None if it isn't stored in chunks."""
+    try:
+        with open(get_chunks_path(object_id, wit_dir), 'r') as file_handler:
+            lines = file_handler.read().splitlines()
+    except FileNotFoundError:
+        return None
+    chunks = []
+    for line in lines:
+        chunk_id, _, size = line.partition(' ')
+        chunks.append(Chunk(chunk_id, int(size) if size else None))
+    return chunks
+
+
+def read_chunk_list(object_id: str, wit_dir: str) -> Optional[List[str]]:
+    """Return the ids of the chunks of `object_id`, or None if it isn't stored in chunks."""
+    chunks = read_chunks(object_id, wit_dir)
+    return [chunk.id for chunk in chunks] if chunks is not None else None
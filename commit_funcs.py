@@ -1,8 +1,10 @@
-import os
 import random
 import time
 from typing import Optional
 
+import metadata_funcs
+import refs_funcs
+import trace_funcs
 import utilities
 
 
@@ -25,60 +27,48 @@ def create_references_file(commit_id: str, wit_dir: Optional[str] = None) -> Non
         except FileNotFoundError as err:
             print(err)
             return
-    reference_path = os.path.join(wit_dir, 'references.txt')
-    if not os.path.exists(reference_path):
-        with open(reference_path, 'x') as references:
-            references.write(f'HEAD={commit_id}\nmaster={commit_id}')
+    refs = refs_funcs.get_refs(wit_dir)
+    if refs.head is None:
+        refs.set('HEAD', commit_id)
+        refs.set('master', commit_id)
+        refs.save()
 
 
-def create_metadata_file(commit_id: str, *message: str, merged_branch_id: Optional[str] = None, wit_dir: Optional[str] = None) -> None:
-    """Create a metadata file for the current image."""
+@trace_funcs.traced('write metadata')
+def create_metadata_file(commit_id: str, *message: str, merged_branch_id: Optional[str] = None,
+                         wit_dir: Optional[str] = None, tree_id: str = '') -> None:
+    """Record the metadata of the current image in the metadata database."""
     if wit_dir is None:
         try:
             wit_dir = utilities.get_wit_dir()
         except FileNotFoundError as err:
             print(err)
             return
-    images_dir = os.path.join(wit_dir, 'images')
-    metadata_path = os.path.join(images_dir, f'{commit_id}.txt')
-    try:
-        parent = utilities.get_parent_id(wit_dir)['HEAD']
-        if merged_branch_id:
-            parent += f', {merged_branch_id}'
-    except KeyError:
-        parent = 'None'
-    cur_time = time.strftime('%a %b %d %H:%M:%S %Y %z', time.gmtime())
-    printable = f'parent={parent}\ndate={cur_time}'
-    if message:
-        to_print = ' '.join(message)
-        printable += f'\nmessage={to_print}'
-    with open(metadata_path, 'x') as metadata:
-        metadata.write(printable)
+    head_id = refs_funcs.get_refs(wit_dir).head
+    parents = [head_id] if head_id else []
+    if head_id and merged_branch_id:
+        parents.append(merged_branch_id)
+    metadata_funcs.insert_commit(
+        metadata_funcs.Commit(commit_id, parents, int(time.time()), ' '.join(message) if message else None, tree_id),
+        wit_dir)
 
 
+@trace_funcs.traced('update references')
 def update_references(commit_id: str, wit_dir: Optional[str] = None, checkout: bool = False) -> None:
-    """Update the reference file in `wit_dir`."""
+    """Update the reference file in `wit_dir`.
+    Raise KeyError if there is no reference to update yet."""
     if wit_dir is None:
         try:
             wit_dir = utilities.get_wit_dir()
         except FileNotFoundError as err:
             print(err)
             return
-    reference_path = os.path.join(wit_dir, 'references.txt')
+    refs = refs_funcs.get_refs(wit_dir)
+    if refs.head is None:
+        raise KeyError('HEAD')
     active_branch = utilities.get_active_branch(wit_dir)
     if active_branch:
-        active_branch_id = utilities.get_parent_id(wit_dir)[active_branch]
-        if not checkout and active_branch_id == utilities.get_parent_id(wit_dir)['HEAD']:
-            active_branch_id = commit_id
-    with open(reference_path, 'r') as file_handler:
-        reference = file_handler.readlines()
-    text = ''
-    for line in reference:
-        branch_name, branch_id = line.rstrip().split('=')
-        if branch_name == 'HEAD':
-            branch_id = commit_id
-        elif branch_name == active_branch:
-            branch_id = active_branch_id
-        text += f'{branch_name}={branch_id}\n'
-    with open(reference_path, 'w') as file_handler:
-        file_handler.write(text.rstrip())
\ No newline at end of file
+        if not checkout and refs.branches[active_branch] == refs.head:
+            refs.set(active_branch, commit_id)
+    refs.set('HEAD', commit_id)
+    refs.save()
\ No newline at end of file
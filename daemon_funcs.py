@@ -0,0 +1,347 @@
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import ignore_funcs
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+EVENT = struct.Struct('iIII')
+READ_SIZE = 1 << 16
+SOCKET_NAME = 'daemon.sock'
+LOG_NAME = 'daemon.log'
+CLIENT_TIMEOUT = 30
+START_TIMEOUT = 60
+
+
+class Inotify:
+    """Minimal ctypes binding of the Linux inotify API, with a non-blocking descriptor."""
+
+    def __init__(self) -> None:
+        library = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or library is None:
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path: str) -> int:
+        """Watch the directory in `path` and return its watch descriptor."""
+        watch_id = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if watch_id < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return watch_id
+
+    def remove_watch(self, watch_id: int) -> None:
+        """Stop watching the directory of `watch_id`, if it is still watched."""
+        self.libc.inotify_rm_watch(self.fd, watch_id)
+
+    def read_events(self) -> Iterator[Tuple[int, int, str]]:
+        """Yield the watch descriptor, mask and file name of every queued event, without blocking."""
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                watch_id, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                yield watch_id, mask, name
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class TreeWatcher:
+    """Stat data of a working tree, kept in memory per directory and refreshed from inotify events.
+    Only the entries named by events are stat'ed again; an overflowing event queue forces a full rescan.
+    Ignored paths are only remembered by name, and ignored directories are never watched."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.inotify: Optional[Inotify] = None
+        self.rescan()
+
+    def rescan(self) -> None:
+        """Drop all watches and state, then watch and list the whole tree again."""
+        if self.inotify is not None:
+            self.inotify.close()
+        self.inotify = Inotify()
+        self.directories: Dict[str, Dict[str, os.stat_result]] = {}
+        self.watches: Dict[int, str] = {}
+        self.watch_ids: Dict[str, int] = {}
+        self.dirty: Set[Tuple[str, str]] = set()
+        self.matchers: Dict[str, ignore_funcs.Matcher] = {}
+        self.ignored: Dict[str, Set[str]] = {}
+        self.scan('', ignore_funcs.Matcher())
+
+    def scan(self, rel_dir: str, matcher: ignore_funcs.Matcher) -> None:
+        """Watch and list `rel_dir` and every directory under it.
+        Each directory is watched before it is listed, so nothing changed while listing is missed."""
+        path = os.path.join(self.root, rel_dir)
+        try:
+            watch_id = self.inotify.add_watch(path)
+        except OSError as err:
+            if err.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise
+        self.watches[watch_id] = rel_dir
+        self.watch_ids[rel_dir] = watch_id
+        entries = self.directories[rel_dir] = {}
+        ignored = self.ignored[rel_dir] = set()
+        prefix = rel_dir + os.sep if rel_dir else ''
+        matcher = self.matchers[rel_dir] = matcher.load(path, prefix)
+        sub_directories = []
+        try:
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    if not rel_dir and entry.name == '.wit':
+                        continue
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if matcher.rules and matcher.is_ignored(prefix + entry.name, is_dir):
+                        ignored.add(entry.name)
+                        continue
+                    entry_stat = get_stat(entry.path)
+                    if entry_stat is not None:
+                        entries[entry.name] = entry_stat
+                        if is_dir:
+                            sub_directories.append(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for name in sub_directories:
+            self.scan(os.path.join(rel_dir, name), matcher)
+
+    def forget(self, rel_dir: str) -> None:
+        """Drop `rel_dir` and every directory under it, and stop watching them."""
+        entries = self.directories.pop(rel_dir, None)
+        if entries is None:
+            return
+        self.matchers.pop(rel_dir, None)
+        self.ignored.pop(rel_dir, None)
+        watch_id = self.watch_ids.pop(rel_dir, None)
+        # A directory moved within the tree keeps its watch descriptor under its new path.
+        if watch_id is not None and self.watches.get(watch_id) == rel_dir:
+            del self.watches[watch_id]
+            self.inotify.remove_watch(watch_id)
+        for name in entries:
+            self.forget(os.path.join(rel_dir, name))
+
+    def process_events(self) -> None:
+        """Record the entries named by queued events, and the directories holding them, as dirty,
+        rescanning everything if events were lost."""
+        overflowed = False
+        for watch_id, mask, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+            elif mask & IN_IGNORED:
+                rel_dir = self.watches.pop(watch_id, None)
+                if rel_dir is not None and self.watch_ids.get(rel_dir) == watch_id:
+                    del self.watch_ids[rel_dir]
+            elif name and watch_id in self.watches:
+                rel_dir = self.watches[watch_id]
+                self.dirty.add((rel_dir, name))
+                if rel_dir:
+                    # Changing a directory's entries changes its own stat data, kept with its parent's entries.
+                    self.dirty.add((os.path.dirname(rel_dir), os.path.basename(rel_dir)))
+        if overflowed:
+            self.rescan()
+
+    def refresh(self) -> None:
+        """Bring the dirty entries up to date."""
+        self.process_events()
+        while self.dirty:
+            self.refresh_entry(*self.dirty.pop())
+
+    def refresh_entry(self, rel_dir: str, name: str) -> None:
+        """Stat `name` in `rel_dir` again, listing it if it became a directory."""
+        entries = self.directories.get(rel_dir)
+        if entries is None or not rel_dir and name == '.wit':
+            return
+        if name == ignore_funcs.IGNORE_FILE:
+            # The rules for the whole directory changed, so it is listed again with them.
+            self.forget(rel_dir)
+            self.scan(rel_dir, self.matchers[os.path.dirname(rel_dir)] if rel_dir else ignore_funcs.Matcher())
+            return
+        rel_path = os.path.join(rel_dir, name)
+        path = os.path.join(self.root, rel_path)
+        entry_stat = get_stat(path)
+        matcher = self.matchers[rel_dir]
+        if matcher.rules and matcher.is_ignored(rel_path, is_real_directory(path)):
+            if entry_stat is None:
+                self.ignored[rel_dir].discard(name)
+            else:
+                self.ignored[rel_dir].add(name)
+            entries.pop(name, None)
+            self.forget(rel_path)
+            return
+        self.ignored[rel_dir].discard(name)
+        if entry_stat is None:
+            entries.pop(name, None)
+            self.forget(rel_path)
+            return
+        entries[name] = entry_stat
+        if not is_real_directory(path):
+            self.forget(rel_path)
+        elif rel_path not in self.directories:
+            self.scan(rel_path, matcher)
+
+    def get_snapshot(self) -> List[list]:
+        """Return the entries `status_funcs.scan_tree` would find, in the same order,
+        as lists of relative path, mode, inode, size and modification time in nanoseconds."""
+        snapshot: List[list] = []
+        self.add_directory('', '', snapshot)
+        return snapshot
+
+    def add_directory(self, rel_dir: str, prefix: str, snapshot: List[list]) -> None:
+        for name, entry_stat in sorted(self.directories[rel_dir].items()):
+            rel_path = prefix + name
+            # Like `status_funcs.iter_directory`, a directory holding only ignored paths isn't empty.
+            if not self.directories.get(rel_path) and not self.ignored.get(rel_path):
+                snapshot.append([rel_path, entry_stat.st_mode, entry_stat.st_ino,
+                                 entry_stat.st_size, entry_stat.st_mtime_ns])
+            else:
+                self.add_directory(rel_path, rel_path + os.sep, snapshot)
+
+    def close(self) -> None:
+        self.inotify.close()
+
+
+def get_stat(path: str) -> Optional[os.stat_result]:
+    """Return the stat data of `path`, following symbolic links unless they are broken, or None if it doesn't exist."""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        try:
+            return os.lstat(path)
+        except FileNotFoundError:
+            return None
+
+
+def is_real_directory(path: str) -> bool:
+    """Return whether `path` is a directory and not a symbolic link to one."""
+    try:
+        return stat.S_ISDIR(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def get_socket_path(wit_dir: str) -> str:
+    """Return path to the socket the daemon of `wit_dir` listens on."""
+    return os.path.join(wit_dir, SOCKET_NAME)
+
+
+def serve(wit_dir_parent: str) -> None:
+    """Watch the working tree of `wit_dir_parent` and answer requests on its socket until asked to stop."""
+    socket_path = get_socket_path(os.path.join(wit_dir_parent, '.wit'))
+    watcher = TreeWatcher(wit_dir_parent)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    try:
+        running = True
+        while running:
+            readable, _, _ = select.select([server, watcher.inotify.fd], [], [])
+            if watcher.inotify.fd in readable:
+                # Drain the event queue as it fills, so it only overflows under a real burst of changes.
+                watcher.process_events()
+            if server in readable:
+                connection, _ = server.accept()
+                with connection:
+                    running = handle_request(connection, watcher)
+    finally:
+        server.close()
+        os.remove(socket_path)
+        watcher.close()
+
+
+def handle_request(connection: socket.socket, watcher: TreeWatcher) -> bool:
+    """Answer the request read from `connection`. Return whether to keep serving."""
+    connection.settimeout(CLIENT_TIMEOUT)
+    request = ''
+    try:
+        request = connection.makefile('r').readline().strip()
+        if request == 'snapshot':
+            watcher.refresh()
+            connection.sendall(json.dumps(watcher.get_snapshot(), separators=(',', ':')).encode())
+        else:
+            connection.sendall(b'"ok"')
+    except OSError:
+        pass
+    return request != 'stop'
+
+
+def send_request(wit_dir: str, request: str) -> Optional[object]:
+    """Return the daemon's response to `request`, or None if the daemon isn't running."""
+    chunks = []
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(CLIENT_TIMEOUT)
+            client.connect(get_socket_path(wit_dir))
+            client.sendall(f'{request}\n'.encode())
+            chunk = client.recv(READ_SIZE)
+            while chunk:
+                chunks.append(chunk)
+                chunk = client.recv(READ_SIZE)
+    except (OSError, AttributeError):
+        # AttributeError: the platform has no Unix sockets.
+        return None
+    return json.loads(b''.join(chunks)) if chunks else None
+
+
+def get_snapshot(wit_dir_parent: str) -> Optional[Dict[str, os.stat_result]]:
+    """Return the working tree snapshot kept by the daemon of `wit_dir_parent`, or None if it isn't running."""
+    response = send_request(os.path.join(wit_dir_parent, '.wit'), 'snapshot')
+    if not isinstance(response, list):
+        return None
+    return {rel_path: os.stat_result((mode, inode, 0, 0, 0, 0, size, 0, mtime_ns / 1e9, 0), {'st_mtime_ns': mtime_ns})
+            for rel_path, mode, inode, size, mtime_ns in response}
+
+
+def is_running(wit_dir: str) -> bool:
+    """Return whether the daemon of `wit_dir` answers requests."""
+    return send_request(wit_dir, 'ping') == 'ok'
+
+
+def start_daemon(wit_dir_parent: str) -> bool:
+    """Start the daemon of `wit_dir_parent` in the background and wait until it answers.
+    Return False if it exited first; its errors are written to '.wit/daemon.log'."""
+    wit_dir = os.path.join(wit_dir_parent, '.wit')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wit.py')
+    with open(os.path.join(wit_dir, LOG_NAME), 'a') as log:
+        process = subprocess.Popen([sys.executable, script, 'daemon', 'run'], cwd=wit_dir_parent,
+                                   stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+    deadline = time.monotonic() + START_TIMEOUT
+    while process.poll() is None and time.monotonic() < deadline:
+        if is_running(wit_dir):
+            return True
+        time.sleep(0.05)
+    return process.poll() is None
@@ -0,0 +1,323 @@
+import heapq
+import mmap
+import os
+import struct
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import metadata_funcs
+import trace_funcs
+import utilities
+
+
+GRAPH_SIGNATURE = b'WITG'
+GRAPH_VERSION = 1
+HEADER = struct.Struct('>4sI')
+RECORD = struct.Struct('>20sIIIq')
+NO_PARENT = 0xFFFFFFFF
+FIRST_SIDE = 1
+SECOND_SIDE = 2
+BOTH_SIDES = FIRST_SIDE | SECOND_SIDE
+STALE = 4
+RESULT = 8
+
+
+class CommitGraph(NamedTuple):
+    """Commits in topological order, with the positions of their parents, generation numbers and timestamps."""
+    ids: List[str]
+    positions: Dict[str, int]
+    parents: List[Tuple[int, ...]]
+    generations: List[int]
+    timestamps: List[int]
+
+
+class GraphRecord(NamedTuple):
+    """A single commit of the commit-graph file."""
+    position: int
+    id: str
+    parents: Tuple[int, ...]
+    generation: int
+    timestamp: int
+
+
+class GraphFile:
+    """Random access to the records of the commit-graph file through a memory map, unpacking only the ones read."""
+
+    def __init__(self, wit_dir: str) -> None:
+        with open(get_graph_path(wit_dir), 'rb') as file_handler:
+            trace_funcs.count(trace_funcs.METADATA_OPENED)
+            self.data = mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, version = HEADER.unpack_from(self.data)
+        if signature != GRAPH_SIGNATURE or version != GRAPH_VERSION:
+            self.data.close()
+            raise ValueError('Unsupported commit-graph file')
+
+    def __len__(self) -> int:
+        return (len(self.data) - HEADER.size) // RECORD.size
+
+    def find(self, commit_id: str) -> Optional[int]:
+        """Return the position of `commit_id`, or None if it isn't in the file."""
+        digest = bytes.fromhex(commit_id)
+        offset = self.data.find(digest, HEADER.size)
+        while offset != -1:
+            if (offset - HEADER.size) % RECORD.size == 0:
+                return (offset - HEADER.size) // RECORD.size
+            offset = self.data.find(digest, offset + 1)
+        return None
+
+    def get(self, position: int) -> GraphRecord:
+        digest, first, second, generation, timestamp = RECORD.unpack_from(self.data, HEADER.size + position * RECORD.size)
+        parents = tuple(parent for parent in (first, second) if parent != NO_PARENT)
+        return GraphRecord(position, digest.hex(), parents, generation, timestamp)
+
+    def close(self) -> None:
+        self.data.close()
+
+
+def get_graph_path(wit_dir: str) -> str:
+    """Return path to the commit-graph file of `wit_dir`."""
+    return os.path.join(wit_dir, 'commit-graph')
+
+
+def get_metadata(commit_id: str, wit_dir: str) -> Tuple[List[str], int]:
+    """Return the parent ids and the timestamp recorded in the metadata of `commit_id`."""
+    commit = metadata_funcs.get_commit(commit_id, wit_dir)
+    if commit is None:
+        raise ValueError(f'Unknown commit id: {commit_id}')
+    return commit.parents, commit.date
+
+
+def open_graph_file(wit_dir: str) -> GraphFile:
+    """Return the commit-graph file, rebuilt from the metadata first if it is missing, of another version,
+    or doesn't hold exactly the images in the metadata."""
+    try:
+        graph_file = GraphFile(wit_dir)
+    except (FileNotFoundError, ValueError):
+        # `ValueError` is also raised when mapping an empty file.
+        pass
+    else:
+        if len(graph_file) == metadata_funcs.count_commits(wit_dir):
+            return graph_file
+        graph_file.close()
+    write_commit_graph(wit_dir)
+    return GraphFile(wit_dir)
+
+
+def read_commit_graph(wit_dir: Optional[str] = None) -> CommitGraph:
+    """Return the commits stored in the commit-graph file, rebuilding the file from the metadata if needed."""
+    if wit_dir is None:
+        wit_dir = utilities.get_wit_dir()
+    graph = CommitGraph([], {}, [], [], [])
+    graph_file = open_graph_file(wit_dir)
+    try:
+        end = HEADER.size + len(graph_file) * RECORD.size
+        for digest, first, second, generation, timestamp in RECORD.iter_unpack(graph_file.data[HEADER.size:end]):
+            commit_id = digest.hex()
+            graph.positions[commit_id] = len(graph.ids)
+            graph.ids.append(commit_id)
+            graph.parents.append(tuple(parent for parent in (first, second) if parent != NO_PARENT))
+            graph.generations.append(generation)
+            graph.timestamps.append(timestamp)
+    finally:
+        graph_file.close()
+    return graph
+
+
+def write_commit_graph(wit_dir: str) -> CommitGraph:
+    """Rebuild the commit-graph file from the metadata of all images, and return its contents."""
+    metadata = {commit.id: (commit.parents, commit.date) for commit in metadata_funcs.iter_commits(wit_dir)}
+    graph = CommitGraph([], {}, [], [], [])
+    for commit_id in metadata:
+        stack = [commit_id]
+        while stack:
+            current = stack[-1]
+            if current in graph.positions:
+                stack.pop()
+                continue
+            missing = [parent for parent in metadata[current][0] if parent not in graph.positions]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            add_to_graph(graph, current, *metadata[current])
+
+    graph_path = get_graph_path(wit_dir)
+    temp_path = f'{graph_path}.tmp'
+    with open(temp_path, 'wb') as file_handler:
+        file_handler.write(HEADER.pack(GRAPH_SIGNATURE, GRAPH_VERSION))
+        for position in range(len(graph.ids)):
+            file_handler.write(pack_record(graph, position))
+    os.replace(temp_path, graph_path)
+    return graph
+
+
+def add_to_graph(graph: CommitGraph, commit_id: str, parents: List[str], timestamp: int) -> None:
+    """Append `commit_id` to `graph`; all of its `parents` must already be in it."""
+    parent_positions = tuple(graph.positions[parent] for parent in parents)
+    generation = 1 + max((graph.generations[parent] for parent in parent_positions), default=0)
+    graph.positions[commit_id] = len(graph.ids)
+    graph.ids.append(commit_id)
+    graph.parents.append(parent_positions)
+    graph.generations.append(generation)
+    graph.timestamps.append(timestamp)
+
+
+def pack_record(graph: CommitGraph, position: int) -> bytes:
+    """Return the fixed-width record of the commit in `position` of `graph`."""
+    first, second = (graph.parents[position] + (NO_PARENT, NO_PARENT))[:2]
+    return RECORD.pack(bytes.fromhex(graph.ids[position]), first, second,
+                       graph.generations[position], graph.timestamps[position])
+
+
+@trace_funcs.traced('update commit graph')
+def append_commit(commit_id: str, wit_dir: str) -> None:
+    """Append the newly created image `commit_id` to the commit-graph file."""
+    append_commits([commit_id], wit_dir)
+
+
+def append_commits(commit_ids: List[str], wit_dir: str) -> None:
+    """Append the new images `commit_ids`, parents first, to the commit-graph file, reading only the records
+    of their parents. The file is rebuilt instead if it is missing, or wouldn't hold exactly the images in the metadata."""
+    try:
+        graph_file = GraphFile(wit_dir)
+    except (FileNotFoundError, ValueError):
+        # `ValueError` is also raised when mapping an empty file.
+        write_commit_graph(wit_dir)
+        return
+    try:
+        size = len(graph_file)
+        records = pack_new_records(graph_file, commit_ids, wit_dir)
+    finally:
+        graph_file.close()
+    if records is None or size + len(records) != metadata_funcs.count_commits(wit_dir):
+        write_commit_graph(wit_dir)
+        return
+    with open(get_graph_path(wit_dir), 'ab') as file_handler:
+        file_handler.write(b''.join(records))
+
+
+def pack_new_records(graph_file: GraphFile, commit_ids: List[str], wit_dir: str) -> Optional[List[bytes]]:
+    """Return the records of the images `commit_ids` missing from `graph_file`, to be appended to it in order,
+    or None if one of their parents is in neither."""
+    start = len(graph_file)
+    positions: Dict[str, int] = {}
+    generations: List[int] = []
+    records = []
+    for commit_id in commit_ids:
+        if commit_id in positions or graph_file.find(commit_id) is not None:
+            continue
+        parents, timestamp = get_metadata(commit_id, wit_dir)
+        parent_positions = tuple(positions[parent] if parent in positions else graph_file.find(parent)
+                                 for parent in parents)
+        if None in parent_positions:
+            return None
+        generation = 1 + max((generations[parent - start] if parent >= start else graph_file.get(parent).generation
+                              for parent in parent_positions), default=0)
+        positions[commit_id] = start + len(records)
+        generations.append(generation)
+        first, second = (parent_positions + (NO_PARENT, NO_PARENT))[:2]
+        records.append(RECORD.pack(bytes.fromhex(commit_id), first, second, generation, timestamp))
+    return records
+
+
+def iter_ancestors(graph: CommitGraph, commit_id: str) -> Iterator[int]:
+    """Yield the position of `commit_id` and of each of its ancestors in `graph` once."""
+    seen = set()
+    stack = [graph.positions[commit_id]]
+    while stack:
+        position = stack.pop()
+        if position in seen:
+            continue
+        seen.add(position)
+        yield position
+        stack.extend(graph.parents[position])
+
+
+def open_commit_graph(wit_dir: str, *commit_ids: str) -> Tuple[GraphFile, List[int]]:
+    """Return the commit-graph file, and the positions of `commit_ids` in it, rebuilding the file if needed."""
+    graph_file = open_graph_file(wit_dir)
+    positions = [graph_file.find(commit_id) for commit_id in commit_ids]
+    if None in positions:
+        graph_file.close()
+        write_commit_graph(wit_dir)
+        graph_file = GraphFile(wit_dir)
+        positions = [graph_file.find(commit_id) for commit_id in commit_ids]
+        for commit_id, position in zip(commit_ids, positions):
+            if position is None:
+                graph_file.close()
+                raise ValueError(f'Unknown commit id: {commit_id}')
+    return graph_file, positions
+
+
+def iter_by_date(graph_file: GraphFile, position: int) -> Iterator[GraphRecord]:
+    """Yield the record of the commit in `position` and of each of its ancestors once, newest first.
+    Records are read from the file only when their children are reached, so the walk can stop at any point
+    having read little more than what it yielded."""
+    record = graph_file.get(position)
+    seen = {position}
+    queue = [(-record.timestamp, -position, record)]
+    while queue:
+        *_, record = heapq.heappop(queue)
+        yield record
+        for parent in record.parents:
+            if parent not in seen:
+                seen.add(parent)
+                parent_record = graph_file.get(parent)
+                # Parents precede their children in the file, so on equal dates the child comes first.
+                heapq.heappush(queue, (-parent_record.timestamp, -parent, parent_record))
+
+
+def get_merge_bases(graph_file: GraphFile, first: int, second: int) -> List[str]:
+    """Return the best common ancestors of the commits in positions `first` and `second`, newest first.
+    Both sides are walked at once in decreasing generation order, stopping as soon as every
+    remaining commit is known to be an ancestor of a common one, so only the records of the commits
+    between the tips and their bases are read. Criss-cross histories have more than one best common ancestor."""
+    if first == second:
+        return [graph_file.get(first).id]
+    records = {first: graph_file.get(first), second: graph_file.get(second)}
+    flags = {first: FIRST_SIDE, second: SECOND_SIDE}
+    queue = [get_queue_key(records[first]), get_queue_key(records[second])]
+    heapq.heapify(queue)
+    candidates = []
+    while any(not flags[position] & STALE for _, _, position in queue):
+        *_, position = heapq.heappop(queue)
+        position_flags = flags[position]
+        if position_flags & BOTH_SIDES == BOTH_SIDES:
+            if not position_flags & RESULT:
+                flags[position] |= RESULT
+                candidates.append(position)
+            position_flags |= STALE
+        for parent in records[position].parents:
+            if flags.get(parent, 0) & position_flags == position_flags:
+                continue
+            flags[parent] = flags.get(parent, 0) | position_flags
+            if parent not in records:
+                records[parent] = graph_file.get(parent)
+            heapq.heappush(queue, get_queue_key(records[parent]))
+
+    bases = [candidate for candidate in candidates
+             if not any(candidate != other and is_ancestor(graph_file, candidate, other) for other in candidates)]
+    bases.sort(key=lambda position: (records[position].generation, records[position].timestamp), reverse=True)
+    return [records[position].id for position in bases]
+
+
+def get_queue_key(record: GraphRecord) -> Tuple[int, int, int]:
+    """Return the key ordering `record` in a walk from the newest generation to the oldest."""
+    return -record.generation, -record.timestamp, record.position
+
+
+def is_ancestor(graph_file: GraphFile, ancestor: int, descendant: int) -> bool:
+    """Return whether `ancestor` is reachable from `descendant`, never reading records below its generation."""
+    min_generation = graph_file.get(ancestor).generation
+    seen = set()
+    stack = [descendant]
+    while stack:
+        position = stack.pop()
+        if position == ancestor:
+            return True
+        if position in seen:
+            continue
+        seen.add(position)
+        record = graph_file.get(position)
+        if record.generation > min_generation:
+            stack.extend(record.parents)
+    return False
@@ -0,0 +1,158 @@
+import os
+import re
+from typing import List, NamedTuple, Optional, Pattern, Tuple
+
+import trace_funcs
+
+
+IGNORE_FILE = '.witignore'
+
+
+class Rules(NamedTuple):
+    """The patterns of one ignore file, combined into a regular expression for files and one for directories,
+    with the last pattern first, so the alternative that matches is the one that decides.
+    `prefix` is the directory of the ignore file relative to the root of the working tree."""
+    prefix: str
+    files: Optional[Pattern]
+    file_negations: List[bool]
+    directories: Optional[Pattern]
+    directory_negations: List[bool]
+
+
+class Matcher:
+    """The ignore rules in effect in a directory: those of its own ignore file and of every directory above it.
+    Deeper ignore files take precedence. Paths are given relative to the scanned directory, which is `base`
+    relative to the root of the working tree."""
+
+    def __init__(self, rules: Tuple[Rules, ...] = (), base: str = '') -> None:
+        self.rules = rules
+        self.base = base
+
+    def load(self, directory: str, prefix: str) -> 'Matcher':
+        """Return the matcher for the contents of `directory`, found in `prefix` under the scanned directory,
+        adding the rules of its ignore file if it has one."""
+        try:
+            with open(os.path.join(directory, IGNORE_FILE), 'r', encoding='utf-8') as file_handler:
+                lines = file_handler.read().splitlines()
+        except (FileNotFoundError, NotADirectoryError):
+            return self
+        trace_funcs.count(trace_funcs.METADATA_OPENED)
+        return Matcher(self.rules + (compile_rules(lines, self.base + prefix),), self.base)
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """Return whether `rel_path` is ignored, by the last pattern matching it in the deepest ignore file with one."""
+        path = (self.base + rel_path).replace(os.sep, '/')
+        for rules in reversed(self.rules):
+            pattern, negations = (rules.directories, rules.directory_negations) if is_dir else (rules.files, rules.file_negations)
+            if pattern is None:
+                continue
+            match = pattern.match(path, len(rules.prefix))
+            if match is not None:
+                return not negations[match.lastindex - 1]
+        return False
+
+
+def parse_line(line: str) -> Optional[Tuple[str, bool, bool]]:
+    """Return the pattern of a line of an ignore file, whether it is negated and whether it matches only
+    directories, or None for blank lines and comments."""
+    while line.endswith(' ') and not line.endswith('\\ '):
+        line = line[:-1]
+    if not line or line.startswith('#'):
+        return None
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    directory_only = line.endswith('/')
+    line = line.rstrip('/')
+    return (line, negated, directory_only) if line else None
+
+
+def translate(pattern: str) -> str:
+    """Return a regular expression without capturing groups matching the paths `pattern` matches.
+    Patterns with a slash other than a trailing one are relative to the directory of their ignore file,
+    others match a name at any depth below it."""
+    anchored = '/' in pattern
+    pattern = pattern[1:] if pattern.startswith('/') else pattern
+    parts = [] if anchored else ['(?:.*/)?']
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        at_start = position == 0 or pattern[position - 1] == '/'
+        if at_start and pattern.startswith('**/', position):
+            parts.append('(?:.*/)?')
+            position += 3
+            continue
+        if at_start and pattern.startswith('**', position) and position + 2 == len(pattern):
+            parts.append('.*')
+            position += 2
+            continue
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '\\' and position + 1 < len(pattern):
+            position += 1
+            parts.append(re.escape(pattern[position]))
+        elif char == '[':
+            end = position + 1
+            if end < len(pattern) and pattern[end] in '!^':
+                end += 1
+            if end < len(pattern) and pattern[end] == ']':
+                end += 1
+            end = pattern.find(']', end)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                members = pattern[position + 1:end].replace('\\', '\\\\')
+                if members[0] in '!^':
+                    members = '^/' + members[1:]
+                parts.append(f'[{members}]')
+                position = end
+        else:
+            parts.append(re.escape(char))
+        position += 1
+    return ''.join(parts)
+
+
+def combine(patterns: List[Tuple[str, bool]]) -> Tuple[Optional[Pattern], List[bool]]:
+    """Return a single regular expression matching the paths of any of `patterns`, last ones first,
+    and whether each of its groups is negated."""
+    if not patterns:
+        return None, []
+    patterns = patterns[::-1]
+    regex = '|'.join(f'({translate(pattern)})' for pattern, _ in patterns)
+    return re.compile(f'(?:{regex})\\Z', re.DOTALL), [negated for _, negated in patterns]
+
+
+def compile_rules(lines: List[str], prefix: str) -> Rules:
+    """Return the rules of an ignore file made of `lines`, found in the directory `prefix`."""
+    parsed = [rule for rule in map(parse_line, lines) if rule is not None]
+    files, file_negations = combine([(pattern, negated) for pattern, negated, directory_only in parsed
+                                     if not directory_only])
+    directories, directory_negations = combine([(pattern, negated) for pattern, negated, _ in parsed])
+    return Rules(prefix.replace(os.sep, '/'), files, file_negations, directories, directory_negations)
+
+
+def get_matcher(root: str, rel_dir: str) -> Matcher:
+    """Return the matcher for scanning the directory `rel_dir` of the working tree in `root`,
+    with the rules of every directory above it. The scan adds the rules of `rel_dir` itself."""
+    if rel_dir in ('', os.curdir):
+        return Matcher()
+    matcher = Matcher()
+    parts = rel_dir.split(os.sep)
+    for depth in range(len(parts)):
+        matcher = matcher.load(os.path.join(root, *parts[:depth]), ''.join(part + os.sep for part in parts[:depth]))
+    return Matcher(matcher.rules, rel_dir + os.sep)
+
+
+def is_path_ignored(root: str, rel_path: str, is_dir: bool) -> bool:
+    """Return whether `rel_path`, or any directory above it, is ignored in the working tree in `root`."""
+    if rel_path in ('', os.curdir):
+        return False
+    matcher = Matcher()
+    parts = rel_path.split(os.sep)
+    for depth in range(len(parts)):
+        matcher = matcher.load(os.path.join(root, *parts[:depth]), ''.join(part + os.sep for part in parts[:depth]))
+        if matcher.is_ignored(os.sep.join(parts[:depth + 1]), is_dir or depth + 1 < len(parts)):
+            return True
+    return False
@@ -0,0 +1,164 @@
+import os
+import struct
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import ignore_funcs
+import object_funcs
+import status_funcs
+import trace_funcs
+import utilities
+
+
+INDEX_SIGNATURE = b'WITI'
+INDEX_VERSION = 1
+HEADER = struct.Struct('>4sII')
+ENTRY = struct.Struct('>QqQ20sH')
+EMPTY_DIGEST = bytes(20)
+
+
+class IndexEntry(NamedTuple):
+    """A staged file: its content id and the stat data of the working file it was read from."""
+    object_id: str
+    size: int = 0
+    mtime_ns: int = 0
+    inode: int = 0
+
+
+def get_index_path(wit_dir: str) -> str:
+    """Return path to the index file of `wit_dir`."""
+    return os.path.join(wit_dir, 'index')
+
+
+@trace_funcs.traced('read index')
+def read_index(wit_dir: Optional[str] = None) -> Dict[str, IndexEntry]:
+    """Return the entries of the index file, rebuilding it from the staging area if it doesn't exist."""
+    if wit_dir is None:
+        wit_dir = utilities.get_wit_dir()
+    try:
+        with open(get_index_path(wit_dir), 'rb') as file_handler:
+            data = file_handler.read()
+    except FileNotFoundError:
+        return rebuild_index(wit_dir)
+    trace_funcs.count(trace_funcs.METADATA_OPENED)
+    trace_funcs.count(trace_funcs.BYTES_READ, len(data))
+
+    signature, version, count = HEADER.unpack_from(data)
+    if signature != INDEX_SIGNATURE or version != INDEX_VERSION:
+        return rebuild_index(wit_dir)
+    index = {}
+    offset = HEADER.size
+    for _ in range(count):
+        size, mtime_ns, inode, digest, path_length = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        rel_path = data[offset:offset + path_length].decode('utf-8').replace('/', os.sep)
+        offset += path_length
+        object_id = object_funcs.EMPTY_DIR if digest == EMPTY_DIGEST else digest.hex()
+        index[rel_path] = IndexEntry(object_id, size, mtime_ns, inode)
+    return index
+
+
+@trace_funcs.traced('write index')
+def write_index(index: Dict[str, IndexEntry], wit_dir: str) -> None:
+    """Atomically replace the index file of `wit_dir` with `index`."""
+    chunks = [HEADER.pack(INDEX_SIGNATURE, INDEX_VERSION, len(index))]
+    for rel_path in sorted(index):
+        entry = index[rel_path]
+        encoded_path = rel_path.replace(os.sep, '/').encode('utf-8')
+        digest = EMPTY_DIGEST if entry.object_id == object_funcs.EMPTY_DIR else bytes.fromhex(entry.object_id)
+        chunks.append(ENTRY.pack(entry.size, entry.mtime_ns, entry.inode, digest, len(encoded_path)))
+        chunks.append(encoded_path)
+    index_path = get_index_path(wit_dir)
+    temp_path = f'{index_path}.tmp'
+    data = b''.join(chunks)
+    with open(temp_path, 'wb') as file_handler:
+        file_handler.write(data)
+    os.replace(temp_path, index_path)
+    trace_funcs.count(trace_funcs.METADATA_OPENED)
+    trace_funcs.count(trace_funcs.BYTES_WRITTEN, len(data))
+
+
+def rebuild_index(wit_dir: str) -> Dict[str, IndexEntry]:
+    """Return index entries for every file in the staging area, with no working file stat data."""
+    staging_area = os.path.join(wit_dir, 'staging_area')
+    return {rel_path: IndexEntry(object_id)
+            for rel_path, object_id in object_funcs.get_tree(staging_area).items()}
+
+
+def make_entry(path: str, object_id: Optional[str] = None, stat: Optional[os.stat_result] = None) -> IndexEntry:
+    """Return an index entry for the working file in `path`, hashing it unless `object_id` is known."""
+    if stat is None:
+        stat = os.stat(path)
+        trace_funcs.count(trace_funcs.FILES_STATED)
+    if status_funcs.is_directory(stat):
+        return IndexEntry(object_funcs.EMPTY_DIR, 0, stat.st_mtime_ns, stat.st_ino)
+    if object_id is None:
+        object_id = object_funcs.hash_file(path)
+    return IndexEntry(object_id, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def is_unchanged(entry: IndexEntry, stat: os.stat_result, index_mtime_ns: int) -> bool:
+    """Return whether the stat data in `stat` proves the file still matches `entry`.
+    Files modified in the same tick the index was written are never trusted."""
+    return (entry.size == stat.st_size
+            and entry.mtime_ns == stat.st_mtime_ns
+            and entry.inode == stat.st_ino
+            and entry.mtime_ns < index_mtime_ns)
+
+
+def get_index_mtime(wit_dir: str) -> int:
+    """Return the modification time of the index file, or 0 if it doesn't exist."""
+    try:
+        return os.stat(get_index_path(wit_dir)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def stage_path(path: str, wit_dir_parent: str, index: Dict[str, IndexEntry]) -> None:
+    """Replace the entries of `index` under `path` with the files currently found there.
+    Ignored files are left out, unless they were already staged."""
+    rel_path = os.path.relpath(path, wit_dir_parent)
+    if rel_path == os.curdir:
+        rel_path = ''
+    prefix = rel_path + os.sep if rel_path else ''
+    staged = [key[len(prefix):] for key in index if key.startswith(prefix)]
+    if rel_path:
+        unstage_path(rel_path, index)
+    else:
+        index.clear()
+    if os.path.isdir(path) and os.listdir(path):
+        snapshot = status_funcs.scan_tree(path, ignore_funcs.get_matcher(wit_dir_parent, rel_path))
+        scanned = set(snapshot)
+        status_funcs.add_tracked_files(path, snapshot, staged)
+        for file_rel_path in snapshot:
+            if file_rel_path not in scanned:
+                utilities.copy_to_staging_area(os.path.join(path, file_rel_path), wit_dir_parent)
+        entries = utilities.run_jobs(lambda item: make_entry(os.path.join(path, item[0]), stat=item[1]),
+                                     snapshot.items())
+        for file_rel_path, entry in zip(snapshot, entries):
+            index[os.path.join(rel_path, file_rel_path)] = entry
+    elif os.path.exists(path):
+        index[rel_path] = make_entry(path)
+
+
+def unstage_path(rel_path: str, index: Dict[str, IndexEntry]) -> None:
+    """Remove `rel_path` and everything under it from `index`."""
+    prefix = rel_path + os.sep
+    for key in [key for key in index if key == rel_path or key.startswith(prefix)]:
+        del index[key]
+
+
+def get_working_id(wit_dir_parent: str, rel_path: str, stat: os.stat_result,
+                   index: Dict[str, IndexEntry], index_mtime_ns: int) -> Tuple[str, bool]:
+    """Return the content id of the staged working file `rel_path`, and whether its entry in `index` was refreshed.
+    The file is only read if its stat data changed since it was staged; if reading proves it unchanged,
+    its entry is refreshed, for the index file to be written again."""
+    entry = index[rel_path]
+    if status_funcs.is_directory(stat):
+        return object_funcs.EMPTY_DIR, False
+    if entry.object_id != object_funcs.EMPTY_DIR and is_unchanged(entry, stat, index_mtime_ns):
+        return entry.object_id, False
+    new_entry = make_entry(os.path.join(wit_dir_parent, rel_path), stat=stat)
+    if new_entry.object_id != entry.object_id:
+        return new_entry.object_id, False
+    index[rel_path] = new_entry
+    return new_entry.object_id, True
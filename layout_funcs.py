@@ -0,0 +1,162 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import history_funcs
+import metadata_funcs
+import prune_funcs
+import refs_funcs
+
+
+SHORT_ID = 7
+ASCII_SYMBOLS = {'node': '*', 'line': '|', 'fork': '\\', 'join': '/', 'across': '_'}
+UNICODE_SYMBOLS = {'node': '●', 'line': '│', 'fork': '╲', 'join': '╱', 'across': '─'}
+
+
+class LaneRow(NamedTuple):
+    """A commit placed in a column, with the lanes of descent running past it.
+    `incoming` are the lanes active above the commit, `outgoing` those active below it."""
+    position: int
+    column: int
+    joined: List[int]
+    forked: Optional[int]
+    incoming: List[bool]
+    outgoing: List[bool]
+
+
+def get_positions(wit_dir: str, all_commits: bool = False) -> Tuple[history_funcs.CommitGraph, List[int]]:
+    """Return the commit graph and the positions in it of the commits to draw: the current commit and its
+    ancestors, or every commit reachable from a branch if `all_commits`. Newest commits come first; the commit
+    graph stores parents before children, so reversing its order keeps every child before its parents."""
+    head_id = refs_funcs.get_refs(wit_dir).head
+    # Found first, since it rebuilds the commit graph if it is out of date.
+    reachable = prune_funcs.get_reachable_positions(wit_dir) if all_commits else []
+    graph = history_funcs.read_commit_graph(wit_dir)
+    if head_id is not None and head_id not in graph.positions:
+        graph = history_funcs.write_commit_graph(wit_dir)
+    if all_commits:
+        positions = reachable
+    elif head_id is not None:
+        positions = list(history_funcs.iter_ancestors(graph, head_id))
+    else:
+        positions = []
+    positions.sort(reverse=True)
+    return graph, positions
+
+
+def get_free_column(lanes: List[Optional[int]], start: int = 0) -> int:
+    """Return the first unused column of `lanes` from `start`, adding one if all are used."""
+    for column in range(start, len(lanes)):
+        if lanes[column] is None:
+            return column
+    lanes.append(None)
+    return len(lanes) - 1
+
+
+def walk_lanes(graph: history_funcs.CommitGraph, positions: List[int]) -> Iterator[LaneRow]:
+    """Yield a row for every commit in `positions`, which must list children before parents.
+    Each column is a lane waiting for the next commit of a line of descent. Lanes waiting for the same
+    commit join into the leftmost one when it is reached, and a merge forks a lane for its second parent."""
+    lanes: List[Optional[int]] = []
+    for position in positions:
+        waiting = [column for column, expected in enumerate(lanes) if expected == position]
+        column = waiting[0] if waiting else get_free_column(lanes)
+        lanes[column] = position
+        incoming = [expected is not None for expected in lanes]
+        joined = waiting[1:]
+        for joined_column in joined:
+            lanes[joined_column] = None
+        parents = graph.parents[position]
+        lanes[column] = parents[0] if parents else None
+        forked = None
+        for parent in parents[1:]:
+            forked = get_free_column(lanes, column + 1)
+            lanes[forked] = parent
+        while lanes and lanes[-1] is None:
+            lanes.pop()
+        yield LaneRow(position, column, joined, forked, incoming, [expected is not None for expected in lanes])
+
+
+def draw_edges(active: List[bool], start: int, end: int, edge: str, symbols: Dict[str, str]) -> str:
+    """Return a line of the lanes in `active`, with `edge` between the columns `start` and `end` > `start`."""
+    cells = []
+    for is_active in active:
+        cells.extend((symbols['line'] if is_active else ' ', ' '))
+    for cell in range(2 * start + 1, 2 * end - 1):
+        if cells[cell] == ' ':
+            cells[cell] = symbols['across']
+    cells[2 * end - 1] = edge
+    return ''.join(cells).rstrip()
+
+
+def render_row(row: LaneRow, symbols: Dict[str, str]) -> Tuple[List[str], str, List[str]]:
+    """Return the lines drawn above a commit's row, the commit's own row, and the lines drawn below it."""
+    above = []
+    active = list(row.incoming)
+    for joined_column in reversed(row.joined):
+        active[joined_column] = False
+        above.append(draw_edges(active, row.column, joined_column, symbols['join'], symbols))
+    node = ''.join(symbols['node'] if column == row.column else symbols['line'] if is_active else ' '
+                   for column, is_active in enumerate(active))
+    below = []
+    if row.forked is not None:
+        outgoing = list(row.outgoing)
+        outgoing[row.forked] = False
+        below.append(draw_edges(outgoing, row.column, row.forked, symbols['fork'], symbols))
+    return above, ' '.join(node).rstrip(), below
+
+
+def get_branch_names(wit_dir: str) -> Dict[str, List[str]]:
+    """Return the names of the branches pointing at each commit, 'HEAD' included."""
+    names: Dict[str, List[str]] = {}
+    for name, commit_id in refs_funcs.get_refs(wit_dir).branches.items():
+        names.setdefault(commit_id, []).append(name)
+    return names
+
+
+def iter_text_graph(graph: history_funcs.CommitGraph, positions: List[int], wit_dir: str,
+                    unicode: bool = False) -> Iterator[str]:
+    """Yield the lines of a text drawing of the commits in `positions`, one row per commit, as each is laid out."""
+    symbols = UNICODE_SYMBOLS if unicode else ASCII_SYMBOLS
+    drawn: Set[str] = {graph.ids[position] for position in positions}
+    messages = {commit.id: commit.message for commit in metadata_funcs.iter_commits(wit_dir) if commit.id in drawn}
+    names = get_branch_names(wit_dir)
+    for row in walk_lanes(graph, positions):
+        above, node, below = render_row(row, symbols)
+        yield from above
+        commit_id = graph.ids[row.position]
+        label = commit_id[:SHORT_ID]
+        if commit_id in names:
+            label += f' ({", ".join(names[commit_id])})'
+        if messages.get(commit_id):
+            label += f' {messages[commit_id]}'
+        yield f'{node}  {label}'
+        yield from below
+
+
+def get_layered_layout(graph: history_funcs.CommitGraph, positions: List[int]) -> Dict[str, Tuple[int, int]]:
+    """Return the column and row of every commit in `positions`: the row is its generation number,
+    and the column its lane, moved right if another commit of its generation already took it."""
+    layout: Dict[str, Tuple[int, int]] = {}
+    taken: Dict[int, Set[int]] = {}
+    for row in walk_lanes(graph, positions):
+        generation = graph.generations[row.position]
+        columns = taken.setdefault(generation, set())
+        column = row.column
+        while column in columns:
+            column += 1
+        columns.add(column)
+        layout[graph.ids[row.position]] = (column, generation)
+    return layout
+
+
+def iter_dot(graph: history_funcs.CommitGraph, positions: List[int], wit_dir: str) -> Iterator[str]:
+    """Yield the lines of a Graphviz description of the commits in `positions`, labelled with their branches."""
+    names = get_branch_names(wit_dir)
+    yield 'digraph wit {'
+    yield '    node [shape=box, fontname="monospace"];'
+    for position in positions:
+        commit_id = graph.ids[position]
+        label = '\\n'.join([commit_id[:SHORT_ID]] + names.get(commit_id, [])).replace('"', '\\"')
+        yield f'    "{commit_id}" [label="{label}"];'
+        for parent in graph.parents[position]:
+            yield f'    "{commit_id}" -> "{graph.ids[parent]}";'
+    yield '}'
@@ -0,0 +1,100 @@
+import calendar
+import os
+import re
+import time
+from typing import Dict, Iterator, List, Optional, Pattern, Sequence
+
+import history_funcs
+import metadata_funcs
+import object_funcs
+
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_date(date: str) -> int:
+    """Return the timestamp of `date`, given in seconds since the epoch or as an ISO date and time in UTC.
+    Raise ValueError if it is neither."""
+    if date.isdigit():
+        return int(date)
+    for date_format in DATE_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(date, date_format))
+        except ValueError:
+            continue
+    raise ValueError(f'Invalid date: `{date}`. Use YYYY-MM-DD [HH:MM[:SS]] or seconds since the epoch.')
+
+
+def compile_pattern(grep: str) -> Pattern[str]:
+    """Return the regular expression `grep`. Raise ValueError if it is invalid."""
+    try:
+        return re.compile(grep)
+    except re.error as err:
+        raise ValueError(f'Invalid pattern: `{grep}`: {err}.') from None
+
+
+def get_path_tree(commit_id: str, paths: Sequence[str], wit_dir: str) -> Dict[str, str]:
+    """Return the entries of image `commit_id` that are one of `paths` or under one of them."""
+    tree_id = object_funcs.get_tree_id(commit_id, wit_dir)
+    if tree_id is not None:
+        path_tree: Dict[str, str] = {}
+        for path in paths:
+            path_tree.update(object_funcs.read_path(tree_id, path, wit_dir))
+        return path_tree
+    prefixes = tuple(path + os.sep for path in paths)
+    return {rel_path: object_id for rel_path, object_id in object_funcs.read_manifest(commit_id, wit_dir).items()
+            if rel_path in paths or rel_path.startswith(prefixes)}
+
+
+def iter_log(wit_dir: str, start_id: str, since: Optional[int] = None, until: Optional[int] = None,
+             grep: Optional[str] = None, paths: Sequence[str] = ()) -> Iterator[metadata_funcs.Commit]:
+    """Yield `start_id` and its ancestors, newest first, as they are reached by the walk.
+    Only commits dated between `since` and `until`, whose message matches the regular expression `grep`,
+    and that changed one of `paths` relative to every one of their parents are yielded.
+    The walk stops at the first commit older than `since`. Raise ValueError, before walking, if `grep` is invalid."""
+    pattern = compile_pattern(grep) if grep is not None else None
+    return walk_log(wit_dir, start_id, since, until, pattern, paths)
+
+
+def walk_log(wit_dir: str, start_id: str, since: Optional[int], until: Optional[int],
+             pattern: Optional[Pattern[str]], paths: Sequence[str]) -> Iterator[metadata_funcs.Commit]:
+    """Yield the commits `iter_log` does, matching their messages against `pattern`."""
+    # Trees of `paths` are kept only until the commit they belong to is reached.
+    path_trees: Dict[str, Dict[str, str]] = {}
+    graph_file, (position,) = history_funcs.open_commit_graph(wit_dir, start_id)
+    try:
+        for record in history_funcs.iter_by_date(graph_file, position):
+            if since is not None and record.timestamp < since:
+                return
+            if paths:
+                tree = path_trees.pop(record.id, None)
+                if tree is None:
+                    tree = get_path_tree(record.id, paths, wit_dir)
+                parent_trees: List[Dict[str, str]] = []
+                for parent in record.parents:
+                    parent_id = graph_file.get(parent).id
+                    if parent_id not in path_trees:
+                        path_trees[parent_id] = get_path_tree(parent_id, paths, wit_dir)
+                    parent_trees.append(path_trees[parent_id])
+                if any(tree == parent_tree for parent_tree in parent_trees or [{}]):
+                    continue
+            if until is not None and record.timestamp > until:
+                continue
+            commit = metadata_funcs.get_commit(record.id, wit_dir)
+            if commit is None or pattern is not None and not pattern.search(commit.message or ''):
+                continue
+            yield commit
+    finally:
+        graph_file.close()
+
+
+def format_commit(commit: metadata_funcs.Commit, names: List[str]) -> str:
+    """Return the description of `commit` printed by `log`, mentioning the branches in `names`."""
+    lines = [f'commit {commit.id}' + (f' ({", ".join(names)})' if names else '')]
+    if len(commit.parents) > 1:
+        lines.append('Merge: ' + ' '.join(parent[:7] for parent in commit.parents))
+    lines.append(f'Date:   {metadata_funcs.format_date(commit.date)}')
+    if commit.message:
+        lines.extend(['', f'    {commit.message}'])
+    lines.append('')
+    return '\n'.join(lines)
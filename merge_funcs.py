@@ -1,22 +1,30 @@
 import os
 from typing import Optional
 
-import graph_funcs
+import history_funcs
+import index_funcs
+import object_funcs
+import refs_funcs
 import status_funcs
 import utilities
 
 
 def get_shared_parent(branch_name: str, wit_dir: Optional[str] = None) -> str:
-    """Return commit id of the shared parent of `branch_name` and the current image."""
+    """Return commit id of the shared parent of `branch_name` and the current image.
+    When there are several best shared parents, the one with the highest generation is used."""
     if wit_dir is None:
         wit_dir = utilities.get_wit_dir()
 
     branch_id = utilities.get_branch_id(branch_name, wit_dir)
-    branch_adjacency = graph_funcs.get_adjacency(wit_dir, branch_id=branch_id)
-    for parent in graph_funcs.get_adjacency(wit_dir):
-        if parent in branch_adjacency or parent in branch_adjacency.values():
-            return parent
-    return ''
+    head_id = refs_funcs.get_refs(wit_dir).head
+    if head_id is None:
+        return ''
+    graph_file, positions = history_funcs.open_commit_graph(wit_dir, head_id, branch_id)
+    try:
+        bases = history_funcs.get_merge_bases(graph_file, *positions)
+    finally:
+        graph_file.close()
+    return bases[0] if bases else ''
 
 
 def update_staging_area(parent_id: str, branch_name: str, wit_dir_parent: Optional[str] = None) -> None:
@@ -25,10 +33,11 @@ def update_staging_area(parent_id: str, branch_name: str, wit_dir_parent: Option
         wit_dir_parent = utilities.get_wit_dir_parent()
     wit_dir = os.path.join(wit_dir_parent, '.wit')
     branch_id = utilities.get_branch_id(branch_name, wit_dir)
-    parent_path, branch_path = (os.path.join(wit_dir, 'images', commit_id) for commit_id in (parent_id, branch_id))
-    changed = status_funcs.get_changed_files(parent_path, branch_path)
-    nonexistent = status_funcs.get_nonexistent_files(parent_path, branch_path)
-    for file_list in (changed, nonexistent):
-        for file in file_list:
-            new_path = utilities.get_new_path(file, wit_dir_parent, additions=['images', branch_id])
-            utilities.copy_files(mode='a', path=new_path)
\ No newline at end of file
+    staging_area = os.path.join(wit_dir, 'staging_area')
+    index = index_funcs.read_index(wit_dir)
+    diff, branch_ids = status_funcs.diff_images(parent_id, branch_id, wit_dir)
+    for rel_path in diff.added + diff.modified + diff.type_changed:
+        object_id = branch_ids[rel_path]
+        object_funcs.checkout_object(object_id, os.path.join(staging_area, rel_path), wit_dir, link=True)
+        index[rel_path] = index_funcs.IndexEntry(object_id)
+    index_funcs.write_index(index, wit_dir)
\ No newline at end of file
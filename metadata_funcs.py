@@ -0,0 +1,142 @@
+import calendar
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import trace_funcs
+import utilities
+
+
+DATE_FORMAT = '%a %b %d %H:%M:%S %Y %z'
+MIN_PREFIX = 4
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS commits (
+    id TEXT PRIMARY KEY,
+    parents TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    message TEXT,
+    tree TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS commits_date ON commits (date);
+'''
+
+
+class Commit(NamedTuple):
+    """Metadata of an image."""
+    id: str
+    parents: List[str]
+    date: int
+    message: Optional[str]
+    tree: str
+
+
+connections: Dict[str, sqlite3.Connection] = {}
+
+
+def connect(wit_dir: Optional[str] = None) -> sqlite3.Connection:
+    """Return the connection to the metadata database of `wit_dir`, creating it on first use."""
+    if wit_dir is None:
+        wit_dir = utilities.get_wit_dir()
+    connection = connections.get(wit_dir)
+    if connection is None:
+        database_path = os.path.join(wit_dir, 'metadata.db')
+        is_new = not os.path.exists(database_path)
+        trace_funcs.count(trace_funcs.METADATA_OPENED)
+        connection = connections[wit_dir] = sqlite3.connect(database_path)
+        with connection:
+            connection.executescript(SCHEMA)
+            if is_new:
+                import_metadata_files(connection, wit_dir)
+    return connection
+
+
+def import_metadata_files(connection: sqlite3.Connection, wit_dir: str) -> None:
+    """Insert the metadata files written before the database existed."""
+    images_dir = os.path.join(wit_dir, 'images')
+    for file_name in os.listdir(images_dir):
+        if not file_name.endswith('.txt'):
+            continue
+        with open(os.path.join(images_dir, file_name), 'r') as file_handler:
+            metadata = dict(line.rstrip('\n').split('=', 1) for line in file_handler if '=' in line)
+        parents = [parent for parent in metadata['parent'].split(', ') if parent != 'None']
+        date = calendar.timegm(time.strptime(metadata['date'], DATE_FORMAT))
+        # Images from before the database have no tree id; their manifest is found by commit id.
+        connection.execute('INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?, ?)',
+                           (file_name[:-len('.txt')], ' '.join(parents), date, metadata.get('message'), ''))
+
+
+def row_to_commit(row: tuple) -> Commit:
+    """Return the image described by a row of the commits table."""
+    commit_id, parents, date, message, tree = row
+    return Commit(commit_id, parents.split(), date, message, tree)
+
+
+def insert_commit(commit: Commit, wit_dir: str) -> None:
+    """Record the metadata of a new image."""
+    connection = connect(wit_dir)
+    with connection:
+        connection.execute('INSERT INTO commits VALUES (?, ?, ?, ?, ?)',
+                           (commit.id, ' '.join(commit.parents), commit.date, commit.message, commit.tree))
+
+
+def insert_commits(commits: Iterable[Commit], wit_dir: str) -> None:
+    """Record the metadata of images received from another repository in one transaction,
+    skipping those already recorded."""
+    connection = connect(wit_dir)
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?, ?)',
+                               ((commit.id, ' '.join(commit.parents), commit.date, commit.message, commit.tree)
+                                for commit in commits))
+
+
+def get_commit(commit_id: str, wit_dir: Optional[str] = None) -> Optional[Commit]:
+    """Return the metadata of image `commit_id`, or None if it doesn't exist."""
+    row = connect(wit_dir).execute('SELECT * FROM commits WHERE id = ?', (commit_id,)).fetchone()
+    return row_to_commit(row) if row else None
+
+
+def count_commits(wit_dir: Optional[str] = None) -> int:
+    """Return the number of images."""
+    return connect(wit_dir).execute('SELECT COUNT(*) FROM commits').fetchone()[0]
+
+
+def delete_commits(commit_ids: List[str], wit_dir: Optional[str] = None) -> None:
+    """Remove the metadata of the images in `commit_ids`."""
+    connection = connect(wit_dir)
+    with connection:
+        connection.executemany('DELETE FROM commits WHERE id = ?', ((commit_id,) for commit_id in commit_ids))
+
+
+def commit_exists(commit_id: str, wit_dir: Optional[str] = None) -> bool:
+    """Return whether image `commit_id` exists."""
+    return connect(wit_dir).execute('SELECT 1 FROM commits WHERE id = ?', (commit_id,)).fetchone() is not None
+
+
+def resolve_commit_id(name: str, wit_dir: Optional[str] = None) -> Optional[str]:
+    """Return the full id of the image whose id is `name`, or starts with `name`.
+    Raise ValueError if more than one image id starts with `name`."""
+    if commit_exists(name, wit_dir):
+        return name
+    name = name.lower()
+    if len(name) < MIN_PREFIX or any(char not in '0123456789abcdef' for char in name):
+        return None
+    # Ids are lowercase hex, so every id starting with `name` sorts below `name` followed by 'g'.
+    rows = connect(wit_dir).execute('SELECT id FROM commits WHERE id >= ? AND id < ? LIMIT 2',
+                                    (name, f'{name}g')).fetchall()
+    if len(rows) > 1:
+        raise ValueError(f'Ambiguous commit id: {name}')
+    return rows[0][0] if rows else None
+
+
+def iter_commits(wit_dir: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None) -> Iterator[Commit]:
+    """Yield every image, oldest first, optionally only those dated between `since` and `until`."""
+    query = 'SELECT * FROM commits WHERE date >= ? AND date <= ? ORDER BY date, id'
+    bounds = (since if since is not None else -2 ** 63, until if until is not None else 2 ** 63 - 1)
+    for row in connect(wit_dir).execute(query, bounds):
+        yield row_to_commit(row)
+
+
+def format_date(date: int) -> str:
+    """Return `date` formatted the way image metadata has always displayed it."""
+    return time.strftime(DATE_FORMAT, time.gmtime(date))
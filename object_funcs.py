@@ -0,0 +1,317 @@
+import hashlib
+import mmap
+import os
+import threading
+from typing import Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+import chunk_funcs
+import metadata_funcs
+import pack_funcs
+import status_funcs
+import trace_funcs
+import utilities
+
+
+BLOCK_SIZE = 1 << 16
+EMPTY_DIR = '-'
+BLOB = 'blob'
+TREE = 'tree'
+EMPTY_TREE = hashlib.sha1(b'').hexdigest()
+
+
+class TreeEntry(NamedTuple):
+    """A file or a directory listed in a tree object, with the id of its contents or of its own tree object."""
+    kind: str
+    object_id: str
+
+
+def hash_file(path: str) -> str:
+    """Return the sha1 hex digest of the contents of `path`.
+    Large files are hashed straight from a memory map."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_handler:
+        size = os.fstat(file_handler.fileno()).st_size
+        trace_funcs.count(trace_funcs.FILES_READ)
+        trace_funcs.count(trace_funcs.BYTES_READ, size)
+        if size >= chunk_funcs.CHUNK_THRESHOLD:
+            with mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+        else:
+            for block in iter(lambda: file_handler.read(BLOCK_SIZE), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def get_object_path(object_id: str, wit_dir: str) -> str:
+    """Return path to the object `object_id` in the object store."""
+    return os.path.join(wit_dir, 'objects', object_id[:2], object_id[2:])
+
+
+def store_file(path: str, wit_dir: str, object_id: Optional[str] = None, base_id: Optional[str] = None) -> str:
+    """Add the contents of `path` to the object store, unless already stored, and return its id.
+    Files above `chunk_funcs.CHUNK_THRESHOLD` are stored as a list of deduplicated chunks, reusing those of
+    `base_id`, a previous version of the file, where the contents didn't change."""
+    if object_id is None:
+        object_id = hash_file(path)
+    object_path = get_object_path(object_id, wit_dir)
+    if has_object(object_id, wit_dir):
+        return object_id
+    if os.path.getsize(path) >= chunk_funcs.CHUNK_THRESHOLD:
+        chunk_funcs.store_chunked_file(path, object_id, wit_dir, base_id)
+    else:
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = f'{object_path}.{threading.get_ident()}.tmp'
+        utilities.copy_file(path, temp_path, link=True)
+        os.replace(temp_path, object_path)
+    return object_id
+
+
+def has_object(object_id: str, wit_dir: str) -> bool:
+    """Return whether `object_id` is in the object store, either loose or packed."""
+    object_path = get_object_path(object_id, wit_dir)
+    return (os.path.exists(object_path) or os.path.exists(chunk_funcs.get_chunks_path(object_id, wit_dir))
+            or pack_funcs.find_object(object_id, wit_dir) is not None)
+
+
+def read_object(object_id: str, wit_dir: str) -> bytes:
+    """Return the contents of the object `object_id`, either loose or packed."""
+    try:
+        with open(get_object_path(object_id, wit_dir), 'rb') as file_handler:
+            content = file_handler.read()
+    except FileNotFoundError:
+        chunk_ids = chunk_funcs.read_chunk_list(object_id, wit_dir)
+        if chunk_ids is not None:
+            return b''.join(read_object(chunk_id, wit_dir) for chunk_id in chunk_ids)
+        content = pack_funcs.read_packed_object(object_id, wit_dir)
+        if content is None:
+            raise
+        return content
+    trace_funcs.count(trace_funcs.FILES_READ)
+    trace_funcs.count(trace_funcs.BYTES_READ, len(content))
+    return content
+
+
+def get_tree(path: str, store: bool = False, wit_dir: Optional[str] = None) -> Dict[str, str]:
+    """Return a mapping of every file in `path` directory tree, relative to `path`, to its content id.
+    if `store`, add the contents to the object store of `wit_dir` as well."""
+    def get_object_id(item: Tuple[str, os.stat_result]) -> str:
+        rel_path, stat = item
+        if status_funcs.is_directory(stat):
+            return EMPTY_DIR
+        if store and wit_dir is not None:
+            return store_file(os.path.join(path, rel_path), wit_dir)
+        return hash_file(os.path.join(path, rel_path))
+
+    snapshot = status_funcs.scan_tree(path)
+    return dict(zip(snapshot, utilities.run_jobs(get_object_id, snapshot.items())))
+
+
+def write_loose(object_id: str, content: bytes, wit_dir: str, suffix: str = '') -> None:
+    """Atomically write `content` as the loose object `object_id`."""
+    object_path = get_object_path(object_id, wit_dir) + suffix
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    temp_path = f'{object_path}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as file_handler:
+        file_handler.write(content)
+    os.replace(temp_path, object_path)
+    trace_funcs.count(trace_funcs.BYTES_WRITTEN, len(content))
+
+
+def store_bytes(content: bytes, wit_dir: str) -> str:
+    """Add `content` to the object store, unless already stored, and return its id."""
+    object_id = hashlib.sha1(content).hexdigest()
+    if not has_object(object_id, wit_dir):
+        write_loose(object_id, content, wit_dir)
+    return object_id
+
+
+def write_tree(tree: Dict[str, str], wit_dir: str) -> str:
+    """Store a tree object for every directory of `tree`, listing the content id of each of its files
+    and the tree id of each of its subdirectories, and return the id of the root's.
+    A directory's id covers everything under it, so equal ids mean equal subtrees."""
+    children: Dict[str, Dict[str, TreeEntry]] = {'': {}}
+    for rel_path, object_id in tree.items():
+        if object_id == EMPTY_DIR:
+            children.setdefault(rel_path, {})
+        else:
+            children.setdefault(os.path.dirname(rel_path), {})[os.path.basename(rel_path)] = TreeEntry(BLOB, object_id)
+    for directory in list(children):
+        while directory:
+            directory = os.path.dirname(directory)
+            children.setdefault(directory, {})
+    # Subdirectories are written before their parents, which need their ids.
+    for directory in sorted(children, key=lambda directory: directory.count(os.sep) if directory else -1, reverse=True):
+        if directory:
+            tree_id = store_bytes(format_tree(children[directory]), wit_dir)
+            children[os.path.dirname(directory)][os.path.basename(directory)] = TreeEntry(TREE, tree_id)
+    return store_bytes(format_tree(children['']), wit_dir)
+
+
+def format_tree(entries: Mapping[str, TreeEntry]) -> bytes:
+    """Return the contents of the tree object listing `entries`."""
+    return ''.join(f'{entries[name].kind} {entries[name].object_id} {name}\n' for name in sorted(entries)).encode('utf-8')
+
+
+def is_tree(content: bytes) -> bool:
+    """Return whether `content` is a tree object rather than a flat manifest of an older image."""
+    return not content or content.startswith((f'{BLOB} '.encode(), f'{TREE} '.encode()))
+
+
+def read_tree(tree_id: str, wit_dir: str) -> Dict[str, TreeEntry]:
+    """Return the entries of the tree object `tree_id`, keyed by name."""
+    entries: Dict[str, TreeEntry] = {}
+    if tree_id == EMPTY_TREE:
+        return entries
+    for line in read_object(tree_id, wit_dir).decode('utf-8').splitlines():
+        kind, object_id, name = line.split(' ', 2)
+        entries[name] = TreeEntry(kind, object_id)
+    return entries
+
+
+def get_path_key(rel_path: str) -> List[str]:
+    """Return the key sorting relative paths in the order of a scan of the working tree: by name within
+    each directory, with the contents of a directory right after the paths sorting before its name."""
+    return rel_path.split(os.sep)
+
+
+def iter_entry(entry: TreeEntry, rel_path: str, wit_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yield every file under `entry`, found in `rel_path`, with its content id, in the order of a scan of the
+    working tree. An empty directory has the content id `EMPTY_DIR`. Only the tree objects along the current
+    path are held in memory."""
+    if entry.kind == BLOB:
+        yield rel_path, entry.object_id
+    elif entry.object_id == EMPTY_TREE:
+        yield rel_path, EMPTY_DIR
+    else:
+        yield from iter_tree(entry.object_id, wit_dir, rel_path + os.sep)
+
+
+def iter_tree(tree_id: str, wit_dir: str, prefix: str = '') -> Iterator[Tuple[str, str]]:
+    """Yield every file in the tree object `tree_id`, with `prefix` prepended, and its content id, like `iter_entry`."""
+    for name, entry in read_tree(tree_id, wit_dir).items():
+        yield from iter_entry(entry, prefix + name, wit_dir)
+
+
+def flatten_entry(entry: TreeEntry, rel_path: str, wit_dir: str) -> Dict[str, str]:
+    """Return a mapping of every file under `entry`, found in `rel_path`, to its content id.
+    An empty directory maps to `EMPTY_DIR`."""
+    return dict(iter_entry(entry, rel_path, wit_dir))
+
+
+def flatten_tree(tree_id: str, wit_dir: str, prefix: str = '') -> Dict[str, str]:
+    """Return a mapping of every file in the tree object `tree_id`, with `prefix` prepended, to its content id."""
+    return dict(iter_tree(tree_id, wit_dir, prefix))
+
+
+def get_tree_id(commit_id: str, wit_dir: str) -> Optional[str]:
+    """Return the id of the root tree object of image `commit_id`, `EMPTY_TREE` if there is no image,
+    or None if the image predates tree objects."""
+    if not commit_id or commit_id == 'None':
+        return EMPTY_TREE
+    commit = metadata_funcs.get_commit(commit_id, wit_dir)
+    if commit is None or not commit.tree or not is_tree(read_object(commit.tree, wit_dir)):
+        return None
+    return commit.tree
+
+
+def iter_image(commit_id: str, wit_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yield every file in image `commit_id` with its content id, like `iter_tree`.
+    Images created before tree objects are read whole and sorted."""
+    tree_id = get_tree_id(commit_id, wit_dir)
+    if tree_id is None:
+        yield from sorted(read_manifest(commit_id, wit_dir).items(), key=lambda item: get_path_key(item[0]))
+    else:
+        yield from iter_tree(tree_id, wit_dir)
+
+
+def read_path(tree_id: str, rel_path: str, wit_dir: str) -> Dict[str, str]:
+    """Return a mapping of the file `rel_path` of the tree object `tree_id`, or of every file under the
+    directory `rel_path`, to its content id. Only the tree objects along `rel_path` are read."""
+    if rel_path in ('', os.curdir):
+        return flatten_tree(tree_id, wit_dir)
+    *directories, name = rel_path.split(os.sep)
+    for directory in directories:
+        entry = read_tree(tree_id, wit_dir).get(directory)
+        if entry is None or entry.kind != TREE:
+            return {}
+        tree_id = entry.object_id
+    entry = read_tree(tree_id, wit_dir).get(name)
+    return flatten_entry(entry, rel_path, wit_dir) if entry is not None else {}
+
+
+def parse_manifest(content: str) -> Dict[str, str]:
+    """Return the mapping of paths to content ids listed in a manifest."""
+    tree = {}
+    for line in content.splitlines():
+        object_id, rel_path = line.split(' ', 1)
+        tree[rel_path.replace('/', os.sep)] = object_id
+    return tree
+
+
+@trace_funcs.traced('read manifest')
+def read_manifest(commit_id: str, wit_dir: Optional[str] = None) -> Dict[str, str]:
+    """Return a mapping of every file in image `commit_id` to its content id."""
+    if wit_dir is None:
+        wit_dir = utilities.get_wit_dir()
+    if not commit_id or commit_id == 'None':
+        return {}
+    commit = metadata_funcs.get_commit(commit_id, wit_dir)
+    if commit is not None and commit.tree:
+        content = read_object(commit.tree, wit_dir)
+        if is_tree(content):
+            return flatten_tree(commit.tree, wit_dir)
+        # Images created before tree objects store a flat manifest.
+        return parse_manifest(content.decode('utf-8'))
+    manifest_path = os.path.join(wit_dir, 'images', commit_id)
+    if os.path.isdir(manifest_path):
+        # Images created before the object store are plain directory copies.
+        return get_tree(manifest_path, store=True, wit_dir=wit_dir)
+    with open(manifest_path, 'r') as manifest:
+        return parse_manifest(manifest.read())
+
+
+@trace_funcs.traced('store objects')
+def create_image(tree: Dict[str, str], staging_area: str, wit_dir: str, base_id: str = '') -> str:
+    """Store the files of `tree` that are not yet in the object store, and return the id of its root tree object.
+    Large files are chunked again only where they changed from their version in image `base_id`,
+    found by reading only the tree objects along their paths."""
+    base_tree_id = get_tree_id(base_id, wit_dir) if base_id else None
+
+    def store(rel_path: str, object_id: str) -> str:
+        path = os.path.join(staging_area, rel_path)
+        base_file_id = None
+        if (base_tree_id is not None and not has_object(object_id, wit_dir)
+                and os.path.getsize(path) >= chunk_funcs.CHUNK_THRESHOLD):
+            base_file_id = read_path(base_tree_id, rel_path, wit_dir).get(rel_path)
+        return store_file(path, wit_dir, object_id=object_id, base_id=base_file_id)
+
+    utilities.run_jobs(lambda item: store(*item), [item for item in tree.items() if item[1] != EMPTY_DIR])
+    return write_tree(tree, wit_dir)
+
+
+def checkout_object(object_id: str, path: str, wit_dir: str, link: bool = False) -> None:
+    """Replace the file in `path` with the object `object_id`. A directory in `path` is only removed if it holds
+    no files, and is kept as it is if `object_id` is an empty directory.
+    if `link`, `path` may share its storage with the object, so it must never be modified in place."""
+    is_directory = os.path.isdir(path) and not os.path.islink(path)
+    if object_id == EMPTY_DIR and is_directory:
+        return
+    if is_directory:
+        utilities.remove_empty_tree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+    if object_id == EMPTY_DIR:
+        os.makedirs(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    object_path = get_object_path(object_id, wit_dir)
+    chunk_ids = chunk_funcs.read_chunk_list(object_id, wit_dir)
+    if os.path.exists(object_path):
+        utilities.copy_file(object_path, path, link=link)
+    elif chunk_ids is not None:
+        with open(path, 'wb') as file_handler:
+            for chunk_id in chunk_ids:
+                file_handler.write(read_object(chunk_id, wit_dir))
+    else:
+        with open(path, 'wb') as file_handler:
+            file_handler.write(read_object(object_id, wit_dir))
@@ -0,0 +1,249 @@
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import history_funcs
+import object_funcs
+
+
+PACK_SIGNATURE = b'WITP'
+INDEX_SIGNATURE = b'WITX'
+PACK_VERSION = 1
+HEADER = struct.Struct('>4sII')
+INDEX_RECORD = struct.Struct('>20sQQ')
+FULL = 0
+DELTA = 1
+OBJECT_HEADER = struct.Struct('>B')
+DELTA_BASE = struct.Struct('>20s')
+COPY = struct.Struct('>cQI')
+INSERT = struct.Struct('>cI')
+DELTA_BLOCK = 32
+MAX_DELTA_SIZE = 1 << 20
+MAX_DEPTH = 10
+
+pack_cache: Dict[str, List[Tuple[str, mmap.mmap, mmap.mmap]]] = {}
+
+
+def get_pack_dir(wit_dir: str) -> str:
+    """Return path to the directory holding the pack files of `wit_dir`."""
+    return os.path.join(wit_dir, 'objects', 'pack')
+
+
+def get_packs(wit_dir: str) -> List[Tuple[str, mmap.mmap, mmap.mmap]]:
+    """Return the name, mapped index and mapped contents of every pack in `wit_dir`, loading them once per process."""
+    if wit_dir not in pack_cache:
+        packs = []
+        pack_dir = get_pack_dir(wit_dir)
+        if os.path.isdir(pack_dir):
+            for file_name in sorted(os.listdir(pack_dir)):
+                if file_name.endswith('.idx'):
+                    name = file_name[:-len('.idx')]
+                    packs.append((name, map_file(os.path.join(pack_dir, file_name)),
+                                  map_file(os.path.join(pack_dir, f'{name}.pack'))))
+        pack_cache[wit_dir] = packs
+    return pack_cache[wit_dir]
+
+
+def map_file(path: str) -> mmap.mmap:
+    """Return a read-only memory map of the file in `path`."""
+    with open(path, 'rb') as file_handler:
+        return mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def find_in_index(index: mmap.mmap, digest: bytes) -> Optional[Tuple[int, int]]:
+    """Return the offset and length of the object `digest` in the pack of `index`, by binary search."""
+    _, _, count = HEADER.unpack_from(index)
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        record_digest, offset, length = INDEX_RECORD.unpack_from(index, HEADER.size + middle * INDEX_RECORD.size)
+        if record_digest == digest:
+            return offset, length
+        if record_digest < digest:
+            low = middle + 1
+        else:
+            high = middle
+    return None
+
+
+def find_object(object_id: str, wit_dir: str) -> Optional[Tuple[mmap.mmap, int, int]]:
+    """Return the mapped pack holding `object_id`, with the object's offset and length in it."""
+    digest = bytes.fromhex(object_id)
+    for _, index, pack in get_packs(wit_dir):
+        location = find_in_index(index, digest)
+        if location is not None:
+            return (pack, *location)
+    return None
+
+
+def read_packed_object(object_id: str, wit_dir: str) -> Optional[bytes]:
+    """Return the contents of `object_id` if it is stored in a pack."""
+    found = find_object(object_id, wit_dir)
+    if found is None:
+        return None
+    pack, offset, length = found
+    kind, = OBJECT_HEADER.unpack_from(pack, offset)
+    if kind == FULL:
+        return zlib.decompress(pack[offset + OBJECT_HEADER.size:offset + length])
+    base_offset = offset + OBJECT_HEADER.size
+    base_digest, = DELTA_BASE.unpack_from(pack, base_offset)
+    delta = zlib.decompress(pack[base_offset + DELTA_BASE.size:offset + length])
+    return apply_delta(object_funcs.read_object(base_digest.hex(), wit_dir), delta)
+
+
+def create_delta(base: bytes, target: bytes) -> bytes:
+    """Return instructions rebuilding `target` from copies of `base` and inserted data."""
+    blocks: Dict[bytes, int] = {}
+    for offset in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        blocks.setdefault(base[offset:offset + DELTA_BLOCK], offset)
+
+    instructions = []
+    position = inserted_from = 0
+    while position + DELTA_BLOCK <= len(target):
+        base_offset = blocks.get(target[position:position + DELTA_BLOCK])
+        if base_offset is None:
+            position += 1
+            continue
+        length = DELTA_BLOCK
+        while (base_offset + length < len(base) and position + length < len(target)
+               and base[base_offset + length] == target[position + length]):
+            length += 1
+        if inserted_from < position:
+            instructions.append(INSERT.pack(b'I', position - inserted_from) + target[inserted_from:position])
+        instructions.append(COPY.pack(b'C', base_offset, length))
+        position = inserted_from = position + length
+    if inserted_from < len(target):
+        instructions.append(INSERT.pack(b'I', len(target) - inserted_from) + target[inserted_from:])
+    return b''.join(instructions)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Return the contents rebuilt from `base` by the instructions in `delta`."""
+    chunks = []
+    position = 0
+    while position < len(delta):
+        if delta[position:position + 1] == b'C':
+            _, offset, length = COPY.unpack_from(delta, position)
+            chunks.append(base[offset:offset + length])
+            position += COPY.size
+        else:
+            _, length = INSERT.unpack_from(delta, position)
+            position += INSERT.size
+            chunks.append(delta[position:position + length])
+            position += length
+    return b''.join(chunks)
+
+
+def iter_loose_objects(wit_dir: str) -> Iterator[str]:
+    """Yield the id of every object stored outside of packs."""
+    objects_dir = os.path.join(wit_dir, 'objects')
+    for prefix in sorted(os.listdir(objects_dir)):
+        if len(prefix) == 2 and os.path.isdir(os.path.join(objects_dir, prefix)):
+            for name in sorted(os.listdir(os.path.join(objects_dir, prefix))):
+                # Temporary files and chunk lists of large files are never packed.
+                if '.' not in name:
+                    yield prefix + name
+
+
+def iter_packed_objects(wit_dir: str) -> Iterator[str]:
+    """Yield the id of every object stored in packs."""
+    for _, index, _ in get_packs(wit_dir):
+        _, _, count = HEADER.unpack_from(index)
+        for position in range(count):
+            digest, _, _ = INDEX_RECORD.unpack_from(index, HEADER.size + position * INDEX_RECORD.size)
+            yield digest.hex()
+
+
+def get_delta_bases(wit_dir: str, commit_ids: Optional[Iterable[str]] = None) -> Dict[str, Optional[str]]:
+    """Return every object of commit history, or of the images `commit_ids` given parents first,
+    in order of first appearance, mapped to the previous version of the same path, if any."""
+    bases: Dict[str, Optional[str]] = {}
+    last_versions: Dict[str, str] = {}
+    if commit_ids is None:
+        commit_ids = history_funcs.read_commit_graph(wit_dir).ids
+    for commit_id in commit_ids:
+        for rel_path, object_id in object_funcs.read_manifest(commit_id, wit_dir).items():
+            if object_id == object_funcs.EMPTY_DIR:
+                continue
+            # Only the first appearance of an object picks its base, so delta chains never loop.
+            if object_id not in bases:
+                bases[object_id] = last_versions.get(rel_path)
+            last_versions[rel_path] = object_id
+    return bases
+
+
+def pack_objects(wit_dir: str, keep: Optional[Set[str]] = None,
+                 commit_ids: Optional[List[str]] = None) -> Tuple[str, int, int]:
+    """Consolidate every stored object, or only those in `keep`, into one pack of zlib-compressed full objects
+    and deltas; the storage of the others is dropped with the old packs. Deltas follow the history of every
+    image, or only of `commit_ids`, whose objects must all be kept.
+    Return the name of the new pack, the number of objects and the number of deltas in it."""
+    stored = set(iter_loose_objects(wit_dir)) | set(iter_packed_objects(wit_dir))
+    if keep is not None:
+        stored &= keep
+    bases = get_delta_bases(wit_dir, commit_ids)
+    # Bases appear earlier in history, so packing in that order packs every base before its deltas.
+    object_ids = [object_id for object_id in bases if object_id in stored]
+    object_ids.extend(sorted(stored.difference(bases)))
+    depths: Dict[str, int] = {}
+    records = []
+    pack_dir = get_pack_dir(wit_dir)
+    os.makedirs(pack_dir, exist_ok=True)
+    temp_path = os.path.join(pack_dir, 'pack.tmp')
+    digest = hashlib.sha1()
+    deltas = 0
+    with open(temp_path, 'wb') as file_handler:
+        header = HEADER.pack(PACK_SIGNATURE, PACK_VERSION, len(object_ids))
+        file_handler.write(header)
+        digest.update(header)
+        offset = len(header)
+        for object_id in object_ids:
+            content = object_funcs.read_object(object_id, wit_dir)
+            entry = OBJECT_HEADER.pack(FULL) + zlib.compress(content)
+            base_id = bases.get(object_id)
+            if (base_id is not None and base_id in depths and len(content) <= MAX_DELTA_SIZE
+                    and depths[base_id] < MAX_DEPTH):
+                delta = create_delta(object_funcs.read_object(base_id, wit_dir), content)
+                if len(delta) < len(content) // 2:
+                    entry = OBJECT_HEADER.pack(DELTA) + DELTA_BASE.pack(bytes.fromhex(base_id)) + zlib.compress(delta)
+                    depths[object_id] = depths[base_id] + 1
+                    deltas += 1
+            depths.setdefault(object_id, 0)
+            records.append(INDEX_RECORD.pack(bytes.fromhex(object_id), offset, len(entry)))
+            file_handler.write(entry)
+            digest.update(entry)
+            offset += len(entry)
+
+    name = f'pack-{digest.hexdigest()}'
+    old_packs = [old_name for old_name, _, _ in get_packs(wit_dir) if old_name != name]
+    os.replace(temp_path, os.path.join(pack_dir, f'{name}.pack'))
+    write_file(os.path.join(pack_dir, f'{name}.idx'),
+               HEADER.pack(INDEX_SIGNATURE, PACK_VERSION, len(records)) + b''.join(sorted(records)))
+
+    # The new pack is complete, so the storage it replaces can go.
+    for _, index, pack in pack_cache.pop(wit_dir, []):
+        index.close()
+        pack.close()
+    for old_name in old_packs:
+        for extension in ('idx', 'pack'):
+            os.remove(os.path.join(pack_dir, f'{old_name}.{extension}'))
+    for object_id in object_ids:
+        object_path = object_funcs.get_object_path(object_id, wit_dir)
+        if os.path.exists(object_path):
+            os.remove(object_path)
+            try:
+                os.rmdir(os.path.dirname(object_path))
+            except OSError:
+                pass
+    return name, len(object_ids), deltas
+
+
+def write_file(path: str, data: bytes) -> None:
+    """Atomically write `data` to `path`."""
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file_handler:
+        file_handler.write(data)
+    os.replace(temp_path, path)
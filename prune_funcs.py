@@ -0,0 +1,279 @@
+import hashlib
+import os
+import shutil
+import struct
+import time
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Set
+
+import chunk_funcs
+import history_funcs
+import index_funcs
+import metadata_funcs
+import object_funcs
+import pack_funcs
+import refs_funcs
+import trace_funcs
+
+
+BITMAPS_NAME = 'bitmaps'
+BITMAPS_SIGNATURE = b'WITB'
+BITMAPS_VERSION = 1
+# Signature, version, number of commit-graph records covered, digest of those records, number of bitmaps.
+BITMAPS_HEADER = struct.Struct('>4sII20sI')
+# Commit-graph position of the tip and length of its compressed bitmap.
+BITMAP_RECORD = struct.Struct('>II')
+DEFAULT_EXPIRE_DAYS = 30
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class PruneResult(NamedTuple):
+    """What a prune deleted."""
+    commits: int
+    objects: int
+
+
+def get_bitmaps_path(wit_dir: str) -> str:
+    """Return path to the reachability bitmaps file of `wit_dir`."""
+    return os.path.join(wit_dir, BITMAPS_NAME)
+
+
+def get_graph_digest(graph_file: history_funcs.GraphFile, count: int) -> bytes:
+    """Return the digest of the first `count` records of `graph_file`, which the positions in bitmaps refer to."""
+    end = history_funcs.HEADER.size + count * history_funcs.RECORD.size
+    return hashlib.sha1(graph_file.data[history_funcs.HEADER.size:end]).digest()
+
+
+def read_bitmaps(wit_dir: str, graph_file: history_funcs.GraphFile) -> Dict[int, int]:
+    """Return the cached bitmaps of commits reachable from each ref tip, keyed by the tip's position.
+    Bit `n` of a bitmap is set if the commit in position `n` of the commit graph is reachable.
+    Bitmaps are dropped if the commit graph was rebuilt since they were written, since positions changed."""
+    try:
+        with open(get_bitmaps_path(wit_dir), 'rb') as file_handler:
+            data = file_handler.read()
+    except FileNotFoundError:
+        return {}
+    trace_funcs.count(trace_funcs.METADATA_OPENED)
+    trace_funcs.count(trace_funcs.BYTES_READ, len(data))
+    signature, version, count, digest, bitmap_count = BITMAPS_HEADER.unpack_from(data)
+    if (signature != BITMAPS_SIGNATURE or version != BITMAPS_VERSION or count > len(graph_file)
+            or digest != get_graph_digest(graph_file, count)):
+        return {}
+    bitmaps = {}
+    offset = BITMAPS_HEADER.size
+    for _ in range(bitmap_count):
+        position, length = BITMAP_RECORD.unpack_from(data, offset)
+        offset += BITMAP_RECORD.size
+        bitmaps[position] = int.from_bytes(zlib.decompress(data[offset:offset + length]), 'little')
+        offset += length
+    return bitmaps
+
+
+def write_bitmaps(wit_dir: str, graph_file: history_funcs.GraphFile, bitmaps: Dict[int, int]) -> None:
+    """Atomically replace the bitmaps file with `bitmaps`, covering every commit of `graph_file`."""
+    count = len(graph_file)
+    chunks = [BITMAPS_HEADER.pack(BITMAPS_SIGNATURE, BITMAPS_VERSION, count,
+                                  get_graph_digest(graph_file, count), len(bitmaps))]
+    for position, bitmap in sorted(bitmaps.items()):
+        compressed = zlib.compress(bitmap.to_bytes((count + 7) // 8, 'little'))
+        chunks.extend((BITMAP_RECORD.pack(position, len(compressed)), compressed))
+    pack_funcs.write_file(get_bitmaps_path(wit_dir), b''.join(chunks))
+
+
+def get_bitmap(graph_file: history_funcs.GraphFile, position: int, bitmaps: Dict[int, int]) -> int:
+    """Return the bitmap of the commits reachable from the one in `position`.
+    The walk stops at commits with a cached bitmap, so only commits added since are visited."""
+    cached = bitmaps.get(position)
+    if cached is not None:
+        return cached
+    seen = bytearray((len(graph_file) + 7) // 8)
+    reachable = 0
+    stack = [position]
+    while stack:
+        current = stack.pop()
+        if seen[current >> 3] >> (current & 7) & 1:
+            continue
+        seen[current >> 3] |= 1 << (current & 7)
+        cached = bitmaps.get(current)
+        if cached is not None:
+            reachable |= cached
+        else:
+            reachable |= 1 << current
+            stack.extend(graph_file.get(current).parents)
+    return reachable
+
+
+@trace_funcs.traced('mark reachable commits')
+def get_reachable(wit_dir: str, graph_file: history_funcs.GraphFile, roots: Iterable[str] = ()) -> int:
+    """Return the bitmap of the commits reachable from a branch, 'HEAD' or one of `roots`.
+    The bitmaps of the branch tips are cached for the next call."""
+    cached = read_bitmaps(wit_dir, graph_file)
+    bitmaps = dict(cached)
+    tips: Dict[int, int] = {}
+    for commit_id in set(refs_funcs.get_refs(wit_dir).branches.values()):
+        position = graph_file.find(commit_id)
+        if position is not None:
+            tips[position] = get_bitmap(graph_file, position, bitmaps)
+            bitmaps[position] = tips[position]
+    if tips != cached:
+        write_bitmaps(wit_dir, graph_file, tips)
+    reachable = 0
+    for bitmap in tips.values():
+        reachable |= bitmap
+    for commit_id in roots:
+        position = graph_file.find(commit_id)
+        if position is not None:
+            reachable |= get_bitmap(graph_file, position, bitmaps)
+    return reachable
+
+
+def is_set(bits: bytes, position: int) -> bool:
+    """Return whether bit `position` of the little-endian bitmap `bits` is set."""
+    return bool(bits[position >> 3] >> (position & 7) & 1)
+
+
+def get_reachable_positions(wit_dir: str) -> List[int]:
+    """Return the commit-graph positions of the commits reachable from a branch or 'HEAD', oldest first."""
+    graph_file = history_funcs.open_graph_file(wit_dir)
+    try:
+        count = len(graph_file)
+        bits = get_reachable(wit_dir, graph_file).to_bytes((count + 7) // 8, 'little')
+    finally:
+        graph_file.close()
+    return [position for position in range(count) if is_set(bits, position)]
+
+
+def get_reflog_roots(wit_dir: str, cutoff: int) -> Set[str]:
+    """Return the commits the references pointed at, before or after a change made after `cutoff`."""
+    roots: Set[str] = set()
+    for entry in refs_funcs.iter_reflog(wit_dir):
+        if entry.timestamp > cutoff:
+            roots.update(commit_id for commit_id in (entry.old_id, entry.new_id) if commit_id is not None)
+    return roots
+
+
+def expire_reflog(wit_dir: str, cutoff: int) -> None:
+    """Drop the reflog entries made at or before `cutoff`."""
+    entries = [entry for entry in refs_funcs.iter_reflog(wit_dir) if entry.timestamp > cutoff]
+    reflog_path = os.path.join(wit_dir, refs_funcs.REFLOG_NAME)
+    if os.path.exists(reflog_path):
+        pack_funcs.write_file(reflog_path, ''.join(map(refs_funcs.format_reflog_entry, entries)).encode())
+
+
+def add_object(object_id: str, wit_dir: str, objects: Set[str]) -> None:
+    """Add `object_id` to `objects`, with its chunks if it is stored in chunks."""
+    objects.add(object_id)
+    objects.update(chunk_funcs.read_chunk_list(object_id, wit_dir) or ())
+
+
+def add_tree_objects(tree_id: str, wit_dir: str, objects: Set[str]) -> None:
+    """Add the tree object `tree_id` and everything it refers to `objects`.
+    Subtrees already in `objects` are skipped, so trees shared between images are read once."""
+    stack = [tree_id]
+    while stack:
+        current = stack.pop()
+        if current in objects:
+            continue
+        objects.add(current)
+        for entry in object_funcs.read_tree(current, wit_dir).values():
+            if entry.kind == object_funcs.TREE:
+                stack.append(entry.object_id)
+            elif entry.object_id not in objects:
+                add_object(entry.object_id, wit_dir, objects)
+
+
+@trace_funcs.traced('mark reachable objects')
+def get_reachable_objects(commit_ids: Iterable[str], wit_dir: str) -> Set[str]:
+    """Return the ids of the objects the images in `commit_ids` and the index refer to."""
+    objects: Set[str] = set()
+    for commit_id in commit_ids:
+        commit = metadata_funcs.get_commit(commit_id, wit_dir)
+        tree_id = object_funcs.get_tree_id(commit_id, wit_dir)
+        if tree_id is not None:
+            add_tree_objects(tree_id, wit_dir, objects)
+            continue
+        if commit is not None and commit.tree:
+            objects.add(commit.tree)
+        for object_id in object_funcs.read_manifest(commit_id, wit_dir).values():
+            if object_id != object_funcs.EMPTY_DIR and object_id not in objects:
+                add_object(object_id, wit_dir, objects)
+    for entry in index_funcs.read_index(wit_dir).values():
+        if entry.object_id != object_funcs.EMPTY_DIR and entry.object_id not in objects:
+            add_object(entry.object_id, wit_dir, objects)
+    return objects
+
+
+def remove_image(commit_id: str, wit_dir: str) -> None:
+    """Remove the files an image created before the metadata database and the object store left in `images`."""
+    image_path = os.path.join(wit_dir, 'images', commit_id)
+    if os.path.isdir(image_path):
+        shutil.rmtree(image_path)
+    for path in (image_path, f'{image_path}.txt'):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def remove_loose_object(object_id: str, wit_dir: str) -> None:
+    """Remove the loose object `object_id` and its chunk list, along with its directory if left empty."""
+    object_path = object_funcs.get_object_path(object_id, wit_dir)
+    for path in (object_path, chunk_funcs.get_chunks_path(object_id, wit_dir)):
+        if os.path.exists(path):
+            os.remove(path)
+    try:
+        os.rmdir(os.path.dirname(object_path))
+    except OSError:
+        pass
+
+
+def iter_chunked_objects(wit_dir: str) -> Iterable[str]:
+    """Yield the id of every object stored as a chunk list."""
+    objects_dir = os.path.join(wit_dir, 'objects')
+    for prefix in os.listdir(objects_dir):
+        if len(prefix) == 2 and os.path.isdir(os.path.join(objects_dir, prefix)):
+            for name in os.listdir(os.path.join(objects_dir, prefix)):
+                if name.endswith('.chunks'):
+                    yield prefix + name[:-len('.chunks')]
+
+
+def prune(wit_dir: str, expire_days: float = DEFAULT_EXPIRE_DAYS) -> PruneResult:
+    """Delete the images that aren't reachable from a branch, 'HEAD', or a commit a reference pointed at
+    in the last `expire_days` days according to the reflog, and every object only they refer to.
+    Return the numbers of images and objects deleted."""
+    cutoff = int(time.time() - expire_days * SECONDS_PER_DAY)
+    graph_file = history_funcs.open_graph_file(wit_dir)
+    try:
+        reachable = get_reachable(wit_dir, graph_file, get_reflog_roots(wit_dir, cutoff))
+        bits = reachable.to_bytes((len(graph_file) + 7) // 8, 'little')
+        records = [graph_file.get(position) for position in range(len(graph_file))]
+    finally:
+        graph_file.close()
+    kept = [record.id for record in records if is_set(bits, record.position)]
+    unreachable = [record.id for record in records if not is_set(bits, record.position)]
+    expire_reflog(wit_dir, cutoff)
+    if not unreachable:
+        return PruneResult(0, 0)
+
+    # Everything deleted is found before anything is, and the images go last: whatever fails,
+    # the next prune still finds the same unreachable images and only reads the kept ones.
+    objects = get_reachable_objects(kept, wit_dir)
+    loose = [object_id for object_id in set(pack_funcs.iter_loose_objects(wit_dir)) | set(iter_chunked_objects(wit_dir))
+             if object_id not in objects]
+    packed = set(pack_funcs.iter_packed_objects(wit_dir))
+    if not packed <= objects:
+        # Packs can only shrink by being rewritten without the unreachable objects.
+        pack_funcs.pack_objects(wit_dir, keep=objects, commit_ids=kept)
+    for object_id in loose:
+        remove_loose_object(object_id, wit_dir)
+    metadata_funcs.delete_commits(unreachable, wit_dir)
+    for commit_id in unreachable:
+        remove_image(commit_id, wit_dir)
+    removed = len(loose) + len(packed - objects)
+
+    # Positions in the commit graph change, so the graph and the bitmaps are rebuilt.
+    history_funcs.write_commit_graph(wit_dir)
+    graph_file = history_funcs.GraphFile(wit_dir)
+    try:
+        get_reachable(wit_dir, graph_file)
+    finally:
+        graph_file.close()
+    return PruneResult(len(unreachable), removed)
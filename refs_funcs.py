@@ -0,0 +1,132 @@
+import os
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import trace_funcs
+import utilities
+
+
+REFLOG_NAME = 'reflog'
+
+
+class ReflogEntry(NamedTuple):
+    """A change of the commit a reference points at."""
+    timestamp: int
+    name: str
+    old_id: Optional[str]
+    new_id: str
+
+
+class Refs:
+    """Branch references of a repository, kept in memory and written back atomically.
+    `HEAD` is stored like a branch named 'HEAD'."""
+
+    def __init__(self, wit_dir: str) -> None:
+        self.path = os.path.join(wit_dir, 'references.txt')
+        self.reflog_path = os.path.join(wit_dir, REFLOG_NAME)
+        self.branches: Dict[str, str] = {}
+        self.saved: Dict[str, str] = {}
+        self.names_by_id: Dict[str, List[str]] = {}
+        self.stamp: Optional[Tuple[int, int]] = None
+        self.load()
+
+    def load(self) -> None:
+        """Read the references file, unless it hasn't changed since it was last read."""
+        stamp = get_stamp(self.path)
+        if stamp == self.stamp:
+            return
+        self.branches = {}
+        self.names_by_id = {}
+        if stamp is not None:
+            trace_funcs.count(trace_funcs.METADATA_OPENED)
+            with open(self.path, 'r') as file_handler:
+                for line in file_handler:
+                    if '=' in line:
+                        name, commit_id = line.rstrip().split('=', 1)
+                        self.set(name, commit_id)
+        self.saved = dict(self.branches)
+        self.stamp = stamp
+
+    def save(self) -> None:
+        """Atomically replace the references file with the references in memory,
+        and record the references that changed in the reflog."""
+        changes = [ReflogEntry(int(time.time()), name, self.saved.get(name), commit_id)
+                   for name, commit_id in self.branches.items() if self.saved.get(name) != commit_id]
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file_handler:
+            file_handler.write('\n'.join(f'{name}={commit_id}' for name, commit_id in self.branches.items()))
+            file_handler.flush()
+            os.fsync(file_handler.fileno())
+        os.replace(temp_path, self.path)
+        trace_funcs.count(trace_funcs.METADATA_OPENED)
+        self.stamp = get_stamp(self.path)
+        self.saved = dict(self.branches)
+        if changes:
+            with open(self.reflog_path, 'a') as file_handler:
+                file_handler.writelines(format_reflog_entry(entry) for entry in changes)
+
+    def set(self, name: str, commit_id: str) -> None:
+        """Point `name` at `commit_id`, in memory only."""
+        old_id = self.branches.get(name)
+        if old_id is not None:
+            self.names_by_id[old_id].remove(name)
+            if not self.names_by_id[old_id]:
+                del self.names_by_id[old_id]
+        self.branches[name] = commit_id
+        self.names_by_id.setdefault(commit_id, []).append(name)
+
+    def get(self, name: str) -> Optional[str]:
+        """Return the commit id `name` points at."""
+        return self.branches.get(name)
+
+    def get_names(self, commit_id: str) -> List[str]:
+        """Return the names of the branches pointing at `commit_id`, not including 'HEAD'."""
+        return [name for name in self.names_by_id.get(commit_id, []) if name != 'HEAD']
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.branches
+
+    @property
+    def head(self) -> Optional[str]:
+        """Return the current commit id."""
+        return self.branches.get('HEAD')
+
+
+refs_cache: Dict[str, Refs] = {}
+
+
+def get_stamp(path: str) -> Optional[Tuple[int, int]]:
+    """Return the modification time and size of `path`, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def format_reflog_entry(entry: ReflogEntry) -> str:
+    """Return the line recording `entry` in the reflog."""
+    return f'{entry.timestamp} {entry.old_id or "-"} {entry.new_id} {entry.name}\n'
+
+
+def iter_reflog(wit_dir: str) -> Iterator[ReflogEntry]:
+    """Yield the entries of the reflog of `wit_dir`, oldest first."""
+    try:
+        with open(os.path.join(wit_dir, REFLOG_NAME), 'r') as file_handler:
+            for line in file_handler:
+                timestamp, old_id, new_id, name = line.rstrip('\n').split(' ', 3)
+                yield ReflogEntry(int(timestamp), name, None if old_id == '-' else old_id, new_id)
+    except FileNotFoundError:
+        return
+
+
+def get_refs(wit_dir: Optional[str] = None) -> Refs:
+    """Return the references of `wit_dir`, parsing the references file only when it changed."""
+    if wit_dir is None:
+        wit_dir = utilities.get_wit_dir()
+    refs = refs_cache.get(wit_dir)
+    if refs is None:
+        refs = refs_cache[wit_dir] = Refs(wit_dir)
+    else:
+        refs.load()
+    return refs
@@ -0,0 +1,259 @@
+import os
+import shutil
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import checkout_funcs
+import commit_funcs
+import history_funcs
+import ignore_funcs
+import index_funcs
+import log_funcs
+import merge_funcs
+import metadata_funcs
+import object_funcs
+import pack_funcs
+import prune_funcs
+import refs_funcs
+import status_funcs
+import transfer_funcs
+import utilities
+
+
+class Repository:
+    """A wit repository, located once, whose operations return their results instead of printing them.
+    Missing paths raise FileNotFoundError, and invalid requests raise ValueError with a printable message."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.root = utilities.get_wit_dir_parent(os.path.abspath(path) if path is not None else None)
+        self.wit_dir = os.path.join(self.root, '.wit')
+        self.staging_area = os.path.join(self.wit_dir, 'staging_area')
+
+    @classmethod
+    def init(cls, path: str) -> 'Repository':
+        """Create a `.wit` directory in `path` and return its repository.
+        Raise FileExistsError if `path` already has one."""
+        wit_dir = os.path.join(path, '.wit')
+        for directory in ('', 'images', 'objects', 'staging_area'):
+            os.mkdir(os.path.join(wit_dir, directory))
+        utilities.update_activated('master', wit_dir)
+        return cls(path)
+
+    @classmethod
+    def clone(cls, source: str, path: str) -> Tuple['Repository', transfer_funcs.TransferResult]:
+        """Create a repository in `path`, which must be empty if it exists, with every branch of the repository
+        in `source`, and check out the branch active there. Return it and what was sent."""
+        source_dir = transfer_funcs.get_remote_wit_dir(source)
+        if os.path.isdir(path) and os.listdir(path):
+            raise ValueError(f'`{path}` is not empty.')
+        created = not os.path.isdir(path)
+        os.makedirs(path, exist_ok=True)
+        repository = cls.init(path)
+        branches = {name: commit_id for name, commit_id in refs_funcs.get_refs(source_dir).branches.items()
+                    if name != 'HEAD'}
+        try:
+            result = transfer_funcs.transfer(source_dir, repository.wit_dir, branches)
+        except BaseException:
+            shutil.rmtree(path if created else repository.wit_dir)
+            raise
+        if not branches:
+            return repository, result
+        active_branch = utilities.get_active_branch(source_dir)
+        if active_branch not in branches:
+            active_branch = 'master' if 'master' in branches else sorted(branches)[0]
+        commit_id = branches[active_branch]
+        utilities.update_activated(active_branch, repository.wit_dir)
+        index = index_funcs.read_index(repository.wit_dir)
+        diff, new_ids = status_funcs.diff_images('', commit_id, repository.wit_dir)
+        checkout_funcs.checkout_tree(diff, new_ids, repository.root, index)
+        index_funcs.write_index(index, repository.wit_dir)
+        refs = repository.refs
+        refs.set('HEAD', commit_id)
+        refs.save()
+        return repository, result
+
+    @property
+    def refs(self) -> refs_funcs.Refs:
+        return refs_funcs.get_refs(self.wit_dir)
+
+    @property
+    def head(self) -> Optional[str]:
+        """Return the current commit id, or None if no images exist."""
+        return self.refs.head
+
+    @property
+    def active_branch(self) -> str:
+        return utilities.get_active_branch(self.wit_dir)
+
+    def add(self, path: str) -> None:
+        """Add a file or directory to be backed to staging area."""
+        self.add_many([path])
+
+    def add_many(self, paths: Iterable[str]) -> None:
+        """Add every file or directory in `paths` to staging area, reading and writing the index once.
+        All paths are checked before anything is staged; ignored paths can only be added if already staged."""
+        abs_paths = [utilities.get_abs_path(path) for path in paths]
+        index = index_funcs.read_index(self.wit_dir)
+        for abs_path in abs_paths:
+            if abs_path != self.root and not abs_path.startswith(self.root + os.sep):
+                raise ValueError(f'`{abs_path}` is outside the repository in `{self.root}`.')
+            rel_path = os.path.relpath(abs_path, self.root)
+            if '.wit' in rel_path.split(os.sep):
+                raise ValueError('Invalid path. Use path to original file.')
+            if rel_path not in index and ignore_funcs.is_path_ignored(self.root, rel_path, os.path.isdir(abs_path)):
+                raise ValueError(f'`{abs_path}` is ignored by a {ignore_funcs.IGNORE_FILE} file.')
+        for abs_path in abs_paths:
+            utilities.copy_to_staging_area(abs_path, self.root)
+            index_funcs.stage_path(abs_path, self.root, index)
+        index_funcs.write_index(index, self.wit_dir)
+
+    def status(self) -> status_funcs.Status:
+        """Return commitment status of files."""
+        return status_funcs.get_status(self.root)
+
+    def commit(self, *message: str, merged_branch_id: Optional[str] = None) -> Optional[str]:
+        """Create an image of files in staging area and return its id, or None if nothing changed."""
+        current_status = self.status()
+        if not current_status.changes and not current_status.removed:
+            return None
+        commit_id = commit_funcs.generate_commit_id()
+        tree = {rel_path: entry.object_id for rel_path, entry in current_status.index.items()}
+        tree_id = object_funcs.create_image(tree, self.staging_area, self.wit_dir, current_status.head_id)
+        commit_funcs.create_metadata_file(commit_id, *message, merged_branch_id=merged_branch_id,
+                                          wit_dir=self.wit_dir, tree_id=tree_id)
+        history_funcs.append_commit(commit_id, self.wit_dir)
+        try:
+            commit_funcs.update_references(commit_id, self.wit_dir)
+        except KeyError:
+            commit_funcs.create_references_file(commit_id, self.wit_dir)
+        return commit_id
+
+    def checkout(self, name: str) -> str:
+        """Rollback to the image `name`, a branch name or a commit id or prefix of one, and return its id."""
+        refs = self.refs
+        commit_id = name
+        if name not in refs:
+            commit_id = metadata_funcs.resolve_commit_id(name, self.wit_dir) or ''
+        if not commit_id:
+            raise ValueError('Invalid commit id. Unable to perform checkout.')
+
+        current_status = self.status()
+        if current_status.changes or current_status.unstaged:
+            raise ValueError('Unable to perform checkout. There are changes not yet committed.')
+
+        if name in refs:
+            branch_name = name
+            commit_id = refs.branches[name]
+        else:
+            branch_names = refs.get_names(commit_id)
+            branch_name = branch_names[0] if branch_names else ''
+        diff, new_ids = status_funcs.diff_images(current_status.head_id, commit_id, self.wit_dir)
+        checkout_funcs.checkout_tree(diff, new_ids, self.root, current_status.index)
+        utilities.update_activated(branch_name, self.wit_dir)
+        index_funcs.write_index(current_status.index, self.wit_dir)
+        commit_funcs.update_references(commit_id, self.wit_dir, checkout=True)
+        return commit_id
+
+    def rm(self, path: str) -> None:
+        """Remove file from directory and staging_area."""
+        abs_path = utilities.get_abs_path(path)
+        if '.wit' in abs_path.split(os.sep):
+            raise ValueError('Invalid path. Use path to original file.')
+        new_path = utilities.get_new_path(abs_path, self.root, additions=['staging_area'])
+        for file in (abs_path, new_path):
+            if os.path.exists(file):
+                try:
+                    os.remove(file)
+                except (PermissionError, IsADirectoryError):
+                    shutil.rmtree(file)
+        index = index_funcs.read_index(self.wit_dir)
+        index_funcs.unstage_path(os.path.relpath(abs_path, self.root), index)
+        index_funcs.write_index(index, self.wit_dir)
+
+    def branch(self, branch_name: str) -> None:
+        """Label the current commit id as `branch_name`."""
+        refs = self.refs
+        if branch_name in refs:
+            raise ValueError(f'A branch named \'{branch_name}\' already exists.')
+        if refs.head is None:
+            raise ValueError('No images currently exist.')
+        refs.set(branch_name, refs.head)
+        refs.save()
+
+    def merge(self, branch_name: str) -> Optional[str]:
+        """Merge changes made in `branch_name` and in the current image into a new image, and return its id."""
+        branch_id = utilities.get_branch_id(branch_name, self.wit_dir)
+        merge_funcs.update_staging_area(merge_funcs.get_shared_parent(branch_name, self.wit_dir),
+                                        branch_name, self.root)
+        return self.commit(f'Merged branch: {branch_name}', merged_branch_id=branch_id)
+
+    def diff(self, old: Optional[str] = None, new: Optional[str] = None) -> Iterator[status_funcs.DiffEntry]:
+        """Yield the paths that differ from the image `old` to the image `new`, branch names or commit ids or
+        prefixes of one, in sorted order as they are found. `old` defaults to the current image, and without
+        `new` the working tree is compared."""
+        old_id = (self.head or '') if old is None else utilities.get_branch_id(old, self.wit_dir)
+        if new is None:
+            return status_funcs.iter_working_diff(self.root, old_id)
+        return status_funcs.iter_image_diff(old_id, utilities.get_branch_id(new, self.wit_dir), self.wit_dir)
+
+    def log(self, start: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None,
+            grep: Optional[str] = None, paths: Sequence[str] = ()) -> Iterator[metadata_funcs.Commit]:
+        """Yield the commits reachable from `start`, a branch name or a commit id or prefix of one,
+        or from the current commit, newest first. See `log_funcs.iter_log` for the filters.
+        `paths` are relative to the repository's root."""
+        start_id = self.head if start is None else utilities.get_branch_id(start, self.wit_dir)
+        if start_id is None:
+            return iter(())
+        return log_funcs.iter_log(self.wit_dir, start_id, since=since, until=until, grep=grep,
+                                  paths=[os.path.normpath(path) for path in paths])
+
+    def receive(self, source_dir: str, branches: Dict[str, str]) -> transfer_funcs.TransferResult:
+        """Fetch the images `branches` point at in the repository of `source_dir` and fast-forward the branches
+        of the same names. If the active branch moves, the working tree follows it, so it must have no changes
+        not yet committed."""
+        refs = self.refs
+        active_branch = self.active_branch
+        follow = active_branch in branches and refs.head is not None and refs.get(active_branch) == refs.head
+        if follow:
+            current_status = self.status()
+            if current_status.changes or current_status.unstaged:
+                raise ValueError(f'Unable to update \'{active_branch}\' in `{self.root}`. '
+                                 'There are changes not yet committed.')
+        result = transfer_funcs.transfer(source_dir, self.wit_dir, branches)
+        if follow and active_branch in result.updated:
+            self.checkout(active_branch)
+        return result
+
+    def push(self, path: str, branch_name: Optional[str] = None) -> transfer_funcs.TransferResult:
+        """Send the branch `branch_name`, the active one by default, to the repository in `path`,
+        along with the images and objects it lacks, and fast-forward its branch of the same name."""
+        branch_name = branch_name or self.active_branch
+        commit_id = self.refs.get(branch_name) if branch_name else None
+        if commit_id is None:
+            raise ValueError('Branch not found.')
+        return Repository(os.path.dirname(transfer_funcs.get_remote_wit_dir(path))).receive(
+            self.wit_dir, {branch_name: commit_id})
+
+    def pull(self, path: str, branch_name: Optional[str] = None) -> transfer_funcs.TransferResult:
+        """Fetch the branch `branch_name`, the active one by default, from the repository in `path`,
+        along with the images and objects missing here, and fast-forward the branch of the same name."""
+        source_dir = transfer_funcs.get_remote_wit_dir(path)
+        branch_name = branch_name or self.active_branch
+        commit_id = refs_funcs.get_refs(source_dir).get(branch_name) if branch_name else None
+        if commit_id is None:
+            raise ValueError(f'Branch not found in `{path}`.')
+        if not transfer_funcs.is_fast_forward(source_dir, self.refs.get(branch_name), commit_id):
+            # The branches diverged: the images are fetched so that they can be merged.
+            transfer_funcs.fetch(source_dir, self.wit_dir, [commit_id])
+            raise ValueError(f'Branch \'{branch_name}\' diverged from `{path}`. '
+                             f'Its images were fetched; merge them with: merge {commit_id}')
+        return self.receive(source_dir, {branch_name: commit_id})
+
+    def gc(self) -> Tuple[str, int, int]:
+        """Consolidate all stored objects into a single compressed pack file.
+        Return the name of the pack, the number of objects and the number of deltas in it."""
+        return pack_funcs.pack_objects(self.wit_dir)
+
+    def prune(self, expire_days: float = prune_funcs.DEFAULT_EXPIRE_DAYS) -> prune_funcs.PruneResult:
+        """Delete the images unreachable from a branch or from the reflog of the last `expire_days` days,
+        and the objects only they refer to."""
+        return prune_funcs.prune(self.wit_dir, expire_days)
@@ -1,36 +1,284 @@
-import filecmp
 import os
-from typing import Iterator
-
-import utilities
-
-
-def get_all_files(path: str) -> Iterator[str]:
-    """Yield absolute path to all files in `path` directory tree."""
-    for folder in os.walk(path):
-        directory, sub_directories, files = folder
-        if '.wit' in path or '.wit' not in directory:
-            for sub_directory in sub_directories:
-                sub_directory_fullname = os.path.join(directory, sub_directory)
-                if not os.listdir(sub_directory_fullname):
-                    yield sub_directory_fullname
-            for file in files:
-                yield os.path.join(directory, file)
-
-
-def get_changed_files(og_path: str, new_path: str) -> Iterator[str]:
-    """Yield all files in `og_path` with different content from the corresponding files in `new_path`."""
-    og_path_files, new_path_files = [list(get_all_files(path)) for path in (og_path, new_path)]
-    for og_file in og_path_files:
-        for new_file in new_path_files:
-            if utilities.get_original_name(og_file) == utilities.get_original_name(new_file):
-                if not filecmp.cmp(og_file, new_file) and not os.path.isdir(og_file):
-                    yield utilities.get_original_name(og_file)
-
-
-def get_nonexistent_files(og_path: str, new_path: str) -> Iterator[str]:
-    """Yield all files in `og_path` not present in `new_path`."""
-    og_path_files, new_path_files = [list(get_all_files(path)) for path in (og_path, new_path)]
-    for og_file in og_path_files:
-        if utilities.get_original_name(og_file) not in (utilities.get_original_name(file) for file in new_path_files):
-            yield utilities.get_original_name(og_file)
\ No newline at end of file
+import stat
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
+
+import daemon_funcs
+import ignore_funcs
+import index_funcs
+import object_funcs
+import refs_funcs
+import trace_funcs
+
+
+T = TypeVar('T')
+CHANGES = 'changes'
+UNSTAGED = 'unstaged'
+UNTRACKED = 'untracked'
+REMOVED_FILES = 'removed'
+ADDED = 'A'
+REMOVED = 'D'
+MODIFIED = 'M'
+TYPE_CHANGED = 'T'
+
+
+class TreeDiff(NamedTuple):
+    """Relative paths that differ between two trees."""
+    added: List[str]
+    removed: List[str]
+    modified: List[str]
+    type_changed: List[str]
+
+
+class DiffEntry(NamedTuple):
+    """A path that differs between two trees: how, as one of `ADDED`, `REMOVED`, `MODIFIED` or `TYPE_CHANGED`,
+    and its content id in the new tree, or in the old one if it was removed."""
+    change: str
+    rel_path: str
+    object_id: str
+
+
+class Status(NamedTuple):
+    """Commitment status of files, along with the image and index it was computed from."""
+    head_id: str
+    index: Dict[str, 'index_funcs.IndexEntry']
+    changes: List[str]
+    unstaged: List[str]
+    untracked: List[str]
+    removed: List[str]
+
+
+@trace_funcs.traced('scan working tree')
+def scan_tree(path: str, matcher: Optional[ignore_funcs.Matcher] = None) -> Dict[str, os.stat_result]:
+    """Return the stat data of all files and empty directories in `path` directory tree,
+    keyed by their path relative to `path`, in sorted order.
+    if `matcher`, paths it ignores are left out, and ignored directories are never listed."""
+    return dict(iter_scan(path, matcher))
+
+
+def iter_scan(path: str, matcher: Optional[ignore_funcs.Matcher] = None) -> Iterator[Tuple[str, os.stat_result]]:
+    """Yield the relative path and stat data of every file and empty directory in `path` directory tree,
+    in the order of `object_funcs.get_path_key`, holding only the listings of the directories along the way."""
+    skip_wit = '.wit' not in path
+    yield from iter_directory(path, list_directory(path, skip_wit), '', skip_wit, matcher)
+
+
+def list_directory(directory: str, skip_wit: bool) -> List[os.DirEntry]:
+    """Return the entries of `directory` sorted by name."""
+    with os.scandir(directory) as iterator:
+        entries = sorted((entry for entry in iterator if not (skip_wit and entry.name == '.wit')),
+                         key=lambda entry: entry.name)
+    trace_funcs.count(trace_funcs.FILES_STATED, len(entries))
+    return entries
+
+
+def iter_directory(directory: str, entries: List[os.DirEntry], prefix: str, skip_wit: bool,
+                   matcher: Optional[ignore_funcs.Matcher]) -> Iterator[Tuple[str, os.stat_result]]:
+    """Yield the contents of `directory`, listed in `entries`, reusing the stat data of `os.scandir`.
+    A directory holding only ignored paths isn't empty, so it is left out."""
+    if matcher is not None:
+        matcher = matcher.load(directory, prefix)
+    for entry in entries:
+        rel_path = prefix + entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if matcher is not None and matcher.rules and matcher.is_ignored(rel_path, is_dir):
+            continue
+        sub_entries = list_directory(entry.path, skip_wit) if is_dir else []
+        if sub_entries:
+            yield from iter_directory(entry.path, sub_entries, rel_path + os.sep, skip_wit, matcher)
+        else:
+            yield rel_path, entry.stat()
+
+
+def is_directory(stat_result: os.stat_result) -> bool:
+    """Return whether `stat_result` belongs to a directory."""
+    return stat.S_ISDIR(stat_result.st_mode)
+
+
+@trace_funcs.traced('status')
+def get_status(wit_dir_parent: str) -> Status:
+    """Return commitment status of files, found in a single walk of the current image, the index and the working
+    tree, see `iter_status`. Only the paths reported are held, in the categories they are printed in."""
+    wit_dir = os.path.join(wit_dir_parent, '.wit')
+    index = index_funcs.read_index(wit_dir)
+    head_id = refs_funcs.get_refs(wit_dir).head or ''
+    paths: Dict[str, List[str]] = {CHANGES: [], UNSTAGED: [], UNTRACKED: [], REMOVED_FILES: []}
+    for category, rel_path in iter_status(wit_dir_parent, head_id, index):
+        paths[category].append(os.path.join(wit_dir_parent, rel_path))
+    return Status(head_id, index, **paths)
+
+
+def iter_status(wit_dir_parent: str, head_id: str,
+                index: Dict[str, 'index_funcs.IndexEntry']) -> Iterator[Tuple[str, str]]:
+    """Yield the category of every path of image `head_id`, `index` or the working tree that isn't committed,
+    along with the path, in sorted order as it is found: one of `CHANGES`, `UNSTAGED`, `UNTRACKED` or `REMOVED_FILES`.
+    The working tree comes from the status daemon if it is running, or is scanned otherwise; only staged files
+    whose stat data changed since they were staged are read, and entries proven unchanged are refreshed."""
+    wit_dir = os.path.join(wit_dir_parent, '.wit')
+    index_mtime_ns = index_funcs.get_index_mtime(wit_dir)
+    with trace_funcs.phase('ask status daemon'):
+        snapshot = daemon_funcs.get_snapshot(wit_dir_parent)
+    working = snapshot.items() if snapshot is not None else iter_scan(wit_dir_parent, ignore_funcs.Matcher())
+    staged = sorted(((rel_path, entry.object_id) for rel_path, entry in index.items()),
+                    key=lambda item: object_funcs.get_path_key(item[0]))
+    committed = ((rel_path, (head_object_id, staged_id)) for rel_path, head_object_id, staged_id
+                 in iter_join(object_funcs.iter_image(head_id, wit_dir), staged))
+    refreshed = False
+    for rel_path, ids, stat_result in iter_join(committed, working):
+        head_object_id, staged_id = ids or (None, None)
+        if stat_result is None and staged_id is not None:
+            stat_result = get_tracked_stat(wit_dir_parent, rel_path)
+        if staged_id is not None and (head_object_id is None or get_change(head_object_id, staged_id) is not None):
+            yield CHANGES, rel_path
+        if stat_result is None:
+            if head_object_id is not None:
+                yield REMOVED_FILES, rel_path
+        elif staged_id is None:
+            yield UNTRACKED, rel_path
+        else:
+            working_id, entry_refreshed = index_funcs.get_working_id(wit_dir_parent, rel_path, stat_result,
+                                                                     index, index_mtime_ns)
+            refreshed = refreshed or entry_refreshed
+            if get_change(staged_id, working_id) is not None:
+                yield UNSTAGED, rel_path
+    if refreshed:
+        index_funcs.write_index(index, wit_dir)
+
+
+def get_tracked_stat(wit_dir_parent: str, rel_path: str) -> Optional[os.stat_result]:
+    """Return the stat data of the staged path `rel_path`, left out of a scan because it is ignored, or None if it
+    no longer exists: ignore files only apply to files that aren't staged yet."""
+    trace_funcs.count(trace_funcs.FILES_STATED)
+    path = os.path.join(wit_dir_parent, rel_path)
+    entry_stat = daemon_funcs.get_stat(path)
+    # A staged empty directory that has contents now is no longer part of the tree.
+    if entry_stat is not None and is_directory(entry_stat) and os.listdir(path):
+        return None
+    return entry_stat
+
+
+def add_tracked_files(wit_dir_parent: str, snapshot: Dict[str, os.stat_result], staged: Iterable[str]) -> None:
+    """Add the staged files left out of `snapshot` because they are ignored, if they still exist."""
+    for rel_path in staged:
+        if rel_path not in snapshot:
+            entry_stat = get_tracked_stat(wit_dir_parent, rel_path)
+            if entry_stat is not None:
+                snapshot[rel_path] = entry_stat
+
+
+def get_change(old_id: str, new_id: str) -> Optional[str]:
+    """Return how a path changed from content id `old_id` to `new_id`, or None if it didn't."""
+    if old_id == new_id:
+        return None
+    if (old_id == object_funcs.EMPTY_DIR) != (new_id == object_funcs.EMPTY_DIR):
+        return TYPE_CHANGED
+    return MODIFIED
+
+
+def iter_join(old: Iterable[Tuple[str, T]], new: Iterable[Tuple[str, T]]) -> Iterator[Tuple[str, Optional[T], Optional[T]]]:
+    """Yield every relative path of `old` and `new` with its value in each, or None where it is missing.
+    Both must be in the order of `object_funcs.get_path_key`; they are merged holding one item of each at a time."""
+    old_items, new_items = iter(old), iter(new)
+    old_item, new_item = next(old_items, None), next(new_items, None)
+    while old_item is not None or new_item is not None:
+        if new_item is None or old_item is not None and (object_funcs.get_path_key(old_item[0])
+                                                          < object_funcs.get_path_key(new_item[0])):
+            yield old_item[0], old_item[1], None
+            old_item = next(old_items, None)
+        elif old_item is None or old_item[0] != new_item[0]:
+            yield new_item[0], None, new_item[1]
+            new_item = next(new_items, None)
+        else:
+            yield old_item[0], old_item[1], new_item[1]
+            old_item, new_item = next(old_items, None), next(new_items, None)
+
+
+def iter_diff(old: Iterable[Tuple[str, str]], new: Iterable[Tuple[str, str]]) -> Iterator[DiffEntry]:
+    """Yield the paths that differ from `old` to `new`, two streams of relative paths and content ids
+    in the order of `object_funcs.get_path_key`, as they are found."""
+    for rel_path, old_id, new_id in iter_join(old, new):
+        if old_id is None:
+            yield DiffEntry(ADDED, rel_path, new_id)
+        elif new_id is None:
+            yield DiffEntry(REMOVED, rel_path, old_id)
+        else:
+            change = get_change(old_id, new_id)
+            if change is not None:
+                yield DiffEntry(change, rel_path, new_id)
+
+
+@trace_funcs.traced('diff images')
+def diff_images(old_id: str, new_id: str, wit_dir: str) -> Tuple[TreeDiff, Dict[str, str]]:
+    """Return the paths that differ from image `old_id` to image `new_id`, and the content ids in `new_id`
+    of the paths added, modified or changed type."""
+    diff = TreeDiff([], [], [], [])
+    paths = {ADDED: diff.added, REMOVED: diff.removed, MODIFIED: diff.modified, TYPE_CHANGED: diff.type_changed}
+    new_ids: Dict[str, str] = {}
+    for entry in iter_image_diff(old_id, new_id, wit_dir):
+        paths[entry.change].append(entry.rel_path)
+        if entry.change != REMOVED:
+            new_ids[entry.rel_path] = entry.object_id
+    return diff, new_ids
+
+
+def iter_image_diff(old_id: str, new_id: str, wit_dir: str) -> Iterator[DiffEntry]:
+    """Yield the paths that differ from image `old_id` to image `new_id`, in sorted order.
+    Subtrees with the same id in both images are skipped without being read, so the cost follows
+    the number of changed paths rather than the size of the images."""
+    old_tree_id, new_tree_id = (object_funcs.get_tree_id(commit_id, wit_dir) for commit_id in (old_id, new_id))
+    if old_tree_id is None or new_tree_id is None:
+        # Images created before tree objects have no subtree ids to compare.
+        yield from iter_diff(object_funcs.iter_image(old_id, wit_dir), object_funcs.iter_image(new_id, wit_dir))
+    else:
+        yield from iter_tree_object_diff(old_tree_id, new_tree_id, '', wit_dir)
+
+
+def iter_tree_object_diff(old_id: str, new_id: str, prefix: str, wit_dir: str) -> Iterator[DiffEntry]:
+    """Yield the paths that differ between the tree objects `old_id` and `new_id`, found in `prefix`,
+    descending only into subtrees that changed."""
+    if old_id == new_id:
+        return
+    old_entries, new_entries = object_funcs.read_tree(old_id, wit_dir), object_funcs.read_tree(new_id, wit_dir)
+    for name in sorted(old_entries.keys() | new_entries.keys()):
+        old_entry, new_entry = old_entries.get(name), new_entries.get(name)
+        if old_entry == new_entry:
+            continue
+        rel_path = prefix + name
+        if (old_entry is not None and new_entry is not None and old_entry.kind == new_entry.kind == object_funcs.TREE
+                and object_funcs.EMPTY_TREE not in (old_entry.object_id, new_entry.object_id)):
+            yield from iter_tree_object_diff(old_entry.object_id, new_entry.object_id, rel_path + os.sep, wit_dir)
+        else:
+            # Added or removed paths, changed files, and files or empty directories replaced by directories
+            # or the other way round.
+            yield from iter_diff(object_funcs.iter_entry(old_entry, rel_path, wit_dir) if old_entry else (),
+                                 object_funcs.iter_entry(new_entry, rel_path, wit_dir) if new_entry else ())
+
+
+def iter_working_diff(wit_dir_parent: str, commit_id: str) -> Iterator[DiffEntry]:
+    """Yield the paths of the working tree that differ from image `commit_id`, in sorted order, as they are found.
+    Both trees are walked at once; only files whose stat data changed since they were staged are read."""
+    wit_dir = os.path.join(wit_dir_parent, '.wit')
+    index = index_funcs.read_index(wit_dir)
+    index_mtime_ns = index_funcs.get_index_mtime(wit_dir)
+
+    def get_object_id(rel_path: str, stat_result: os.stat_result) -> str:
+        if is_directory(stat_result):
+            return object_funcs.EMPTY_DIR
+        entry = index.get(rel_path)
+        if entry is not None and index_funcs.is_unchanged(entry, stat_result, index_mtime_ns):
+            return entry.object_id
+        return object_funcs.hash_file(os.path.join(wit_dir_parent, rel_path))
+
+    working = ((rel_path, get_object_id(rel_path, stat_result))
+               for rel_path, stat_result in iter_scan(wit_dir_parent, ignore_funcs.Matcher()))
+    for entry in iter_diff(object_funcs.iter_image(commit_id, wit_dir), working):
+        if entry.change == REMOVED and entry.rel_path in index:
+            # Staged files are never ignored, so a file missing from the scan may still exist.
+            entry_stat = get_tracked_stat(wit_dir_parent, entry.rel_path)
+            if entry_stat is not None:
+                new_id = get_object_id(entry.rel_path, entry_stat)
+                change = get_change(entry.object_id, new_id)
+                if change is not None:
+                    yield DiffEntry(change, entry.rel_path, new_id)
+                continue
+        yield entry
+
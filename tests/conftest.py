@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repository_funcs  # noqa: E402
+
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    """A new repository in a temporary directory, which is also the current directory."""
+    monkeypatch.chdir(tmp_path)
+    return repository_funcs.Repository.init(str(tmp_path))
+
+
+def write(path, content=''):
+    """Write `content` to the file in `path`, creating its directories."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as file_handler:
+        file_handler.write(content)
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from conftest import write
+
+
+def test_checkout_keeps_untracked_files_in_removed_directory(repository):
+    write('a.txt', 'a')
+    repository.add('a.txt')
+    first_id = repository.commit('first')
+    os.mkdir('d')
+    repository.add('d')
+    repository.commit('second')
+    write(os.path.join('d', 'notes.txt'), 'mine')
+
+    with pytest.raises(ValueError, match='Untracked files would be deleted'):
+        repository.checkout(first_id)
+
+    with open(os.path.join('d', 'notes.txt')) as file_handler:
+        assert file_handler.read() == 'mine'
+    assert repository.active_branch == 'master'
+
+
+def test_checkout_removes_empty_directory(repository):
+    write('a.txt', 'a')
+    repository.add('a.txt')
+    first_id = repository.commit('first')
+    os.makedirs(os.path.join('d', 'e'))
+    write(os.path.join('d', 'f.txt'), 'f')
+    repository.add('d')
+    repository.commit('second')
+
+    repository.checkout(first_id)
+
+    assert not os.path.exists('d')
+    assert os.path.exists('a.txt')
+    assert repository.head == first_id
+
+
+def test_checkout_keeps_untracked_file_at_added_path(repository):
+    write('a.txt', 'a')
+    repository.add('a.txt')
+    repository.commit('first')
+    repository.branch('feature')
+    repository.checkout('feature')
+    write('g.txt', 'theirs')
+    repository.add('g.txt')
+    repository.commit('second')
+    repository.checkout('master')
+    write('g.txt', 'mine')
+
+    with pytest.raises(ValueError, match='Untracked files would be deleted or overwritten'):
+        repository.checkout('feature')
+
+    with open('g.txt') as file_handler:
+        assert file_handler.read() == 'mine'
+    assert repository.active_branch == 'master'
+
+
+def test_checkout_keeps_untracked_file_in_place_of_added_directory(repository):
+    write('a.txt', 'a')
+    repository.add('a.txt')
+    repository.commit('first')
+    repository.branch('feature')
+    repository.checkout('feature')
+    write(os.path.join('d', 'g.txt'), 'theirs')
+    repository.add('d')
+    repository.commit('second')
+    repository.checkout('master')
+    write('d', 'mine')
+
+    with pytest.raises(ValueError, match='Untracked files would be deleted or overwritten'):
+        repository.checkout('feature')
+
+    with open('d') as file_handler:
+        assert file_handler.read() == 'mine'
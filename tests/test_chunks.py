@@ -0,0 +1,88 @@
+import hashlib
+import random
+
+import pytest
+
+import chunk_funcs
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    """Chunk sizes small enough for the test data to hold many chunks."""
+    monkeypatch.setattr(chunk_funcs, 'MIN_CHUNK', 256)
+    monkeypatch.setattr(chunk_funcs, 'AVERAGE_CHUNK', 1024)
+    monkeypatch.setattr(chunk_funcs, 'MAX_CHUNK', 4096)
+    monkeypatch.setattr(chunk_funcs, 'ANCHOR_SMALL', chunk_funcs.ANCHOR[:10])
+    monkeypatch.setattr(chunk_funcs, 'ANCHOR_LARGE', chunk_funcs.ANCHOR[:8])
+
+
+def get_chunks(data, base=()):
+    return [chunk_funcs.Chunk(hashlib.sha1(data[start:end]).hexdigest(), end - start)
+            for start, end in chunk_funcs.iter_chunks(data, base)]
+
+
+def edit(data, generator):
+    """Return `data` with a random insertion, deletion, overwrite, append or truncation."""
+    position = generator.randrange(len(data))
+    insert = generator.randbytes(generator.randrange(1, 64))
+    kind = generator.choice(['insert', 'delete', 'overwrite', 'append', 'truncate'])
+    if kind == 'insert':
+        return data[:position] + insert + data[position:]
+    if kind == 'delete':
+        return data[:position] + data[position + len(insert):]
+    if kind == 'overwrite':
+        return data[:position] + insert + data[position + len(insert):]
+    if kind == 'append':
+        return data + insert
+    return data[:position]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_rechunking_matches_chunking_from_scratch(seed):
+    generator = random.Random(seed)
+    data = generator.randbytes(64 * 1024)
+    base = get_chunks(data)
+    for _ in range(5):
+        data = edit(data, generator) or b'x'
+
+        assert get_chunks(data, base) == get_chunks(data)
+        base = get_chunks(data, base)
+
+
+def test_rechunking_only_scans_changed_region(monkeypatch):
+    data = random.Random(0).randbytes(256 * 1024)
+    base = get_chunks(data)
+    scanned = []
+    find_cut = chunk_funcs.find_cut
+    monkeypatch.setattr(chunk_funcs, 'find_cut', lambda *args: scanned.append(args[1]) or find_cut(*args))
+    position = len(data) // 2
+    edited = data[:position] + b'x' + data[position + 1:]
+
+    chunks = get_chunks(edited, base)
+
+    assert len(scanned) <= 3
+    assert len(set(chunks) - set(base)) <= 2
+
+
+def test_chunk_list_without_sizes_is_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_funcs, 'get_chunks_path', lambda object_id, wit_dir: str(tmp_path / object_id))
+    (tmp_path / 'old').write_text('a' * 40 + '\n' + 'b' * 40 + '\n')
+
+    assert chunk_funcs.read_chunk_list('old', '') == ['a' * 40, 'b' * 40]
+    assert chunk_funcs.read_chunks('old', '') == [chunk_funcs.Chunk('a' * 40, None), chunk_funcs.Chunk('b' * 40, None)]
+
+
+def test_cuts_do_not_depend_on_scan_blocks(monkeypatch):
+    data = random.Random(1).randbytes(64 * 1024)
+    chunks = get_chunks(data)
+    monkeypatch.setattr(chunk_funcs, 'SCAN_BLOCK', 64)
+
+    assert get_chunks(data) == chunks
+
+
+def test_cuts_are_found_again_after_an_insertion():
+    data = random.Random(2).randbytes(64 * 1024)
+    chunks = get_chunks(data)
+    shifted = get_chunks(b'inserted' + data)
+
+    assert len(set(chunks) - set(shifted)) <= 2
@@ -0,0 +1,115 @@
+import errno
+import os
+
+import pytest
+
+import object_funcs
+import utilities
+
+from conftest import write
+
+
+CONTENT = bytes(range(256)) * 4096
+
+
+def fail(error_number):
+    """Return a function raising OSError with `error_number`, like a filesystem lacking a feature."""
+    def function(*args, **kwargs):
+        raise OSError(error_number, os.strerror(error_number))
+    return function
+
+
+@pytest.fixture(autouse=True)
+def strategies(monkeypatch):
+    """Start every test with every copy strategy available and none used."""
+    monkeypatch.setattr(utilities, 'available_strategies', list(utilities.COPY_STRATEGIES))
+    monkeypatch.setattr(utilities, 'used_strategies', set())
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'source.bin'
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+@pytest.mark.parametrize('failing, expected', [
+    (['reflink'], 'copy_file_range'),
+    (['reflink', 'copy_file_range'], 'sendfile'),
+    (['reflink', 'copy_file_range', 'sendfile'], 'buffered copy'),
+])
+def test_copy_falls_back_to_next_strategy(failing, expected, source, tmp_path, monkeypatch):
+    failures = {
+        'reflink': (utilities.fcntl, 'ioctl', fail(errno.EOPNOTSUPP)),
+        'copy_file_range': (os, 'copy_file_range', fail(errno.EXDEV)),
+        'sendfile': (os, 'sendfile', fail(errno.ENOSYS)),
+    }
+    for strategy in failing:
+        monkeypatch.setattr(*failures[strategy])
+    new_path = str(tmp_path / 'copy.bin')
+
+    utilities.copy_file(source, new_path)
+
+    with open(new_path, 'rb') as file_handler:
+        assert file_handler.read() == CONTENT
+    assert utilities.used_strategies == {expected}
+    assert utilities.available_strategies[0] == expected
+
+
+def test_copy_discards_partial_copy_of_failed_strategy(source, tmp_path, monkeypatch):
+    def copy_half(source_fd, destination_fd, count, *args):
+        os.write(destination_fd, b'x' * (count // 2))
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(utilities.fcntl, 'ioctl', fail(errno.EOPNOTSUPP))
+    monkeypatch.setattr(os, 'copy_file_range', copy_half)
+    new_path = str(tmp_path / 'copy.bin')
+
+    utilities.copy_file(source, new_path)
+
+    with open(new_path, 'rb') as file_handler:
+        assert file_handler.read() == CONTENT
+
+
+def test_copy_raises_other_errors(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(utilities.fcntl, 'ioctl', fail(errno.EIO))
+
+    with pytest.raises(OSError):
+        utilities.copy_file(source, str(tmp_path / 'copy.bin'))
+    assert 'reflink' in utilities.available_strategies
+
+
+def test_parallel_copies_fall_back_once(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(utilities.fcntl, 'ioctl', fail(errno.EOPNOTSUPP))
+    monkeypatch.setattr(os, 'copy_file_range', fail(errno.EXDEV))
+    monkeypatch.setattr(utilities, 'JOBS', 8)
+    new_paths = [str(tmp_path / f'copy{number}.bin') for number in range(64)]
+
+    utilities.run_jobs(lambda new_path: utilities.copy_file(source, new_path), new_paths)
+
+    for new_path in new_paths:
+        with open(new_path, 'rb') as file_handler:
+            assert file_handler.read() == CONTENT
+    assert utilities.available_strategies == ['sendfile', 'buffered copy']
+
+
+def test_link_only_shares_objects_with_staging_area(repository, monkeypatch):
+    monkeypatch.setattr(utilities, 'LINK_OBJECTS', True)
+    write('a.txt', 'one')
+    repository.add('a.txt')
+    first_id = repository.commit('one')
+    write('a.txt', 'two')
+    repository.add('a.txt')
+    repository.commit('two')
+
+    repository.checkout(first_id)
+
+    object_id = object_funcs.read_manifest(first_id, repository.wit_dir)['a.txt']
+    object_stat = os.stat(object_funcs.get_object_path(object_id, repository.wit_dir))
+    staged_stat = os.stat(os.path.join(repository.staging_area, 'a.txt'))
+    working_stat = os.stat('a.txt')
+    assert staged_stat.st_ino == object_stat.st_ino
+    assert working_stat.st_ino != object_stat.st_ino
+    assert working_stat.st_nlink == 1
+    with open('a.txt') as file_handler:
+        assert file_handler.read() == 'one'
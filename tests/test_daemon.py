@@ -0,0 +1,125 @@
+import os
+import shutil
+import sys
+import threading
+import time
+
+import pytest
+
+import daemon_funcs
+import ignore_funcs
+import status_funcs
+from conftest import write
+
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='The daemon watches trees with inotify')
+
+
+def scan(root):
+    """Return what a fresh scan of `root` finds, in the form of `TreeWatcher.get_snapshot`."""
+    return [[rel_path, stat_result.st_mode, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns]
+            for rel_path, stat_result in status_funcs.iter_scan(root, ignore_funcs.Matcher())]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = str(tmp_path / 'tree')
+    write(os.path.join(root, 'a.txt'), 'a')
+    write(os.path.join(root, 'd', 'b.txt'), 'b')
+    write(os.path.join(root, 'd', 'e', 'c.txt'), 'c')
+    write(os.path.join(root, 'build', 'out.o'), 'o')
+    write(os.path.join(root, ignore_funcs.IGNORE_FILE), 'build/\n')
+    os.makedirs(os.path.join(root, '.wit'))
+    return root
+
+
+@pytest.fixture
+def watcher(tree):
+    tree_watcher = daemon_funcs.TreeWatcher(tree)
+    yield tree_watcher
+    tree_watcher.close()
+
+
+@linux_only
+def test_watcher_follows_changes(tree, watcher):
+    assert watcher.get_snapshot() == scan(tree)
+
+    write(os.path.join(tree, 'a.txt'), 'changed')
+    write(os.path.join(tree, 'new.txt'), 'new')
+    os.remove(os.path.join(tree, 'd', 'b.txt'))
+    write(os.path.join(tree, 'f', 'g', 'h.txt'), 'h')
+    os.rename(os.path.join(tree, 'd', 'e'), os.path.join(tree, 'moved'))
+    write(os.path.join(tree, 'moved', 'i.txt'), 'i')
+    os.makedirs(os.path.join(tree, 'empty'))
+    write(os.path.join(tree, 'build', 'ignored.o'), 'o')
+    watcher.refresh()
+
+    assert watcher.get_snapshot() == scan(tree)
+
+    shutil.rmtree(os.path.join(tree, 'f'))
+    os.rmdir(os.path.join(tree, 'empty'))
+    watcher.refresh()
+
+    assert watcher.get_snapshot() == scan(tree)
+
+
+@linux_only
+def test_watcher_applies_ignore_file_changes(tree, watcher):
+    write(os.path.join(tree, 'd', 'debug.log'), 'log')
+    watcher.refresh()
+    write(os.path.join(tree, ignore_funcs.IGNORE_FILE), '*.log\n')
+    watcher.refresh()
+
+    snapshot = watcher.get_snapshot()
+    assert snapshot == scan(tree)
+    assert os.path.join('build', 'out.o') in [entry[0] for entry in snapshot]
+    assert os.path.join('d', 'debug.log') not in [entry[0] for entry in snapshot]
+
+    write(os.path.join(tree, 'd', ignore_funcs.IGNORE_FILE), '!debug.log\n')
+    watcher.refresh()
+
+    assert watcher.get_snapshot() == scan(tree)
+
+
+@linux_only
+def test_watcher_rescans_when_events_are_lost(tree, watcher, monkeypatch):
+    write(os.path.join(tree, 'unseen.txt'), 'unseen')
+    os.remove(os.path.join(tree, 'a.txt'))
+    # Drop the real events, as the kernel does when the queue overflows, and report the overflow.
+    list(watcher.inotify.read_events())
+    monkeypatch.setattr(watcher.inotify, 'read_events', lambda: iter([(-1, daemon_funcs.IN_Q_OVERFLOW, '')]))
+    watcher.refresh()
+
+    assert watcher.get_snapshot() == scan(tree)
+
+
+@linux_only
+def test_daemon_serves_snapshots(tree):
+    wit_dir = os.path.join(tree, '.wit')
+    server = threading.Thread(target=daemon_funcs.serve, args=(tree,))
+    server.start()
+    try:
+        for _ in range(200):
+            if daemon_funcs.is_running(wit_dir):
+                break
+            time.sleep(0.01)
+        write(os.path.join(tree, 'd', 'new.txt'), 'new')
+
+        snapshot = daemon_funcs.get_snapshot(tree)
+        assert [[rel_path, stat_result.st_mode, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns]
+                for rel_path, stat_result in snapshot.items()] == scan(tree)
+    finally:
+        daemon_funcs.send_request(wit_dir, 'stop')
+        server.join()
+    assert not os.path.exists(daemon_funcs.get_socket_path(wit_dir))
+
+
+def test_status_scans_without_daemon(repository, monkeypatch):
+    write('a.txt', 'a')
+    scans = []
+    iter_scan = status_funcs.iter_scan
+    monkeypatch.setattr(status_funcs, 'iter_scan', lambda *args: scans.append(args) or iter_scan(*args))
+
+    assert daemon_funcs.get_snapshot(repository.root) is None
+    assert repository.status().untracked == [os.path.join(repository.root, 'a.txt')]
+    assert [args[0] for args in scans].count(repository.root) == 1
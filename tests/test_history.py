@@ -0,0 +1,77 @@
+import os
+
+import history_funcs
+import merge_funcs
+import transfer_funcs
+from conftest import write
+
+
+def read_graph_file(wit_dir):
+    with open(history_funcs.get_graph_path(wit_dir), 'rb') as file_handler:
+        return file_handler.read()
+
+
+def test_commit_appends_to_commit_graph(repository, monkeypatch):
+    write('a.txt', 'a')
+    repository.add('a.txt')
+    repository.commit('first')
+    rebuilds = []
+    write_commit_graph = history_funcs.write_commit_graph
+    monkeypatch.setattr(history_funcs, 'write_commit_graph',
+                        lambda wit_dir: rebuilds.append(wit_dir) or write_commit_graph(wit_dir))
+    for content in ('b', 'c'):
+        write('a.txt', content)
+        repository.add('a.txt')
+        repository.commit(content)
+
+    assert rebuilds == []
+    appended = read_graph_file(repository.wit_dir)
+    write_commit_graph(repository.wit_dir)
+    assert appended == read_graph_file(repository.wit_dir)
+
+
+def test_commit_rebuilds_missing_commit_graph(repository):
+    write('a.txt', 'a')
+    repository.add('a.txt')
+    repository.commit('first')
+    os.remove(history_funcs.get_graph_path(repository.wit_dir))
+    write('a.txt', 'b')
+    repository.add('a.txt')
+    repository.commit('second')
+
+    assert len(history_funcs.read_commit_graph(repository.wit_dir).ids) == 2
+
+
+def commit_file(repository, name, content):
+    write(name, content)
+    repository.add(name)
+    return repository.commit(content)
+
+
+def test_shared_parent_reads_only_records_after_it(repository, monkeypatch):
+    for number in range(20):
+        commit_file(repository, 'a.txt', str(number))
+    fork_id = repository.head
+    repository.branch('feature')
+    commit_file(repository, 'a.txt', 'master')
+    repository.checkout('feature')
+    commit_file(repository, 'b.txt', 'feature')
+    repository.checkout('master')
+    read = []
+    get = history_funcs.GraphFile.get
+    monkeypatch.setattr(history_funcs.GraphFile, 'get', lambda self, position: read.append(position) or get(self, position))
+
+    assert merge_funcs.get_shared_parent('feature', repository.wit_dir) == fork_id
+    assert len(set(read)) <= 5
+
+
+def test_is_fast_forward(repository):
+    first_id = commit_file(repository, 'a.txt', 'first')
+    repository.branch('feature')
+    second_id = commit_file(repository, 'a.txt', 'second')
+    repository.checkout('feature')
+    other_id = commit_file(repository, 'b.txt', 'other')
+
+    assert transfer_funcs.is_fast_forward(repository.wit_dir, first_id, second_id)
+    assert not transfer_funcs.is_fast_forward(repository.wit_dir, second_id, first_id)
+    assert not transfer_funcs.is_fast_forward(repository.wit_dir, second_id, other_id)
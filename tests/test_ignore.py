@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+import ignore_funcs
+from conftest import write
+
+
+@pytest.mark.parametrize('lines, rel_path, is_dir, expected', [
+    # Names without a slash match at any depth.
+    (['*.log'], 'a.log', False, True),
+    (['*.log'], os.path.join('d', 'e', 'a.log'), False, True),
+    (['*.log'], 'a.txt', False, False),
+    (['?.txt'], 'a.txt', False, True),
+    (['?.txt'], 'ab.txt', False, False),
+    (['*.txt'], os.path.join('d', 'a.txt'), False, True),
+    # A slash anchors the pattern to the directory of the ignore file.
+    (['/build'], 'build', True, True),
+    (['/build'], os.path.join('d', 'build'), True, False),
+    (['d/build'], os.path.join('d', 'build'), True, True),
+    (['d/build'], os.path.join('e', 'd', 'build'), True, False),
+    (['d/*.txt'], os.path.join('d', 'e', 'a.txt'), False, False),
+    # A trailing slash only matches directories.
+    (['build/'], 'build', True, True),
+    (['build/'], 'build', False, False),
+    # Double asterisks match any number of directories.
+    (['**/tmp'], 'tmp', True, True),
+    (['**/tmp'], os.path.join('a', 'b', 'tmp'), False, True),
+    (['logs/**'], os.path.join('logs', 'a', 'b.txt'), False, True),
+    (['logs/**'], 'logs', True, False),
+    (['a/**/b'], os.path.join('a', 'b'), False, True),
+    (['a/**/b'], os.path.join('a', 'x', 'y', 'b'), False, True),
+    (['a/**/b'], os.path.join('c', 'a', 'b'), False, False),
+    # Character classes, negated ones never matching a slash.
+    (['[abc].txt'], 'b.txt', False, True),
+    (['[abc].txt'], 'd.txt', False, False),
+    (['[!abc].txt'], 'd.txt', False, True),
+    (['[!abc].txt'], 'a.txt', False, False),
+    (['[a-c]?.txt'], 'cz.txt', False, True),
+    # Escapes, comments, blank lines and trailing spaces.
+    (['\\#hash'], '#hash', False, True),
+    (['# comment', '', 'a.txt   '], 'a.txt', False, True),
+    (['# a.txt'], 'a.txt', False, False),
+    (['a\\ '], 'a ', False, True),
+    # The last matching pattern decides.
+    (['*.log', '!keep.log'], 'keep.log', False, False),
+    (['*.log', '!keep.log'], 'other.log', False, True),
+    (['!keep.log', '*.log'], 'keep.log', False, True),
+    (['build/', '!build'], 'build', True, False),
+    (['!build', 'build/'], 'build', True, True),
+])
+def test_matcher(lines, rel_path, is_dir, expected):
+    matcher = ignore_funcs.Matcher((ignore_funcs.compile_rules(lines, ''),))
+
+    assert matcher.is_ignored(rel_path, is_dir) == expected
+
+
+def test_deeper_ignore_files_take_precedence(tmp_path):
+    write(str(tmp_path / ignore_funcs.IGNORE_FILE), '*.log\n/top.txt\n')
+    write(str(tmp_path / 'sub' / ignore_funcs.IGNORE_FILE), '!keep.log\n*.txt\n')
+    matcher = ignore_funcs.Matcher().load(str(tmp_path), '')
+    sub_matcher = matcher.load(str(tmp_path / 'sub'), 'sub' + os.sep)
+
+    assert sub_matcher.is_ignored(os.path.join('sub', 'other.log'), False)
+    assert not sub_matcher.is_ignored(os.path.join('sub', 'keep.log'), False)
+    assert sub_matcher.is_ignored(os.path.join('sub', 'a.txt'), False)
+    assert matcher.is_ignored('keep.log', False)
+    assert matcher.is_ignored('top.txt', False)
+    assert not matcher.is_ignored('a.txt', False)
+
+
+def test_path_under_ignored_directory_is_ignored(tmp_path):
+    write(str(tmp_path / ignore_funcs.IGNORE_FILE), 'build/\n')
+    write(str(tmp_path / 'sub' / ignore_funcs.IGNORE_FILE), '/local.txt\n')
+
+    assert ignore_funcs.is_path_ignored(str(tmp_path), os.path.join('build', 'out', 'a.o'), False)
+    assert ignore_funcs.is_path_ignored(str(tmp_path), os.path.join('sub', 'local.txt'), False)
+    assert not ignore_funcs.is_path_ignored(str(tmp_path), 'local.txt', False)
+    assert not ignore_funcs.is_path_ignored(str(tmp_path), os.path.join('src', 'a.c'), False)
+
+
+def test_matcher_for_subdirectory_has_rules_above_it(tmp_path):
+    write(str(tmp_path / ignore_funcs.IGNORE_FILE), 'sub/*.tmp\n')
+    matcher = ignore_funcs.get_matcher(str(tmp_path), 'sub').load(str(tmp_path / 'sub'), '')
+
+    assert matcher.is_ignored('a.tmp', False)
+    assert not matcher.is_ignored('a.txt', False)
+
+
+def test_add_and_status_skip_ignored_subtrees(repository):
+    write(ignore_funcs.IGNORE_FILE, 'build/\n*.log\n')
+    write(os.path.join('build', 'out', 'a.o'), 'object')
+    write(os.path.join('src', 'a.c'), 'source')
+    write(os.path.join('src', 'debug.log'), 'log')
+    write(os.path.join('src', ignore_funcs.IGNORE_FILE), '!debug.log\n')
+    write('run.log', 'log')
+
+    repository.add('.')
+
+    index = repository.status().index
+    assert sorted(index) == sorted([ignore_funcs.IGNORE_FILE, os.path.join('src', 'a.c'),
+                                    os.path.join('src', 'debug.log'), os.path.join('src', ignore_funcs.IGNORE_FILE)])
+    repository.commit('first')
+    write(os.path.join('build', 'out', 'b.o'), 'object')
+    write('other.log', 'log')
+    assert repository.status().untracked == []
+    with pytest.raises(ValueError, match='ignored'):
+        repository.add(os.path.join('build', 'out', 'b.o'))
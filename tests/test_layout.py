@@ -0,0 +1,101 @@
+import re
+
+import pytest
+
+import layout_funcs
+from conftest import write
+
+
+MERGED_GRAPH = '''\
+*  {after} (HEAD, master) after
+*  {merge} Merged branch: feature
+|\\
+| *  {feature_again} (feature) feature again
+| *  {feature} on feature
+* |  {master} on master
+|/
+*  {base} base'''
+
+BRANCHED_GRAPH = '''\
+●  {master_again} (HEAD, master) master again
+│ ●  {feature} (feature) on feature
+● │  {master} on master
+│╱
+●  {base} base'''
+
+
+def commit_file(repository, name, content):
+    write(name, content)
+    repository.add(name)
+    return repository.commit(content)
+
+
+@pytest.fixture
+def merged(repository):
+    """A history with a branch merged back into master, and the ids of its commits."""
+    commit_ids = {'base': commit_file(repository, 'a.txt', 'base')}
+    repository.branch('feature')
+    commit_ids['master'] = commit_file(repository, 'a.txt', 'on master')
+    repository.checkout('feature')
+    commit_ids['feature'] = commit_file(repository, 'b.txt', 'on feature')
+    commit_ids['feature_again'] = commit_file(repository, 'b.txt', 'feature again')
+    repository.checkout('master')
+    repository.merge('feature')
+    commit_ids['merge'] = repository.head
+    commit_ids['after'] = commit_file(repository, 'a.txt', 'after')
+    return commit_ids
+
+
+def get_text_graph(wit_dir, all_commits=False, unicode=False):
+    graph, positions = layout_funcs.get_positions(wit_dir, all_commits)
+    return '\n'.join(layout_funcs.iter_text_graph(graph, positions, wit_dir, unicode))
+
+
+def shorten(commit_ids):
+    return {name: commit_id[:layout_funcs.SHORT_ID] for name, commit_id in commit_ids.items()}
+
+
+def test_text_graph_of_merge(repository, merged):
+    assert get_text_graph(repository.wit_dir) == MERGED_GRAPH.format(**shorten(merged))
+
+
+def test_text_graph_of_unmerged_branch(repository):
+    commit_ids = {'base': commit_file(repository, 'a.txt', 'base')}
+    repository.branch('feature')
+    commit_ids['master'] = commit_file(repository, 'a.txt', 'on master')
+    repository.checkout('feature')
+    commit_ids['feature'] = commit_file(repository, 'b.txt', 'on feature')
+    repository.checkout('master')
+    commit_ids['master_again'] = commit_file(repository, 'a.txt', 'master again')
+
+    assert get_text_graph(repository.wit_dir, all_commits=True, unicode=True) == BRANCHED_GRAPH.format(
+        **shorten(commit_ids))
+    assert commit_ids['feature'][:layout_funcs.SHORT_ID] not in get_text_graph(repository.wit_dir)
+
+
+def test_dot_lists_every_commit_and_parent(repository, merged):
+    graph, positions = layout_funcs.get_positions(repository.wit_dir)
+    lines = list(layout_funcs.iter_dot(graph, positions, repository.wit_dir))
+
+    assert lines[0] == 'digraph wit {' and lines[-1] == '}'
+    nodes = {}
+    for line in lines[2:-1]:
+        match = re.fullmatch(r'    "(\w+)" \[label="(.*)"\];', line)
+        if match:
+            nodes[match.group(1)] = match.group(2).split('\\n')
+    labels = {commit_id: [commit_id[:layout_funcs.SHORT_ID]] for commit_id in merged.values()}
+    assert nodes == {
+        **labels,
+        merged['after']: [merged['after'][:layout_funcs.SHORT_ID], 'HEAD', 'master'],
+        merged['feature_again']: [merged['feature_again'][:layout_funcs.SHORT_ID], 'feature'],
+    }
+    edges = [tuple(re.fullmatch(r'    "(\w+)" -> "(\w+)";', line).groups())
+             for line in lines[2:-1] if '->' in line]
+    assert sorted(edges) == sorted([
+        (merged['after'], merged['merge']),
+        (merged['merge'], merged['master']),
+        (merged['merge'], merged['feature_again']),
+        (merged['feature_again'], merged['feature']),
+        (merged['feature'], merged['base']),
+        (merged['master'], merged['base']),
+    ])
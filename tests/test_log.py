@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+import commit_funcs
+import wit
+from conftest import write
+
+
+DAY = 24 * 60 * 60
+# 2020-01-01 00:00 UTC.
+START = 1577836800
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A clock starting on `START`, moved a day forward by `commit_file`."""
+    now = [START]
+    monkeypatch.setattr(commit_funcs.time, 'time', lambda: now[0])
+    return now
+
+
+def commit_file(repository, clock, name, content):
+    write(name, content)
+    repository.add(name)
+    commit_id = repository.commit(content)
+    clock[0] += DAY
+    return commit_id
+
+
+def get_messages(commits):
+    return [commit.message for commit in commits]
+
+
+def test_log_lists_history_newest_first(repository, clock):
+    for content in ('first', 'second', 'third'):
+        commit_file(repository, clock, 'a.txt', content)
+
+    assert get_messages(repository.log()) == ['third', 'second', 'first']
+
+
+def test_log_filters_by_date(repository, clock):
+    for content in ('first', 'second', 'third'):
+        commit_file(repository, clock, 'a.txt', content)
+
+    assert get_messages(repository.log(since=START + DAY)) == ['third', 'second']
+    assert get_messages(repository.log(until=START + DAY)) == ['second', 'first']
+    assert get_messages(repository.log(since=START + DAY, until=START + DAY)) == ['second']
+
+
+def test_log_filters_by_message(repository, clock):
+    for content in ('fix parser', 'add feature', 'fix printer'):
+        commit_file(repository, clock, 'a.txt', content)
+
+    assert get_messages(repository.log(grep='^fix')) == ['fix printer', 'fix parser']
+
+
+def test_log_rejects_invalid_pattern(repository, clock, capsys):
+    commit_file(repository, clock, 'a.txt', 'first')
+
+    with pytest.raises(ValueError, match='Invalid pattern'):
+        repository.log(grep='(')
+    wit.main(['log', '--grep', '('])
+
+    assert capsys.readouterr().out.startswith('Invalid pattern: `(`')
+
+
+def test_log_filters_by_path(repository, clock):
+    commit_file(repository, clock, 'a.txt', 'a')
+    commit_file(repository, clock, 'b.txt', 'b')
+    commit_file(repository, clock, os.path.join('d', 'c.txt'), 'c')
+    commit_file(repository, clock, 'a.txt', 'a again')
+
+    assert get_messages(repository.log(paths=['a.txt'])) == ['a again', 'a']
+    assert get_messages(repository.log(paths=['d'])) == ['c']
+    assert get_messages(repository.log(paths=['b.txt', 'd'])) == ['c', 'b']
+
+
+def test_log_skips_merge_matching_a_parent_in_path(repository, clock):
+    commit_file(repository, clock, 'a.txt', 'base')
+    repository.branch('feature')
+    repository.checkout('feature')
+    commit_file(repository, clock, 'b.txt', 'on feature')
+    repository.checkout('master')
+    commit_file(repository, clock, 'a.txt', 'on master')
+    repository.merge('feature')
+
+    assert get_messages(repository.log())[0] == 'Merged branch: feature'
+    assert get_messages(repository.log(paths=['b.txt'])) == ['on feature']
+    assert get_messages(repository.log(paths=['a.txt'])) == ['on master', 'base']
+
+
+def test_log_command_limits_and_filters(repository, clock, capsys):
+    for content in ('first', 'second', 'third'):
+        commit_file(repository, clock, 'a.txt', content)
+    capsys.readouterr()
+
+    wit.main(['log', '-n', '2'])
+    assert capsys.readouterr().out.count('commit ') == 2
+
+    wit.main(['log', '--since', '2020-01-02', '--until', '2020-01-02 23:59'])
+    output = capsys.readouterr().out
+    assert output.count('commit ') == 1 and 'second' in output
+
+    wit.main(['log', '--', 'b.txt'])
+    assert capsys.readouterr().out == ''
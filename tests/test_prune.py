@@ -0,0 +1,50 @@
+import os
+
+import metadata_funcs
+import object_funcs
+import pack_funcs
+
+from conftest import write
+
+
+def test_prune_after_gc(repository):
+    write('a.txt', 'one')
+    repository.add('a.txt')
+    first_id = repository.commit('one')
+    write('a.txt', 'two')
+    repository.add('a.txt')
+    repository.commit('two')
+    repository.checkout(first_id)
+    write('b.txt', 'orphan')
+    repository.add('b.txt')
+    orphan_id = repository.commit('orphan')
+    repository.checkout('master')
+    orphan_blob = object_funcs.read_manifest(orphan_id, repository.wit_dir)['b.txt']
+    repository.gc()
+
+    result = repository.prune(expire_days=0)
+
+    assert result.commits == 1
+    assert result.objects == 2
+    assert not metadata_funcs.commit_exists(orphan_id, repository.wit_dir)
+    assert not object_funcs.has_object(orphan_blob, repository.wit_dir)
+    assert orphan_blob not in set(pack_funcs.iter_packed_objects(repository.wit_dir))
+    assert repository.prune(expire_days=0) == (0, 0)
+    repository.checkout(first_id)
+    with open('a.txt') as file_handler:
+        assert file_handler.read() == 'one'
+    assert not os.path.exists('b.txt')
+
+
+def test_prune_keeps_commits_in_reflog(repository):
+    write('a.txt', 'one')
+    repository.add('a.txt')
+    first_id = repository.commit('one')
+    write('b.txt', 'orphan')
+    repository.add('b.txt')
+    repository.commit('orphan')
+    repository.checkout(first_id)
+    repository.refs.set('master', first_id)
+    repository.refs.save()
+
+    assert repository.prune() == (0, 0)
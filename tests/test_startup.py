@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import wit
+
+from conftest import write
+
+
+WIT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wit.py')
+PLOTTING_MODULES = ('matplotlib', 'networkx')
+
+
+def get_imported_modules(args, cwd, python_path):
+    """Return the names of the modules imported by running wit with `args`, as reported by `-X importtime`."""
+    env = dict(os.environ, PYTHONPATH=python_path)
+    process = subprocess.run([sys.executable, '-X', 'importtime', WIT, *args], cwd=cwd, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=60)
+    return {line.rsplit('|', 1)[-1].strip() for line in process.stderr.splitlines() if line.startswith('import time:')}
+
+
+@pytest.fixture
+def python_path(tmp_path):
+    """A directory holding stand-ins for the plotting libraries, so importing them shows even where
+    they aren't installed."""
+    stubs = tmp_path / 'stubs'
+    for name in PLOTTING_MODULES:
+        write(str(stubs / name / '__init__.py'))
+    write(str(stubs / 'matplotlib' / 'pyplot.py'))
+    return str(stubs)
+
+
+@pytest.mark.parametrize('command', sorted(set(wit.COMMANDS) - {'graph'}))
+def test_commands_do_not_import_plotting_libraries(command, repository, python_path):
+    imported = get_imported_modules([command], repository.root, python_path)
+
+    assert not [name for name in imported if name.split('.')[0] in PLOTTING_MODULES]
+
+
+def test_graph_output_to_image_imports_plotting_libraries(repository, python_path):
+    write('a.txt', 'a')
+    repository.add('a.txt')
+    repository.commit('one')
+
+    imported = get_imported_modules(['graph', '--output', 'graph.png'], repository.root, python_path)
+
+    assert {'matplotlib', 'networkx'} <= imported
@@ -0,0 +1,37 @@
+import os
+
+from conftest import write
+
+
+def test_status_reports_every_category(repository):
+    for name in ('kept.txt', 'edited.txt', 'deleted.txt'):
+        write(name, name)
+        repository.add(name)
+    repository.commit('first')
+    write(os.path.join('d', 'staged.txt'), 'staged')
+    repository.add(os.path.join('d', 'staged.txt'))
+    write('edited.txt', 'edited again')
+    os.remove('deleted.txt')
+    write('new.txt', 'new')
+
+    current_status = repository.status()
+
+    root = repository.root
+    assert current_status.changes == [os.path.join(root, 'd', 'staged.txt')]
+    assert current_status.unstaged == [os.path.join(root, 'edited.txt')]
+    assert current_status.untracked == [os.path.join(root, 'new.txt')]
+    assert current_status.removed == [os.path.join(root, 'deleted.txt')]
+
+
+def test_status_reads_staged_files_that_are_ignored(repository):
+    write('build.log', 'first')
+    repository.add('build.log')
+    repository.commit('first')
+    write('.witignore', '*.log\n')
+    repository.add('.witignore')
+    write('build.log', 'second')
+
+    current_status = repository.status()
+
+    assert current_status.unstaged == [os.path.join(repository.root, 'build.log')]
+    assert current_status.removed == []
@@ -0,0 +1,166 @@
+import io
+import os
+
+import pytest
+
+import metadata_funcs
+import refs_funcs
+import repository_funcs
+import transfer_funcs
+from conftest import write
+
+
+def commit_file(repository, rel_path, content):
+    write(os.path.join(repository.root, rel_path), content)
+    repository.add(os.path.join(repository.root, rel_path))
+    return repository.commit(content)
+
+
+def read(repository, rel_path):
+    with open(os.path.join(repository.root, rel_path)) as file_handler:
+        return file_handler.read()
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir(str(tmp_path / 'source'))
+    repository = repository_funcs.Repository.init(str(tmp_path / 'source'))
+    commit_file(repository, 'a.txt', 'a')
+    os.makedirs(os.path.join(repository.root, 'empty'))
+    repository.add(os.path.join(repository.root, 'empty'))
+    commit_file(repository, os.path.join('d', 'b.txt'), 'b')
+    repository.branch('feature')
+    return repository
+
+
+@pytest.fixture
+def clone(source, tmp_path):
+    repository, _ = repository_funcs.Repository.clone(source.root, str(tmp_path / 'clone'))
+    return repository
+
+
+def test_clone_copies_branches_and_checks_out_active_one(source, tmp_path):
+    repository, result = repository_funcs.Repository.clone(source.root, str(tmp_path / 'clone'))
+
+    assert result.commits == 2
+    assert result.updated == ['feature', 'master']
+    assert repository.refs.branches == {name: commit_id for name, commit_id in source.refs.branches.items()}
+    assert repository.active_branch == 'master'
+    assert read(repository, os.path.join('d', 'b.txt')) == 'b'
+    assert os.path.isdir(os.path.join(repository.root, 'empty'))
+    current_status = repository.status()
+    assert (current_status.changes, current_status.unstaged, current_status.untracked) == ([], [], [])
+    assert [commit.message for commit in repository.log()] == ['b', 'a']
+
+
+def test_clone_refuses_non_empty_directory(source, tmp_path):
+    write(str(tmp_path / 'clone' / 'mine.txt'), 'mine')
+
+    with pytest.raises(ValueError, match='not empty'):
+        repository_funcs.Repository.clone(source.root, str(tmp_path / 'clone'))
+    assert os.listdir(str(tmp_path / 'clone')) == ['mine.txt']
+
+
+def test_push_sends_only_missing_images(source, clone):
+    commit_id = commit_file(clone, 'a.txt', 'pushed')
+
+    result = clone.push(source.root)
+
+    assert result.commits == 1
+    assert result.updated == ['master']
+    assert source.refs.get('master') == commit_id
+    # The active branch of the target moved, so its working tree follows.
+    assert read(source, 'a.txt') == 'pushed'
+    again = clone.push(source.root)
+    assert (again.commits, again.objects, again.updated) == (0, 0, [])
+
+
+def test_pull_fast_forwards(source, clone):
+    commit_file(source, os.path.join('d', 'b.txt'), 'pulled')
+    commit_id = commit_file(source, 'c.txt', 'c')
+
+    result = clone.pull(source.root)
+
+    assert result.commits == 2
+    assert clone.head == commit_id
+    assert read(clone, os.path.join('d', 'b.txt')) == 'pulled'
+    assert read(clone, 'c.txt') == 'c'
+
+
+def test_push_rejects_diverged_branch(source, clone):
+    source_id = commit_file(source, 'a.txt', 'source')
+    commit_file(clone, 'a.txt', 'clone')
+
+    with pytest.raises(ValueError, match='Merge them first'):
+        clone.push(source.root)
+
+    assert source.refs.get('master') == source_id
+    assert read(source, 'a.txt') == 'source'
+
+
+def test_pull_fetches_diverged_images_without_moving_branch(source, clone):
+    source_id = commit_file(source, 'a.txt', 'source')
+    clone_id = commit_file(clone, 'a.txt', 'clone')
+
+    with pytest.raises(ValueError, match='diverged'):
+        clone.pull(source.root)
+
+    assert metadata_funcs.commit_exists(source_id, clone.wit_dir)
+    assert clone.refs.get('master') == clone_id
+    assert read(clone, 'a.txt') == 'clone'
+
+
+def test_push_refuses_locked_references(source, clone):
+    commit_file(clone, 'a.txt', 'pushed')
+    lock_path = os.path.join(source.wit_dir, transfer_funcs.LOCK_NAME)
+    write(lock_path)
+
+    with pytest.raises(ValueError, match='being updated'):
+        clone.push(source.root)
+
+    assert source.refs.get('master') == clone.refs.get('feature')
+    assert os.path.exists(lock_path)
+
+
+def test_push_refuses_uncommitted_changes_in_target(source, clone):
+    commit_file(clone, 'a.txt', 'pushed')
+    write(os.path.join(source.root, 'a.txt'), 'uncommitted')
+    source.add(os.path.join(source.root, 'a.txt'))
+
+    with pytest.raises(ValueError, match='not yet committed'):
+        clone.push(source.root)
+
+    assert source.refs.get('master') == clone.refs.get('feature')
+
+
+def make_bundle(source, target):
+    commit_ids = transfer_funcs.find_missing_commits(source.wit_dir, target.wit_dir, [source.head])
+    bundle = io.BytesIO()
+    transfer_funcs.write_bundle(bundle, transfer_funcs.iter_bundle_entries(commit_ids, source.wit_dir, target.wit_dir))
+    return commit_ids, bundle.getvalue()
+
+
+def test_bundle_is_applied(source, clone):
+    commit_file(source, 'c.txt', 'c')
+    commit_ids, bundle = make_bundle(source, clone)
+
+    assert transfer_funcs.apply_bundle(io.BytesIO(bundle), clone.wit_dir) == commit_ids
+    assert metadata_funcs.commit_exists(commit_ids[0], clone.wit_dir)
+
+
+@pytest.mark.parametrize('damage, message', [
+    (lambda bundle: bundle[:len(bundle) // 2], 'truncated'),
+    # The last byte of the digest that ends the bundle.
+    (lambda bundle: bundle[:-5] + bytes([bundle[-5] ^ 1]) + bundle[-4:], 'damaged'),
+    (lambda bundle: b'XXXX' + bundle[4:], 'Unsupported'),
+])
+def test_damaged_bundle_records_no_images(source, clone, damage, message):
+    commit_file(source, 'c.txt', 'c')
+    commit_ids, bundle = make_bundle(source, clone)
+
+    with pytest.raises(ValueError, match=message):
+        transfer_funcs.apply_bundle(io.BytesIO(damage(bundle)), clone.wit_dir)
+
+    assert not metadata_funcs.commit_exists(commit_ids[0], clone.wit_dir)
+    assert refs_funcs.get_refs(clone.wit_dir).get('master') != commit_ids[0]
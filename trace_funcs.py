@@ -0,0 +1,104 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, List, Optional, TypeVar
+
+
+F = TypeVar('F', bound=Callable[..., Any])
+# Checked before any other work, so instrumentation costs one global lookup while disabled.
+ENABLED = False
+FILES_STATED = 'files stat\'ed'
+FILES_READ = 'files read'
+BYTES_READ = 'bytes read'
+BYTES_WRITTEN = 'bytes written'
+METADATA_OPENED = 'metadata files opened'
+NULL_PHASE = contextlib.nullcontext()
+
+events: List[Dict[str, Any]] = []
+counters: Dict[str, int] = {}
+lock = threading.Lock()
+
+
+class Phase:
+    """Context manager recording the wall time spent in a named phase."""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0
+
+    def __enter__(self) -> 'Phase':
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        end = time.perf_counter_ns()
+        with lock:
+            events.append({'name': self.name, 'start': self.start, 'end': end, 'thread': threading.get_ident()})
+
+
+def phase(name: str) -> ContextManager:
+    """Return a context manager timing the phase `name`, or one doing nothing if instrumentation is disabled."""
+    return Phase(name) if ENABLED else NULL_PHASE
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Decorate a function so every call to it is timed as the phase `name`."""
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with Phase(name):
+                return function(*args, **kwargs)
+        return wrapper  # type: ignore
+    return decorator
+
+
+def count(counter: str, amount: int = 1) -> None:
+    """Add `amount` to `counter`."""
+    if ENABLED:
+        with lock:
+            counters[counter] = counters.get(counter, 0) + amount
+
+
+def get_summary() -> str:
+    """Return the total time and number of calls of every phase, slowest first, and the value of every counter."""
+    totals: Dict[str, List[int]] = {}
+    for event in events:
+        total = totals.setdefault(event['name'], [0, 0])
+        total[0] += event['end'] - event['start']
+        total[1] += 1
+    width = max([len(name) for name in totals] + [len('Phase')])
+    lines = [f'{"Phase":<{width}}  {"Calls":>7}  {"Total ms":>10}']
+    for name, (nanoseconds, calls) in sorted(totals.items(), key=lambda item: -item[1][0]):
+        lines.append(f'{name:<{width}}  {calls:>7}  {nanoseconds / 1e6:>10.2f}')
+    lines.append('')
+    lines.extend(f'{counter}: {value}' for counter, value in sorted(counters.items()))
+    return '\n'.join(lines)
+
+
+def write_trace(path: str) -> None:
+    """Write the recorded phases and the final counter values to `path`, in the Chrome trace event format."""
+    pid = os.getpid()
+    origin = min((event['start'] for event in events), default=0)
+    trace_events = [{'name': event['name'], 'ph': 'X', 'pid': pid, 'tid': event['thread'],
+                     'ts': (event['start'] - origin) / 1e3, 'dur': (event['end'] - event['start']) / 1e3}
+                    for event in events]
+    end = max((event['end'] for event in events), default=origin)
+    trace_events.extend({'name': counter, 'ph': 'C', 'pid': pid, 'ts': (end - origin) / 1e3, 'args': {'value': value}}
+                        for counter, value in sorted(counters.items()))
+    with open(path, 'w') as file_handler:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, file_handler)
+
+
+def report(print_timings: bool, trace_path: Optional[str]) -> None:
+    """Print the summary to standard error if `print_timings`, and write the trace file if `trace_path` is given."""
+    if print_timings:
+        print(get_summary(), file=sys.stderr)
+    if trace_path:
+        write_trace(trace_path)
@@ -0,0 +1,295 @@
+import hashlib
+import os
+import struct
+import zlib
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import chunk_funcs
+import history_funcs
+import metadata_funcs
+import object_funcs
+import refs_funcs
+import trace_funcs
+
+
+BUNDLE_SIGNATURE = b'WITS'
+BUNDLE_VERSION = 1
+HEADER = struct.Struct('>4sI')
+# Kind, id of the object or image, and length of the compressed contents that follow.
+ENTRY = struct.Struct('>B20sI')
+OBJECT = 0
+CHUNK_LIST = 1
+COMMIT = 2
+# The id of the last entry is the digest of everything before it.
+END = 3
+LOCK_NAME = 'references.lock'
+
+
+class TransferResult(NamedTuple):
+    """What a push, pull or clone sent, and the branches it moved."""
+    commits: int
+    objects: int
+    size: int
+    updated: List[str]
+
+
+def get_remote_wit_dir(path: str) -> str:
+    """Return path to the '.wit' directory of the repository in `path`, which must be its root."""
+    wit_dir = os.path.join(os.path.abspath(path), '.wit')
+    if not os.path.isdir(wit_dir):
+        raise FileNotFoundError(f"'.wit' directory not found in `{path}`.")
+    return wit_dir
+
+
+def is_fast_forward(wit_dir: str, old_id: Optional[str], new_id: str) -> bool:
+    """Return whether moving a branch of `wit_dir` from `old_id` to `new_id` keeps every image it led to."""
+    if old_id is None or old_id == new_id:
+        return True
+    if not metadata_funcs.commit_exists(old_id, wit_dir):
+        return False
+    graph_file, (old_position, new_position) = history_funcs.open_commit_graph(wit_dir, old_id, new_id)
+    try:
+        return history_funcs.is_ancestor(graph_file, old_position, new_position)
+    finally:
+        graph_file.close()
+
+
+@trace_funcs.traced('negotiate')
+def find_missing_commits(source_dir: str, target_dir: str, want_ids: Iterable[str]) -> List[str]:
+    """Return the images reachable from `want_ids` in `source_dir` that `target_dir` doesn't have, parents first.
+    The branch tips of the target are the haves it starts with; the walk asks the target about every other
+    commit it reaches, and stops at those it has, since a repository holds all the ancestors of its images."""
+    haves = set(refs_funcs.get_refs(target_dir).branches.values())
+    graph_file = history_funcs.open_graph_file(source_dir)
+    try:
+        missing: Set[int] = set()
+        seen: Set[int] = set()
+        stack = []
+        for commit_id in want_ids:
+            position = graph_file.find(commit_id)
+            if position is None:
+                raise ValueError(f'Unknown commit id: {commit_id}')
+            stack.append(position)
+        while stack:
+            position = stack.pop()
+            if position in seen:
+                continue
+            seen.add(position)
+            record = graph_file.get(position)
+            if record.id in haves or metadata_funcs.commit_exists(record.id, target_dir):
+                continue
+            missing.add(position)
+            stack.extend(record.parents)
+        # Parents precede their children in the commit graph.
+        return [graph_file.get(position).id for position in sorted(missing)]
+    finally:
+        graph_file.close()
+
+
+def iter_blob(object_id: str, source_dir: str, target_dir: str, sent: Set[str]) -> Iterator[Tuple[int, str, bytes]]:
+    """Yield the kind, id and contents of `object_id` unless the target has it, preceded by its chunks
+    if it is stored in chunks."""
+    if object_id == object_funcs.EMPTY_DIR or object_id in sent or object_funcs.has_object(object_id, target_dir):
+        return
+    sent.add(object_id)
+    chunks = chunk_funcs.read_chunks(object_id, source_dir)
+    if chunks is None:
+        yield OBJECT, object_id, object_funcs.read_object(object_id, source_dir)
+        return
+    for chunk in chunks:
+        yield from iter_blob(chunk.id, source_dir, target_dir, sent)
+    yield CHUNK_LIST, object_id, chunk_funcs.format_chunk_list(chunks)
+
+
+def iter_tree_objects(tree_id: str, source_dir: str, target_dir: str,
+                      sent: Set[str]) -> Iterator[Tuple[int, str, bytes]]:
+    """Yield the objects of the tree object `tree_id` that the target doesn't have, each tree after
+    everything it lists. A tree the target has is skipped whole, since objects are always stored after
+    those they refer to."""
+    if tree_id in sent or object_funcs.has_object(tree_id, target_dir):
+        return
+    sent.add(tree_id)
+    for entry in object_funcs.read_tree(tree_id, source_dir).values():
+        if entry.kind == object_funcs.TREE:
+            yield from iter_tree_objects(entry.object_id, source_dir, target_dir, sent)
+        else:
+            yield from iter_blob(entry.object_id, source_dir, target_dir, sent)
+    yield OBJECT, tree_id, object_funcs.read_object(tree_id, source_dir) if tree_id != object_funcs.EMPTY_TREE else b''
+
+
+def format_manifest(tree: Dict[str, str]) -> bytes:
+    """Return the contents of the flat manifest listing `tree`, as images stored before tree objects."""
+    return ''.join(f'{tree[rel_path]} {rel_path.replace(os.sep, "/")}\n' for rel_path in sorted(tree)).encode('utf-8')
+
+
+def format_commit(commit: metadata_funcs.Commit) -> bytes:
+    """Return the metadata of `commit` as sent in a bundle; the message comes last since it may span lines."""
+    fields = [' '.join(commit.parents), str(commit.date), commit.tree]
+    if commit.message is not None:
+        fields.append(commit.message)
+    return '\n'.join(fields).encode('utf-8')
+
+
+def parse_commit(commit_id: str, content: bytes) -> metadata_funcs.Commit:
+    """Return the image `commit_id` described by `content`, as written by `format_commit`."""
+    parents, date, tree, *message = content.decode('utf-8').split('\n', 3)
+    return metadata_funcs.Commit(commit_id, parents.split(), int(date), message[0] if message else None, tree)
+
+
+def iter_bundle_entries(commit_ids: List[str], source_dir: str, target_dir: str) -> Iterator[Tuple[int, str, bytes]]:
+    """Yield every object of the images `commit_ids` that the target doesn't have, then the images themselves.
+    Images from before tree objects are sent with a flat manifest, which they didn't always have."""
+    sent: Set[str] = set()
+    commits = []
+    for commit_id in commit_ids:
+        commit = metadata_funcs.get_commit(commit_id, source_dir)
+        if commit is None:
+            raise ValueError(f'Unknown commit id: {commit_id}')
+        tree_id = object_funcs.get_tree_id(commit_id, source_dir)
+        if tree_id is not None:
+            yield from iter_tree_objects(tree_id, source_dir, target_dir, sent)
+        else:
+            manifest = object_funcs.read_manifest(commit_id, source_dir)
+            for object_id in manifest.values():
+                yield from iter_blob(object_id, source_dir, target_dir, sent)
+            content = object_funcs.read_object(commit.tree, source_dir) if commit.tree else format_manifest(manifest)
+            tree_id = hashlib.sha1(content).hexdigest()
+            if tree_id not in sent and not object_funcs.has_object(tree_id, target_dir):
+                sent.add(tree_id)
+                yield OBJECT, tree_id, content
+            commit = commit._replace(tree=tree_id)
+        commits.append(commit)
+    for commit in commits:
+        yield COMMIT, commit.id, format_commit(commit)
+
+
+@trace_funcs.traced('write bundle')
+def write_bundle(file_handler: BinaryIO, entries: Iterable[Tuple[int, str, bytes]]) -> Tuple[int, int]:
+    """Stream `entries` into a bundle, compressing each as it comes, and end it with the digest of its contents.
+    Return the number of objects and the size of the bundle."""
+    digest = hashlib.sha1()
+    header = HEADER.pack(BUNDLE_SIGNATURE, BUNDLE_VERSION)
+    file_handler.write(header)
+    digest.update(header)
+    size = len(header)
+    objects = 0
+    for kind, object_id, content in entries:
+        compressed = zlib.compress(content)
+        entry = ENTRY.pack(kind, bytes.fromhex(object_id), len(compressed))
+        for data in (entry, compressed):
+            file_handler.write(data)
+            digest.update(data)
+        size += len(entry) + len(compressed)
+        objects += kind != COMMIT
+    file_handler.write(ENTRY.pack(END, digest.digest(), 0))
+    trace_funcs.count(trace_funcs.BYTES_WRITTEN, size + ENTRY.size)
+    return objects, size + ENTRY.size
+
+
+def read_exactly(file_handler: BinaryIO, size: int) -> bytes:
+    """Return the next `size` bytes of `file_handler`. Raise ValueError if it ends before."""
+    data = file_handler.read(size)
+    if len(data) != size:
+        raise ValueError('The bundle is truncated.')
+    return data
+
+
+@trace_funcs.traced('apply bundle')
+def apply_bundle(file_handler: BinaryIO, wit_dir: str) -> List[str]:
+    """Store the objects of the bundle read from `file_handler` in `wit_dir` as they are read, and record its
+    images once the whole bundle is verified. Return the ids of the images, parents first.
+    Raise ValueError if the bundle is damaged; objects stored by then are only reachable once sent again."""
+    digest = hashlib.sha1()
+    header = read_exactly(file_handler, HEADER.size)
+    signature, version = HEADER.unpack(header)
+    if signature != BUNDLE_SIGNATURE or version != BUNDLE_VERSION:
+        raise ValueError('Unsupported bundle.')
+    digest.update(header)
+    commits = []
+    while True:
+        entry = read_exactly(file_handler, ENTRY.size)
+        kind, object_digest, length = ENTRY.unpack(entry)
+        if kind == END:
+            if object_digest != digest.digest():
+                raise ValueError('The bundle is damaged.')
+            break
+        compressed = read_exactly(file_handler, length)
+        digest.update(entry)
+        digest.update(compressed)
+        trace_funcs.count(trace_funcs.BYTES_READ, len(entry) + length)
+        content = zlib.decompress(compressed)
+        object_id = object_digest.hex()
+        if kind == OBJECT:
+            if hashlib.sha1(content).digest() != object_digest:
+                raise ValueError(f'The bundle is damaged: object {object_id} doesn\'t match its id.')
+            if not object_funcs.has_object(object_id, wit_dir):
+                object_funcs.write_loose(object_id, content, wit_dir)
+        elif kind == CHUNK_LIST:
+            if not object_funcs.has_object(object_id, wit_dir):
+                object_funcs.write_loose(object_id, content, wit_dir, suffix='.chunks')
+        elif kind == COMMIT:
+            commits.append(parse_commit(object_id, content))
+        else:
+            raise ValueError(f'Unknown bundle entry: {kind}')
+    metadata_funcs.insert_commits(commits, wit_dir)
+    commit_ids = [commit.id for commit in commits]
+    history_funcs.append_commits(commit_ids, wit_dir)
+    return commit_ids
+
+
+def update_branches(wit_dir: str, updates: Dict[str, Tuple[Optional[str], str]]) -> None:
+    """Move every branch in `updates` from the image it was expected to point at to its new one, at once.
+    Raise ValueError if another process is updating the references, if a branch moved meanwhile,
+    or if a move isn't a fast-forward."""
+    lock_path = os.path.join(wit_dir, LOCK_NAME)
+    try:
+        lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise ValueError(f'The references in `{wit_dir}` are being updated. If not, remove {lock_path}') from None
+    try:
+        refs = refs_funcs.get_refs(wit_dir)
+        for name, (old_id, new_id) in updates.items():
+            if refs.get(name) != old_id:
+                raise ValueError(f'Branch \'{name}\' changed during the transfer. Try again.')
+            if not is_fast_forward(wit_dir, old_id, new_id):
+                raise ValueError(f'Branch \'{name}\' can\'t be updated: {new_id} doesn\'t descend from {old_id}.')
+        for name, (_, new_id) in updates.items():
+            refs.set(name, new_id)
+        refs.save()
+    finally:
+        os.close(lock)
+        os.remove(lock_path)
+
+
+def fetch(source_dir: str, target_dir: str, commit_ids: Iterable[str]) -> TransferResult:
+    """Send the images `commit_ids` of `source_dir`, with their ancestors and contents, to `target_dir`,
+    in a single bundle holding only what it lacks. No branch is moved."""
+    missing = find_missing_commits(source_dir, target_dir, commit_ids)
+    bundle_path = os.path.join(target_dir, f'incoming-{os.getpid()}.bundle')
+    try:
+        with open(bundle_path, 'wb') as file_handler:
+            objects, size = write_bundle(file_handler, iter_bundle_entries(missing, source_dir, target_dir))
+        with open(bundle_path, 'rb') as file_handler:
+            apply_bundle(file_handler, target_dir)
+    finally:
+        if os.path.exists(bundle_path):
+            os.remove(bundle_path)
+    return TransferResult(len(missing), objects, size, [])
+
+
+def transfer(source_dir: str, target_dir: str, branches: Dict[str, str]) -> TransferResult:
+    """Fetch the images `branches` point at in `source_dir` into `target_dir`, then fast-forward the branches
+    of the same names there. Raise ValueError, before sending anything, if a branch of the target has images
+    the source doesn't lead to."""
+    target_refs = refs_funcs.get_refs(target_dir)
+    expected = {name: target_refs.get(name) for name in branches}
+    for name, commit_id in branches.items():
+        if not is_fast_forward(source_dir, expected[name], commit_id):
+            raise ValueError(f'Branch \'{name}\' in `{os.path.dirname(target_dir)}` has images '
+                             f'`{os.path.dirname(source_dir)}` doesn\'t lead to. Merge them first.')
+    result = fetch(source_dir, target_dir, branches.values())
+    updates = {name: (expected[name], commit_id) for name, commit_id in branches.items()
+               if expected[name] != commit_id}
+    if updates:
+        update_branches(target_dir, updates)
+    return result._replace(updated=sorted(updates))
@@ -1,6 +1,29 @@
+import errno
 import os
 import shutil
-from typing import Dict, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+import ignore_funcs
+import metadata_funcs
+import refs_funcs
+import trace_funcs
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+DEFAULT_JOBS = min(8, os.cpu_count() or 1)
+JOBS = DEFAULT_JOBS
+VERBOSE = False
+LINK_OBJECTS = False
+FICLONE = 0x40049409
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF}
 
 
 def print_help() -> None:
@@ -9,14 +32,34 @@ def print_help() -> None:
                '\nFunctions: Description, [Parameters]'
                '\n----------------------------------'
                '\ninit: Create a directory for image storage'
-               '\nadd: Add a file or directory to be backed to staging area, <path>'
+               '\nadd: Add a file or directory to be backed to staging area, leaving out paths matched by .witignore files, <path>'
                '\ncommit: Create an image of files in staging area, [message]'
                '\nstatus: Print commitment status of files'
                '\ncheckout: Rollback to a previous image, <commit_id | branch_name>'
                '\nrm: Remove file from directory and staging_area, <original_path>'
-               '\ngraph: Draw a graph of commit inheritance, [--all]'
+               '\ngraph: Draw a graph of commit inheritance, as text or to a file, --all for every branch, [--all] [--text | --unicode] [--output <file.svg | file.png | file.dot>]'
+               '\ndiff: Print the paths changed between two images, or from an image, the current one by default,'
+               ' to the working tree, [<commit_id | branch_name> [<commit_id | branch_name>]]'
+               '\nlog: Print the history of the current image or of a branch or commit, newest first,'
+               ' [<branch_name | commit_id>] [-n <number>] [--since <date>] [--until <date>] [--grep <pattern>] [-- <path>...]'
                '\nbranch: Label the current commit id as <name> and define it as the acctivated branch, <name>'
-               '\nmerge: Merge changes made in `branch_name` and in the current image into a new image, <branch_name>')
+               '\nmerge: Merge changes made in `branch_name` and in the current image into a new image, <branch_name>'
+               '\ngc: Consolidate all stored objects into a single compressed pack file'
+               '\nprune: Delete images no branch leads to, and the objects only they use, keeping those a reference'
+               ' pointed at in the last N days, default 30, [--expire N]'
+               '\npush: Send a branch, the active one by default, and the images and objects it needs to another'
+               ' repository, moving its branch forward, <path> [<branch_name>]'
+               '\npull: Fetch a branch, the active one by default, and the images and objects it needs from another'
+               ' repository, moving the branch here forward, <path> [<branch_name>]'
+               '\nclone: Copy a repository to a new one and check out its active branch, <source_path> <path>'
+               '\ndaemon: Start or stop a background process watching the working tree, to answer status without scanning it,'
+               ' or run it in the foreground until stopped, <start | stop | run>'
+               '\n\nOptions:'
+               f'\n--jobs N: Number of files hashed, copied and written at once, default {DEFAULT_JOBS}'
+               '\n--link: Hardlink stored objects into the staging area instead of copying them'
+               '\n--verbose: Print the strategies used for copying files'
+               '\n--timings: Print the time spent in each phase and counts of files and bytes read and written'
+               '\n--trace FILE: Write the phases and counters to FILE in the Chrome trace event format')
     print(message)
 
 
@@ -34,7 +77,7 @@ def get_wit_dir_parent(path: Optional[str] = None) -> str:
     wit_dir_parent = None
     temp = path
     while not wit_dir_parent and not os.path.ismount(temp):
-        if os.path.isdir(temp) and '.wit' in os.listdir(temp):
+        if os.path.isdir(os.path.join(temp, '.wit')):
             return temp
         temp = os.path.dirname(temp)
 
@@ -65,79 +108,165 @@ def get_new_path(abs_path: str,
     return new_path
 
 
-def copy_files(mode: str, path: str, commit_id: Optional[str] = None) -> None:
-    """Copy files from `path` to the necessary location based on `mode`:
-    if 'a', copy to staging_area
-    if 'c', copy to images\`commit_id`"""
-
-    if mode == 'a':
+@trace_funcs.traced('copy to staging area')
+def copy_to_staging_area(path: str, wit_dir_parent: str) -> None:
+    """Replace the copy in the staging area of the file or directory in the absolute path `path`.
+    Ignored paths under a directory are not copied."""
+    new_path = get_new_path(path, wit_dir_parent, additions=['staging_area'])
+    if os.path.exists(new_path):
         try:
-            path = get_abs_path(path)
-            wit_dir_parent = get_wit_dir_parent(path)
-        except FileNotFoundError as err:
-            print(err)
-            return
-        new_path = get_new_path(path, wit_dir_parent, additions=['staging_area'])
-        if os.path.exists(new_path):
-            try:
-                os.remove(new_path)
-            except PermissionError:
-                shutil.rmtree(new_path)
+            os.remove(new_path)
+        except (PermissionError, IsADirectoryError):
+            shutil.rmtree(new_path)
+
+    if os.path.isdir(path):
+        copy_tree(path, new_path, ignore_funcs.get_matcher(wit_dir_parent, os.path.relpath(path, wit_dir_parent)))
+    else:
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        copy_file(path, new_path)
+        shutil.copystat(path, new_path)
+
+
+def copy_tree(path: str, new_path: str, matcher: Optional[ignore_funcs.Matcher] = None) -> None:
+    """Copy the directory tree in `path` to `new_path`, leaving out the paths ignored by `matcher`.
+    Directories are created in order first, then files are copied by up to `JOBS` threads."""
+    files = []
+    matchers = {path: matcher}
+    for directory, sub_directories, file_names in os.walk(path):
+        sub_directories[:] = [name for name in sub_directories if name != '.wit']
+        directory_matcher = matchers.pop(directory, None)
+        if directory_matcher is not None:
+            rel_directory = os.path.relpath(directory, path)
+            prefix = '' if rel_directory == os.curdir else rel_directory + os.sep
+            directory_matcher = directory_matcher.load(directory, prefix)
+            sub_directories[:] = [name for name in sub_directories if not directory_matcher.is_ignored(prefix + name, True)]
+            file_names = [name for name in file_names if not directory_matcher.is_ignored(prefix + name, False)]
+            matchers.update((os.path.join(directory, name), directory_matcher) for name in sub_directories)
+        new_directory = os.path.join(new_path, os.path.relpath(directory, path))
+        os.makedirs(new_directory, exist_ok=True)
+        files.extend((os.path.join(directory, name), os.path.join(new_directory, name)) for name in file_names)
+    run_jobs(lambda paths: (copy_file(*paths), shutil.copystat(*paths)), files)
+
+
+def reflink(source: BinaryIO, destination: BinaryIO, size: int) -> None:
+    """Clone the extents of `source` into `destination` on copy-on-write filesystems."""
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'Reflinks are not supported on this platform')
+    fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+
+
+def copy_range(source: BinaryIO, destination: BinaryIO, size: int) -> None:
+    """Copy `source` into `destination` inside the kernel with `os.copy_file_range`."""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, '`copy_file_range` is not supported on this platform')
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(source.fileno(), destination.fileno(), size - copied)
+        if count == 0:
+            break
+        copied += count
+    shutil.copyfileobj(source, destination)
+
 
-    elif mode == 'c':
-        if commit_id is None:
-            print('Missing argument: `commit_id`')
+def send_file(source: BinaryIO, destination: BinaryIO, size: int) -> None:
+    """Copy `source` into `destination` inside the kernel with `os.sendfile`."""
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, '`sendfile` is not supported on this platform')
+    copied = 0
+    while copied < size:
+        count = os.sendfile(destination.fileno(), source.fileno(), copied, size - copied)
+        if count == 0:
+            break
+        copied += count
+    source.seek(copied)
+    shutil.copyfileobj(source, destination)
+
+
+def buffered_copy(source: BinaryIO, destination: BinaryIO, size: int) -> None:
+    """Copy `source` into `destination` through Python buffers."""
+    shutil.copyfileobj(source, destination)
+
+
+COPY_STRATEGIES: Dict[str, Callable[[BinaryIO, BinaryIO, int], None]] = {
+    'reflink': reflink,
+    'copy_file_range': copy_range,
+    'sendfile': send_file,
+    'buffered copy': buffered_copy,
+}
+available_strategies = list(COPY_STRATEGIES)
+used_strategies = set()
+# Files are copied by several threads at once, which all update the strategies.
+strategies_lock = threading.Lock()
+
+
+def report_strategy(strategy: str) -> None:
+    """Print `strategy` the first time it is used, if running verbosely."""
+    with strategies_lock:
+        if strategy in used_strategies:
             return
+        used_strategies.add(strategy)
+    if VERBOSE:
+        print(f'Copying files with {strategy}.')
+
+
+def copy_file(path: str, new_path: str, link: bool = False) -> None:
+    """Copy the contents of `path` to `new_path` with the fastest strategy the filesystem supports.
+    if `link`, and `LINK_OBJECTS` is set, hardlink `path` instead; only do so for files never modified in place."""
+    if link and LINK_OBJECTS:
         try:
-            wit_dir_parent = get_wit_dir_parent()
-        except FileNotFoundError as err:
-            print(err)
+            os.link(path, new_path)
+        except OSError as err:
+            if err.errno not in UNSUPPORTED_ERRNOS | {errno.EPERM, errno.EMLINK}:
+                raise
+        else:
+            report_strategy('hardlink')
             return
-        new_path = get_new_path(path, wit_dir_parent, additions=['images', commit_id], commit=True)
 
-    else:
-        print('Invalid mode.\nAccepted modes:\n\'a\': add\n\'c\': commit')
-        return
+    with open(path, 'rb') as source, open(new_path, 'wb') as destination:
+        size = os.fstat(source.fileno()).st_size
+        trace_funcs.count(trace_funcs.FILES_READ)
+        trace_funcs.count(trace_funcs.BYTES_READ, size)
+        trace_funcs.count(trace_funcs.BYTES_WRITTEN, size)
+        with strategies_lock:
+            strategies = list(available_strategies)
+        for strategy in strategies:
+            try:
+                COPY_STRATEGIES[strategy](source, destination, size)
+            except OSError as err:
+                if err.errno not in UNSUPPORTED_ERRNOS or strategy == 'buffered copy':
+                    raise
+                with strategies_lock:
+                    if strategy in available_strategies:
+                        available_strategies.remove(strategy)
+                source.seek(0)
+                destination.seek(0)
+                destination.truncate()
+            else:
+                report_strategy(strategy)
+                return
 
-    try:
-        shutil.copytree(path, new_path)
-    except NotADirectoryError:
-        try:
-            shutil.copy2(path, new_path)
-        except FileNotFoundError:
-            split_path = new_path.split(os.sep)
-            for index, _ in enumerate(split_path):
-                if index > 0:
-                    temp_path = os.sep.join(split_path[:index])
-                    if not os.path.exists(temp_path):
-                        os.mkdir(temp_path)
-            shutil.copy2(path, new_path)
-
-
-def get_parent_id(wit_dir: Optional[str] = None, commit_id: Optional[str] = None) -> Dict[str, str]:
-    """return parent id from reference or metadata file."""
-    if wit_dir is None:
-            wit_dir = get_wit_dir()
-    if commit_id:
-        path = os.path.join(wit_dir, 'images', f'{commit_id}.txt')
-    else:
-        path = os.path.join(wit_dir, 'references.txt')
-    try:
-        with open(path, 'r') as file_handler:
-            return {line.split('=')[0]: line.split('=')[1].rstrip() for line in file_handler.readlines()}
-    except FileNotFoundError:
-        return {}
+
+def run_jobs(function: Callable[[T], R], items: Iterable[T]) -> List[R]:
+    """Return the results of calling `function` on every item of `items`, in order, using up to `JOBS` threads.
+    All calls are completed before the error of the first failing item, if any, is raised."""
+    items = list(items)
+    if JOBS <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=JOBS) as executor:
+        futures = [executor.submit(function, item) for item in items]
+    return [future.result() for future in futures]
 
 
-def get_original_name(path: str) -> str:
-    """Return path to backed file in the 'real' directory."""
-    temp = path.split(os.sep)
-    for word in ('.wit', 'staging_area', 'images'):
-        if word in temp:
-            if word == 'images' and len(temp) > temp.index(word) + 1:
-                temp.pop(temp.index(word) + 1)
-            temp.remove(word)
-    return os.sep.join(temp)
+def remove_empty_tree(path: str) -> None:
+    """Remove the directory in `path` and the directories under it, deepest first.
+    Raise OSError if any of them still holds a file: files are never deleted along with a directory."""
+    for directory, sub_directories, _ in os.walk(path, topdown=False):
+        for name in sub_directories:
+            sub_directory = os.path.join(directory, name)
+            if os.path.islink(sub_directory):
+                raise OSError(errno.ENOTEMPTY, os.strerror(errno.ENOTEMPTY), directory)
+            os.rmdir(sub_directory)
+    os.rmdir(path)
 
 
 def update_activated(branch_name: str, wit_dir: Optional[str] = None) -> None:
@@ -145,6 +274,7 @@ def update_activated(branch_name: str, wit_dir: Optional[str] = None) -> None:
     if wit_dir is None:
         wit_dir = get_wit_dir()
     activated = os.path.join(wit_dir, 'activated.txt')
+    trace_funcs.count(trace_funcs.METADATA_OPENED)
     with open(activated, 'w') as file_handler:
         file_handler.write(branch_name)
 
@@ -153,16 +283,12 @@ def get_branch_id(branch_name: str, wit_dir: Optional[str] = None) -> str:
     """Return commit id attached to `branch_name`."""
     if wit_dir is None:
         wit_dir = get_wit_dir()
-    if branch_name in os.listdir(os.path.join(wit_dir, 'images')):
+    if metadata_funcs.commit_exists(branch_name, wit_dir):
         return branch_name
-    reference = os.path.join(wit_dir, 'references.txt')
-    with open(reference, 'r') as file_handler:
-        branches = {line.split('=')[0]: line.rstrip().split('=')[1]
-                    for line in file_handler.readlines()}
-    if branch_name in branches:
-        return branches[branch_name]
-    else:
+    branch_id = refs_funcs.get_refs(wit_dir).get(branch_name) or metadata_funcs.resolve_commit_id(branch_name, wit_dir)
+    if branch_id is None:
         raise ValueError('Branch not found.')
+    return branch_id
 
 
 def get_active_branch(wit_dir: Optional[str]) -> str:
@@ -170,5 +296,6 @@ def get_active_branch(wit_dir: Optional[str]) -> str:
     if wit_dir is None:
         wit_dir = get_wit_dir()
     activated = os.path.join(wit_dir, 'activated.txt')
+    trace_funcs.count(trace_funcs.METADATA_OPENED)
     with open(activated, 'r') as file_handler:
         return file_handler.read()
\ No newline at end of file
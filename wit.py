@@ -1,88 +1,67 @@
+import itertools
 import os
-import shutil
 import sys
-from typing import List, Optional, Tuple
-
-import commit_funcs
-import graph_funcs
-import merge_funcs
-import status_funcs
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import daemon_funcs
+import layout_funcs
+import log_funcs
+import prune_funcs
+import repository_funcs
+import trace_funcs
+import transfer_funcs
 import utilities
 
 
-FUNCS = ('help', 'init', 'add', 'commit',
-         'status', 'checkout', 'rm',
-         'graph', 'branch', 'merge')
+GRAPH_EXTENSIONS = ('.svg', '.png', '.dot')
 
 
 def init(path: str) -> None:
     """Create a `.wit` directory for storing the program's images."""
-    wit_dir = os.path.join(path, '.wit')
-    images_dir = os.path.join(wit_dir, 'images')
-    staging_area_dir = os.path.join(wit_dir, 'staging_area')
     try:
-        for directory in [wit_dir, images_dir, staging_area_dir]:
-            os.mkdir(directory)
+        repository_funcs.Repository.init(path)
     except FileExistsError as err:
         print('An error has occurred:\n{}'.format(err))
     else:
-        utilities.update_activated('master')
         print('Wit initialized.')
 
 
 def add(path: str) -> None:
     """Add a file or directory to be backed to staging area."""
-    utilities.copy_files(mode='a', path=path)
+    try:
+        repository_funcs.Repository().add(path)
+    except (FileNotFoundError, ValueError) as err:
+        print(err)
+        return
     print(f'\'{path}\' added to staging area.')
 
 
 def commit(*message: str, merged_branch_id: Optional[str] = None) -> None:
     """Create an image of files in staging area."""
     try:
-        wit_dir = utilities.get_wit_dir()
+        commit_id = repository_funcs.Repository().commit(*message, merged_branch_id=merged_branch_id)
     except FileNotFoundError as err:
         print(err)
         return
-
-    staging_area = os.path.join(wit_dir, 'staging_area')
-    changes, _, _, removed = status(no_print=True)
-    if not changes and not removed:
+    if commit_id is None:
         print('No changes since last commit')
-        return
-    commit_id = commit_funcs.generate_commit_id()
-    utilities.copy_files(mode='c', path=staging_area, commit_id=commit_id)
-    commit_funcs.create_metadata_file(commit_id, *message, merged_branch_id=merged_branch_id, wit_dir=wit_dir)
-    try:
-        commit_funcs.update_references(commit_id, wit_dir)
-    except KeyError:
-        commit_funcs.create_references_file(commit_id, wit_dir)
-    print(f'Image {commit_id} created.')
+    else:
+        print(f'Image {commit_id} created.')
 
 
 def status(no_print: bool = False) -> Tuple[List[str], List[str], List[str], List[str]]:
     """Print commitment status of files."""
-    parent_dir = utilities.get_wit_dir_parent()
-    wit_dir = os.path.join(parent_dir, '.wit')
-    staging_area = os.path.join(wit_dir, 'staging_area')
-    try:
-        head_id = utilities.get_parent_id(wit_dir)['HEAD']
-    except KeyError:
-        head_id = ''
-        changes = [os.path.join(parent_dir, path) for path in os.listdir(staging_area)]
-        removed = []
-    else:
-        last_image = os.path.join(wit_dir, 'images', head_id)
-        changes = list(status_funcs.get_nonexistent_files(staging_area, last_image))
-        changes.extend(list(status_funcs.get_changed_files(staging_area, last_image)))
-        removed = list(status_funcs.get_nonexistent_files(last_image, parent_dir))
-    unstaged = list(status_funcs.get_changed_files(parent_dir, staging_area))
-    untracked = list(status_funcs.get_nonexistent_files(parent_dir, staging_area))
+    repository = repository_funcs.Repository()
+    current_status = repository.status()
+    head_id = current_status.head_id
+    changes, unstaged, untracked, removed = (current_status.changes, current_status.unstaged,
+                                             current_status.untracked, current_status.removed)
 
     if not no_print:
         printable = ''
         if head_id:
             printable += f'Current commit id: {head_id}'
-            active_branch = utilities.get_active_branch(wit_dir)
+            active_branch = repository.active_branch
             if active_branch:
                 printable += f'\nActive branch: {active_branch}'
         else:
@@ -99,177 +78,385 @@ def status(no_print: bool = False) -> Tuple[List[str], List[str], List[str], Lis
 def checkout(commit_id: str) -> None:
     """Rollback to a previous image."""
     try:
-        wit_dir_parent = utilities.get_wit_dir_parent()
-    except FileNotFoundError as err:
+        commit_id = repository_funcs.Repository().checkout(commit_id)
+    except (FileNotFoundError, ValueError) as err:
         print(err)
         return
+    print(f'Reverted to {commit_id}')
 
-    wit_dir = os.path.join(wit_dir_parent, '.wit')
-    branches = utilities.get_parent_id(wit_dir)
-    if commit_id not in branches and commit_id not in os.listdir(os.path.join(wit_dir, 'images')):
-        print('Invalid commit id. Unable to perform checkout.')
+
+def rm(original_path: str) -> None:
+    """Remove file from directory and staging_area."""
+    try:
+        repository_funcs.Repository().rm(original_path)
+    except (FileNotFoundError, ValueError) as err:
+        print(err)
         return
+    print(f'\'{original_path}\' removed.')
+
 
-    changes, unstaged, _, _ = status(no_print=True)
-    if changes or unstaged:
-        print('Unable to perform checkout. There are changes not yet committed.')
+def graph(all_commits: bool = False, text: bool = False, unicode: bool = False, output: Optional[str] = None) -> None:
+    """Draw a graph of commit inheritance, as text, or to an svg, png or dot file."""
+    try:
+        wit_dir = repository_funcs.Repository().wit_dir
+    except FileNotFoundError as err:
+        print(err)
         return
 
-    if commit_id in branches:
-        branch_name = commit_id
-        commit_id = branches[commit_id]
-    elif commit_id in branches.values():
-        for key, value in branches.items():
-            if value == commit_id:
-                branch_name = key
+    extension = os.path.splitext(output)[1].lower() if output else ''
+    if output is not None and extension not in GRAPH_EXTENSIONS:
+        print(f'Unsupported output format: `{output}`. Use one of: {", ".join(GRAPH_EXTENSIONS)}')
+        return
+    commit_graph, positions = layout_funcs.get_positions(wit_dir, all_commits=all_commits)
+    if extension == '.dot':
+        with open(output, 'w') as file_handler:
+            for line in layout_funcs.iter_dot(commit_graph, positions, wit_dir):
+                file_handler.write(f'{line}\n')
+    elif text or unicode:
+        print_lines(layout_funcs.iter_text_graph(commit_graph, positions, wit_dir, unicode=unicode))
     else:
-        branch_name = ''
-    utilities.update_activated(branch_name, wit_dir)
-    for file in status_funcs.get_all_files(os.path.join(wit_dir, 'images', commit_id)):
-        og_path = utilities.get_original_name(file)
-        staging_area = utilities.get_new_path(og_path, wit_dir_parent, additions=['staging_area'])
-
-        for path in (og_path, staging_area):
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except PermissionError:
-                    shutil.rmtree(path)
-            try:
-                shutil.copy2(file, path)
-            except PermissionError:
-                shutil.copytree(file, path)
-
-    commit_funcs.update_references(commit_id, wit_dir, checkout=True)
-    print(f'Reverted to {commit_id}')
+        # Imported here so that only drawn graphs pay for loading the plotting libraries.
+        import graph_funcs
+        graph_funcs.draw_graph(commit_graph, positions, wit_dir, output=output)
 
 
-def rm(original_path: str) -> None:
-    """Remove file from directory and staging_area."""
+def diff(old: Optional[str] = None, new: Optional[str] = None) -> None:
+    """Print the paths that differ between two images, or between an image and the working tree, as they are found."""
     try:
-        path = utilities.get_abs_path(original_path)
-        parent_dir = utilities.get_wit_dir_parent()
-    except FileNotFoundError as err:
+        entries = repository_funcs.Repository().diff(old, new)
+        print_lines(f'{entry.change}\t{entry.rel_path}' for entry in entries)
+    except (FileNotFoundError, ValueError) as err:
+        print(err)
+
+
+def log(start: Optional[str] = None, limit: Optional[int] = None, since: Optional[int] = None,
+        until: Optional[int] = None, grep: Optional[str] = None, paths: Tuple[str, ...] = ()) -> None:
+    """Print the history of the current image, or of `start`, newest first, as it is walked."""
+    try:
+        repository = repository_funcs.Repository()
+        commits = repository.log(start, since=since, until=until, grep=grep,
+                                 paths=[os.path.relpath(os.path.abspath(path), repository.root) for path in paths])
+        names = layout_funcs.get_branch_names(repository.wit_dir)
+        print_lines(log_funcs.format_commit(commit, names.get(commit.id, []))
+                    for commit in itertools.islice(commits, limit))
+    except (FileNotFoundError, ValueError) as err:
+        print(err)
+
+
+def print_lines(lines: Iterable[str]) -> None:
+    """Print each of `lines` as soon as it is produced."""
+    try:
+        for line in lines:
+            print(line)
+    except BrokenPipeError:
+        # The reader stopped early, like `head` does; don't fail when stdout is flushed at exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def branch(branch_name: str) -> None:
+    """Label the current commit id as `branch_name`, and define it as the acctivated branch."""
+    try:
+        repository_funcs.Repository().branch(branch_name)
+    except (FileNotFoundError, ValueError) as err:
         print(err)
         return
+    print(f'Branch \'{branch_name}\' created.')
 
-    if '.wit' in path:
-        print('Invalid path. Use path to original file.')
 
-    new_path = utilities.get_new_path(path, parent_dir, additions=['staging_area'])
-    for file in (path, new_path):
-        if os.path.exists(file):
-            try:
-                os.remove(file)
-            except PermissionError:
-                shutil.rmtree(file)
-    print(f'\'{original_path}\' removed.')
+def merge(branch_name: str) -> None:
+    """Merge changes made in `branch_name` and in the current image into a new image."""
+    try:
+        repository = repository_funcs.Repository()
+        commit_id = repository.merge(branch_name)
+    except (FileNotFoundError, ValueError) as err:
+        print(err)
+        return
+    if commit_id is None:
+        print('No changes since last commit')
+    else:
+        print(f'Image {commit_id} created.')
+    print(f'Branches \'{repository.active_branch}\' & \'{branch_name}\' merged.')
 
 
-def graph(all_commits: bool = False) -> None:
-    """Draw a graph of commit inheritance."""
+def gc() -> None:
+    """Consolidate all stored objects into a single compressed pack file."""
     try:
-        wit_dir = utilities.get_wit_dir()
+        name, objects, deltas = repository_funcs.Repository().gc()
     except FileNotFoundError as err:
         print(err)
         return
-
-    graph_funcs.draw_graph(graph_funcs.get_adjacency(wit_dir, all_commits=all_commits), wit_dir)
+    print(f'Packed {objects} objects ({deltas} deltas) into {name}.')
 
 
-def branch(branch_name: str) -> None:
-    """Label the current commit id as `branch_name`, and define it as the acctivated branch."""
+def prune(expire_days: float) -> None:
+    """Delete images no branch leads to and that no reference pointed at in the last `expire_days` days."""
     try:
-        wit_dir = utilities.get_wit_dir()
+        commits, objects = repository_funcs.Repository().prune(expire_days)
     except FileNotFoundError as err:
         print(err)
         return
+    print(f'Pruned {commits} images and {objects} objects.')
 
-    branches = utilities.get_parent_id(wit_dir)
-    head_id = branches['HEAD']
-    reference = os.path.join(wit_dir, 'references.txt')
-    if branch_name not in branches:
-        with open(reference, 'a') as file_handler:
-            file_handler.write(f'\n{branch_name}={head_id}')
-        print(f'Branch \'{branch_name}\' created.')
-    else:
-        print(f'A branch named \'{branch_name}\' already exists.')
 
+def print_transfer(result: transfer_funcs.TransferResult) -> None:
+    """Print what a push, pull or clone sent and the branches it moved."""
+    print(f'Sent {result.commits} images and {result.objects} objects ({result.size} bytes).')
+    for name in result.updated:
+        print(f'Branch \'{name}\' updated.')
 
-def merge(branch_name: str) -> None:
-    """Merge changes made in `branch_name` and in the current image into a new image."""
+
+def push(path: str, branch_name: Optional[str]) -> None:
+    """Send `branch_name`, or the active branch, to the repository in `path`, with the images it lacks."""
+    try:
+        result = repository_funcs.Repository().push(path, branch_name)
+    except (FileNotFoundError, ValueError) as err:
+        print(err)
+        return
+    print_transfer(result)
+
+
+def pull(path: str, branch_name: Optional[str]) -> None:
+    """Fetch `branch_name`, or the active branch, from the repository in `path`, with the images missing here."""
+    try:
+        result = repository_funcs.Repository().pull(path, branch_name)
+    except (FileNotFoundError, ValueError) as err:
+        print(err)
+        return
+    print_transfer(result)
+
+
+def clone(source: str, path: str) -> None:
+    """Copy the repository in `source` to a new repository in `path`."""
+    try:
+        _, result = repository_funcs.Repository.clone(source, path)
+    except (FileNotFoundError, FileExistsError, ValueError) as err:
+        print(err)
+        return
+    print_transfer(result)
+    print(f'Cloned into `{path}`.')
+
+
+def daemon(action: str) -> None:
+    """Start or stop the status daemon, or run it in the foreground if `action` is 'run'."""
     try:
-        wit_dir_parent = utilities.get_wit_dir_parent()
+        wit_dir_parent = repository_funcs.Repository().root
     except FileNotFoundError as err:
         print(err)
         return
+
     wit_dir = os.path.join(wit_dir_parent, '.wit')
+    running = daemon_funcs.is_running(wit_dir)
+    if action in ('start', 'run') and running:
+        print('The daemon is already running.')
+    elif action == 'run':
+        daemon_funcs.serve(wit_dir_parent)
+    elif action == 'start':
+        if daemon_funcs.start_daemon(wit_dir_parent):
+            print('Daemon started.')
+        else:
+            print(f'Unable to start the daemon. See {os.path.join(wit_dir, daemon_funcs.LOG_NAME)}')
+    elif running:
+        daemon_funcs.send_request(wit_dir, 'stop')
+        print('Daemon stopped.')
+    else:
+        print('The daemon is not running.')
+
+
+def run_init(args: List[str]) -> None:
+    if args:
+        utilities.print_help()
+    else:
+        init(os.getcwd())
+
+
+def run_add(args: List[str]) -> None:
     try:
-        merge_funcs.update_staging_area(
-            merge_funcs.get_shared_parent(branch_name, wit_dir),
-            branch_name, wit_dir_parent)
-    except ValueError as err:
+        add(args[0])
+    except IndexError:
+        print('Usage: python <wit.py> add <path>')
+
+
+def run_commit(args: List[str]) -> None:
+    try:
+        commit(*args)
+    except FileNotFoundError as err:
         print(err)
-    message = f'Merged branch: {branch_name}'
-    branch_id = utilities.get_branch_id(branch_name)
-    commit(message, merged_branch_id=branch_id)
-    active_branch = utilities.get_active_branch(wit_dir)
-    print(f'Branches \'{active_branch}\' & \'{branch_name}\' merged.')
-
-
-if len(sys.argv) == 1 or sys.argv[1] == 'help' or sys.argv[1] not in FUNCS or len(sys.argv) > 3 and sys.argv[1] != 'commit':
-    utilities.print_help()
-else:
-    if sys.argv[1] == 'init':
-        if len(sys.argv) == 3:
-            utilities.print_help()
-        else:
-            init(os.getcwd())
-    elif sys.argv[1] == 'add':
-        try:
-            add(sys.argv[2])
-        except IndexError:
-            print('Usage: python <wit.py> add <path>')
-    elif sys.argv[1] == 'commit':
+
+
+def run_status(args: List[str]) -> None:
+    if args:
+        utilities.print_help()
+    else:
         try:
-            commit(*sys.argv[2:])
-        except IndexError:
-            commit()
+            status()
         except FileNotFoundError as err:
             print(err)
-    elif sys.argv[1] == 'status':
-        if len(sys.argv) == 3:
-            utilities.print_help()
-        else:
-            try:
-                status()
-            except FileNotFoundError as err:
-                print(err)
-    elif sys.argv[1] == 'checkout':
-        try:
-            checkout(sys.argv[2])
-        except IndexError:
-            print('Usage: python <wit.py> checkout <commit_id | branch_name>')
-    elif sys.argv[1] == 'rm':
-        try:
-            rm(sys.argv[2])
-        except IndexError:
-            print('Usage: python <wit.py> rm <original_path>')
-    elif sys.argv[1] == 'graph':
-        try:
-            if sys.argv[2] == '--all':
-                graph(all_commits=True)
-            else:
-                print('Usage: python <wit.py> graph [--all]')
-        except IndexError:
-            graph()
-    elif sys.argv[1] == 'branch':
-        try:
-            branch(sys.argv[2])
-        except IndexError:
-            print('Usage: python <wit.py> branch <name>')
-    elif sys.argv[1] == 'merge':
-        try:
-            merge(sys.argv[2])
-        except IndexError:
-            print('Usage: python <wit.py> merge <branch_name>')
\ No newline at end of file
+
+
+def run_checkout(args: List[str]) -> None:
+    try:
+        checkout(args[0])
+    except IndexError:
+        print('Usage: python <wit.py> checkout <commit_id | branch_name>')
+
+
+def run_rm(args: List[str]) -> None:
+    try:
+        rm(args[0])
+    except IndexError:
+        print('Usage: python <wit.py> rm <original_path>')
+
+
+def run_graph(args: List[str]) -> None:
+    output = pop_option(args, '--output')
+    flags = {'--all', '--text', '--unicode'}
+    if any(arg not in flags for arg in args):
+        print('Usage: python <wit.py> graph [--all] [--text | --unicode] [--output <file.svg | file.png | file.dot>]')
+    else:
+        graph(all_commits='--all' in args, text='--text' in args, unicode='--unicode' in args, output=output)
+
+
+def run_diff(args: List[str]) -> None:
+    if len(args) > 2:
+        print('Usage: python <wit.py> diff [<commit_id | branch_name> [<commit_id | branch_name>]]')
+    else:
+        diff(*args)
+
+
+def run_log(args: List[str]) -> None:
+    usage = ('Usage: python <wit.py> log [<branch_name | commit_id>] [-n <number>] [--since <date>] [--until <date>]'
+             ' [--grep <pattern>] [-- <path>...]')
+    paths: Tuple[str, ...] = ()
+    if '--' in args:
+        separator = args.index('--')
+        args, paths = args[:separator], tuple(args[separator + 1:])
+    limit = pop_option(args, '-n')
+    since, until = pop_option(args, '--since'), pop_option(args, '--until')
+    grep = pop_option(args, '--grep')
+    if len(args) > 1 or any(arg.startswith('-') for arg in args) or limit is not None and not limit.isdigit():
+        print(usage)
+        return
+    try:
+        since_date = log_funcs.parse_date(since) if since is not None else None
+        until_date = log_funcs.parse_date(until) if until is not None else None
+    except ValueError as err:
+        print(err)
+        return
+    log(args[0] if args else None, limit=int(limit) if limit is not None else None,
+        since=since_date, until=until_date, grep=grep, paths=paths)
+
+
+def run_branch(args: List[str]) -> None:
+    try:
+        branch(args[0])
+    except IndexError:
+        print('Usage: python <wit.py> branch <name>')
+
+
+def run_merge(args: List[str]) -> None:
+    try:
+        merge(args[0])
+    except IndexError:
+        print('Usage: python <wit.py> merge <branch_name>')
+
+
+def run_gc(args: List[str]) -> None:
+    if args:
+        utilities.print_help()
+    else:
+        gc()
+
+
+def run_prune(args: List[str]) -> None:
+    expire = pop_option(args, '--expire')
+    try:
+        expire_days = float(expire) if expire is not None else prune_funcs.DEFAULT_EXPIRE_DAYS
+    except ValueError:
+        expire_days = -1
+    if args or expire_days < 0:
+        print('Usage: python <wit.py> prune [--expire <days>]')
+    else:
+        prune(expire_days)
+
+
+def run_push(args: List[str]) -> None:
+    if len(args) in (1, 2):
+        push(args[0], args[1] if len(args) > 1 else None)
+    else:
+        print('Usage: python <wit.py> push <path> [<branch_name>]')
+
+
+def run_pull(args: List[str]) -> None:
+    if len(args) in (1, 2):
+        pull(args[0], args[1] if len(args) > 1 else None)
+    else:
+        print('Usage: python <wit.py> pull <path> [<branch_name>]')
+
+
+def run_clone(args: List[str]) -> None:
+    if len(args) == 2:
+        clone(args[0], args[1])
+    else:
+        print('Usage: python <wit.py> clone <source_path> <path>')
+
+
+def run_daemon(args: List[str]) -> None:
+    if args and args[0] in ('start', 'stop', 'run'):
+        daemon(args[0])
+    else:
+        print('Usage: python <wit.py> daemon <start | stop | run>')
+
+
+COMMANDS: Dict[str, Callable[[List[str]], None]] = {
+    'init': run_init, 'add': run_add, 'commit': run_commit,
+    'status': run_status, 'checkout': run_checkout, 'rm': run_rm,
+    'graph': run_graph, 'branch': run_branch, 'merge': run_merge,
+    'gc': run_gc, 'daemon': run_daemon, 'log': run_log, 'diff': run_diff,
+    'prune': run_prune, 'push': run_push, 'pull': run_pull, 'clone': run_clone,
+}
+
+
+def pop_option(argv: List[str], option: str) -> Optional[str]:
+    """Remove `option` and its value from `argv`, and return the value."""
+    for position, arg in enumerate(argv):
+        if arg == option and position + 1 < len(argv):
+            del argv[position]
+            return argv.pop(position)
+        if arg.startswith(f'{option}='):
+            del argv[position]
+            return arg.split('=', 1)[1]
+    return None
+
+
+def main(argv: List[str]) -> None:
+    """Run the command named in `argv` with the rest of `argv` as its parameters."""
+    jobs = pop_option(argv, '--jobs')
+    if jobs is not None:
+        if not jobs.isdigit() or int(jobs) < 1:
+            print('Usage: python <wit.py> --jobs <N> <function name> [parameters]')
+            return
+        utilities.JOBS = int(jobs)
+    if '--link' in argv:
+        argv.remove('--link')
+        utilities.LINK_OBJECTS = True
+    if '--verbose' in argv:
+        argv.remove('--verbose')
+        utilities.VERBOSE = True
+    trace_path = pop_option(argv, '--trace')
+    print_timings = '--timings' in argv
+    if print_timings:
+        argv.remove('--timings')
+    trace_funcs.ENABLED = print_timings or trace_path is not None
+    if not argv or argv[0] not in COMMANDS or len(argv) > 2 and argv[0] not in ('commit', 'graph', 'log', 'diff', 'prune', 'push', 'pull', 'clone'):
+        utilities.print_help()
+        return
+    try:
+        with trace_funcs.phase(f'command {argv[0]}'):
+            COMMANDS[argv[0]](argv[1:])
+    finally:
+        if trace_funcs.ENABLED:
+            trace_funcs.report(print_timings, trace_path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])